@@ -0,0 +1,408 @@
+# lab/bench/loadgen.py
+"""
+Load generator for the stream server (lab.wb.server).
+- Starts N simulated camera clients, each on its own websocket
+- Frames come from a video file, an image folder or synthetic frames
+  (lab.bench.standin_models), JPEG-encoded once up front so the generator
+  itself stays cheap; every client sends them in a loop at --fps
+- Frames use the binary envelope (lab.wb.protocol), so every reply is matched
+  to its frame id and end-to-end latency is measured on this machine's clock
+- Reports end-to-end and server-side (latency_ms, queue_ms) p50/p95/p99,
+  achieved throughput, dropped frames and errors; --out writes JSON
+- --stages asks for the server's per-stage breakdown and reports it too
+Usage:
+    python -m lab.bench.loadgen --clients 8 --fps 10 --duration 30
+    python -m lab.bench.loadgen --clients 20 --video lobby.mp4 --out load.json
+    python -m lab.bench.loadgen --clients 4 --images ./faces --fps 5
+"""
+
+import argparse
+import asyncio
+import json
+import platform
+import random
+import sys
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+import websockets
+
+from lab.wb.metrics import STAGES
+from lab.wb.protocol import (
+    FLAG_JSON_RESPONSE,
+    FLAG_STAGE_TIMINGS,
+    FMT_JPEG,
+    FMT_JSON,
+    MSG_ERROR,
+    MSG_FLOW_CONTROL,
+    MSG_FRAME,
+    Envelope,
+    decode_result,
+    pack_message,
+    unpack_message,
+)
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp"}
+# ?fps= sent to the server is a bit above the send rate, so scheduling jitter
+# on this side does not show up as server rate limiting
+_RATE_HEADROOM = 1.25
+PERCENTILES = (50, 95, 99)
+
+
+# -------------------------------
+# Frame sources
+# -------------------------------
+def _encode(frames: List[np.ndarray], size, quality: int) -> List[bytes]:
+    jpegs = []
+    for frame in frames:
+        if size and frame.shape[1::-1] != tuple(size):
+            frame = cv2.resize(frame, tuple(size), interpolation=cv2.INTER_AREA)
+        ok, buf = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+        if ok:
+            jpegs.append(buf.tobytes())
+    return jpegs
+
+
+def video_frames(path: str, max_frames: int) -> List[np.ndarray]:
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        raise RuntimeError(f"Cannot open video: {path}")
+    frames = []
+    while len(frames) < max_frames:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frames.append(frame)
+    cap.release()
+    return frames
+
+
+def folder_frames(path: str, max_frames: int) -> List[np.ndarray]:
+    frames = []
+    for p in sorted(Path(path).iterdir()):
+        if p.suffix.lower() not in IMAGE_EXTENSIONS:
+            continue
+        frame = cv2.imread(str(p))
+        if frame is None:
+            print(f"[WARN] Cannot read image: {p}")
+            continue
+        frames.append(frame)
+        if len(frames) >= max_frames:
+            break
+    return frames
+
+
+def synthetic_frames(width: int, height: int, faces: int, count: int):
+    # onnx is only needed here, not for video/image sources
+    from lab.bench.standin_models import synthetic_frame
+
+    return [synthetic_frame(width, height, faces, seed=i) for i in range(count)]
+
+
+def load_frames(args) -> List[bytes]:
+    size = (args.width, args.height)
+    if args.video:
+        frames = video_frames(args.video, args.max_frames)
+        size = size if args.resize else None
+    elif args.images:
+        frames = folder_frames(args.images, args.max_frames)
+        size = size if args.resize else None
+    else:
+        frames = synthetic_frames(args.width, args.height, args.faces, 16)
+    jpegs = _encode(frames, size, args.quality)
+    if not jpegs:
+        raise RuntimeError("No frames to send")
+    avg_kb = sum(len(j) for j in jpegs) / len(jpegs) / 1024
+    print(f"[INFO] Loaded {len(jpegs)} frame(s), {avg_kb:.1f} KB average")
+    return jpegs
+
+
+# -------------------------------
+# Simulated camera
+# -------------------------------
+class ClientStats:
+    def __init__(self):
+        self.counts = Counter(
+            sent=0, answered=0, skipped=0, dropped=0, errors=0, flow_control=0
+        )
+        self.e2e_ms: List[float] = []
+        self.server_ms: List[float] = []
+        self.queue_ms: List[float] = []
+        self.stages_ms: Dict[str, List[float]] = {}
+        self.faces = 0
+        self.last_server_drops: Dict[str, int] = {}
+
+    def merge(self, other: "ClientStats") -> None:
+        self.counts.update(other.counts)
+        self.e2e_ms += other.e2e_ms
+        self.server_ms += other.server_ms
+        self.queue_ms += other.queue_ms
+        for stage, values in other.stages_ms.items():
+            self.stages_ms.setdefault(stage, []).extend(values)
+        self.faces += other.faces
+        for key, value in other.last_server_drops.items():
+            self.last_server_drops[key] = self.last_server_drops.get(key, 0) + value
+
+
+def _parse_reply(msg) -> Tuple[int, int, dict]:
+    """-> (message type, frame id, decoded dict); 0 type for legacy JSON."""
+    if isinstance(msg, str):
+        data = json.loads(msg)
+        kind = MSG_FLOW_CONTROL if data.get("type") == "flow_control" else 0
+        return kind, data.get("frame_id", 0), data
+    env, payload = unpack_message(msg)
+    if env.payload_format == FMT_JSON:
+        return env.msg_type, env.frame_id, json.loads(bytes(payload))
+    return env.msg_type, env.frame_id, decode_result(payload)
+
+
+async def camera_client(
+    index: int,
+    url: str,
+    jpegs: List[bytes],
+    fps: float,
+    start_at: float,
+    measure_from: float,
+    stop_at: float,
+    drain_s: float,
+    max_in_flight: int,
+    json_replies: bool,
+    stage_timings: bool,
+) -> ClientStats:
+    stats = ClientStats()
+    pending: Dict[int, float] = {}  # frame id -> capture time, unanswered
+    flags = FLAG_JSON_RESPONSE if json_replies else 0
+    if stage_timings:
+        flags |= FLAG_STAGE_TIMINGS
+    interval = 1.0 / fps
+    rng = random.Random(index)
+    server_fps = fps * _RATE_HEADROOM
+
+    await asyncio.sleep(max(0.0, start_at - time.time()))
+
+    def measured(ts: float) -> bool:
+        return measure_from <= ts <= stop_at
+
+    async def sender(ws):
+        # absolute schedule with a random phase: clients do not send in lockstep
+        next_due = time.time() + rng.uniform(0.0, interval)
+        frame_id, pos = 0, rng.randrange(len(jpegs))
+        while True:
+            await asyncio.sleep(max(0.0, next_due - time.time()))
+            next_due += interval
+            ts = time.time()
+            if ts > stop_at:
+                return
+            if len(pending) >= max_in_flight:
+                stats.counts["skipped"] += measured(ts)
+                continue
+            frame_id += 1
+            pos = (pos + 1) % len(jpegs)
+            pending[frame_id] = ts
+            env = Envelope(MSG_FRAME, FMT_JPEG, frame_id, ts, flags)
+            await ws.send(pack_message(env, jpegs[pos]))
+            stats.counts["sent"] += measured(ts)
+
+    async def receiver(ws):
+        async for msg in ws:
+            kind, frame_id, data = _parse_reply(msg)
+            if kind == MSG_FLOW_CONTROL:
+                stats.counts["flow_control"] += 1
+                continue
+            ts_capture = pending.pop(frame_id, None)
+            # replies come in frame order: older unanswered frames were dropped
+            for fid in [fid for fid in pending if fid < frame_id]:
+                stats.counts["dropped"] += measured(pending.pop(fid))
+            if ts_capture is None or not measured(ts_capture):
+                continue
+            if kind == MSG_ERROR or "error" in data:
+                stats.counts["errors"] += 1
+                continue
+            stats.counts["answered"] += 1
+            stats.e2e_ms.append((time.time() - ts_capture) * 1000.0)
+            stats.server_ms.append(data["latency_ms"])
+            stats.queue_ms.append(data["queue_ms"])
+            stats.faces += data["faces"]
+            for stage, ms in (data.get("stages") or {}).items():
+                stats.stages_ms.setdefault(stage, []).append(ms)
+            stats.last_server_drops = dict(data.get("dropped") or {})
+
+    try:
+        async with websockets.connect(
+            f"{url}?fps={server_fps:g}", max_size=8 * 1024 * 1024
+        ) as ws:
+            recv_task = asyncio.create_task(receiver(ws))
+            send_task = asyncio.create_task(sender(ws))
+            try:
+                await send_task
+                # let in-flight frames come back before closing
+                deadline = time.time() + drain_s
+                while pending and time.time() < deadline and not recv_task.done():
+                    await asyncio.sleep(0.02)
+            finally:
+                recv_task.cancel()
+            stats.counts["dropped"] += sum(measured(ts) for ts in pending.values())
+    except (OSError, websockets.WebSocketException) as exc:
+        print(f"[WARN] client {index}: {exc!r}")
+        stats.counts["errors"] += 1
+    return stats
+
+
+# -------------------------------
+# Report
+# -------------------------------
+def _percentiles(values: List[float]) -> Dict[str, Optional[float]]:
+    if not values:
+        return {f"p{p}": None for p in PERCENTILES} | {"mean": None}
+    arr = np.asarray(values)
+    out = {f"p{p}": round(float(np.percentile(arr, p)), 2) for p in PERCENTILES}
+    out["mean"] = round(float(arr.mean()), 2)
+    return out
+
+
+def summarize(total: ClientStats, clients: int, fps: float, seconds: float) -> dict:
+    c = total.counts
+    return {
+        "clients": clients,
+        "fps_per_client": fps,
+        "measured_s": round(seconds, 2),
+        "offered_fps": round(clients * fps, 2),
+        "sent_fps": round(c["sent"] / seconds, 2),
+        "throughput_fps": round(c["answered"] / seconds, 2),
+        "counts": dict(c),
+        "drop_ratio": round(c["dropped"] / c["sent"], 4) if c["sent"] else 0.0,
+        "server_drops": total.last_server_drops,
+        "faces_per_frame": (
+            round(total.faces / c["answered"], 2) if c["answered"] else 0.0
+        ),
+        "e2e_ms": _percentiles(total.e2e_ms),
+        "server_ms": _percentiles(total.server_ms),
+        "queue_ms": _percentiles(total.queue_ms),
+        "stages_ms": {
+            stage: _percentiles(total.stages_ms[stage])
+            for stage in STAGES
+            if stage in total.stages_ms
+        },
+    }
+
+
+def print_summary(summary: dict) -> None:
+    c = summary["counts"]
+    print(
+        f"[INFO] {summary['clients']} client(s) x {summary['fps_per_client']} fps "
+        f"over {summary['measured_s']} s: offered {summary['offered_fps']} fps, "
+        f"sent {summary['sent_fps']} fps, answered {summary['throughput_fps']} fps"
+    )
+    print(
+        f"[INFO] sent={c['sent']} answered={c['answered']} dropped={c['dropped']} "
+        f"({summary['drop_ratio']:.1%}) skipped={c['skipped']} errors={c['errors']} "
+        f"flow_control={c['flow_control']} faces/frame={summary['faces_per_frame']}"
+    )
+    rows = [(name, summary[name]) for name in ("e2e_ms", "server_ms", "queue_ms")]
+    rows += [(f"  {stage}", p) for stage, p in summary["stages_ms"].items()]
+    for name, p in rows:
+        if p["p50"] is None:
+            print(f"[INFO] {name:<12} no replies")
+            continue
+        print(
+            f"[INFO] {name:<12} p50={p['p50']:>8.1f}  p95={p['p95']:>8.1f}  "
+            f"p99={p['p99']:>8.1f}  mean={p['mean']:>8.1f}"
+        )
+
+
+# -------------------------------
+# Main
+# -------------------------------
+async def run(args, jpegs: List[bytes]) -> dict:
+    now = time.time()
+    # connects are spread over the ramp-up; warmup starts once all are sending
+    measure_from = now + args.ramp_up + args.warmup
+    stop_at = measure_from + args.duration
+    tasks = [
+        camera_client(
+            i,
+            args.url,
+            jpegs,
+            args.fps,
+            now + args.ramp_up * i / args.clients,
+            measure_from,
+            stop_at,
+            args.drain,
+            args.max_in_flight,
+            args.json,
+            args.stages,
+        )
+        for i in range(args.clients)
+    ]
+    total = ClientStats()
+    for stats in await asyncio.gather(*tasks):
+        total.merge(stats)
+    return summarize(total, args.clients, args.fps, args.duration)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Stream server load generator")
+    parser.add_argument("--url", default="ws://localhost:8765/stream")
+    parser.add_argument("--clients", type=int, default=4)
+    parser.add_argument("--fps", type=float, default=10.0, help="per client")
+    parser.add_argument("--duration", type=float, default=30.0, help="measured seconds")
+    parser.add_argument("--ramp-up", type=float, default=2.0, help="connect spread")
+    parser.add_argument(
+        "--warmup", type=float, default=3.0, help="unmeasured seconds after ramp-up"
+    )
+    parser.add_argument(
+        "--drain", type=float, default=5.0, help="max wait for late replies"
+    )
+    parser.add_argument("--max-in-flight", type=int, default=3)
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--video", default="", help="video file to loop")
+    source.add_argument("--images", default="", help="folder of images to loop")
+    parser.add_argument("--max-frames", type=int, default=300)
+    parser.add_argument("--width", type=int, default=640)
+    parser.add_argument("--height", type=int, default=480)
+    parser.add_argument(
+        "--resize",
+        action="store_true",
+        help="resize video/image frames to --width x --height",
+    )
+    parser.add_argument("--faces", type=int, default=3, help="synthetic frames")
+    parser.add_argument("--quality", type=int, default=80)
+    parser.add_argument(
+        "--json", action="store_true", help="ask for JSON replies (debugging)"
+    )
+    parser.add_argument(
+        "--stages", action="store_true", help="collect per-stage server timings"
+    )
+    parser.add_argument("--out", default="", help="write the summary JSON here")
+    args = parser.parse_args(argv)
+    if args.clients < 1 or args.fps <= 0:
+        parser.error("--clients and --fps must be positive")
+
+    jpegs = load_frames(args)
+    summary = asyncio.run(run(args, jpegs))
+    print_summary(summary)
+
+    if args.out:
+        report = {
+            "meta": {
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "url": args.url,
+                "source": args.video or args.images or "synthetic",
+                "frames": len(jpegs),
+                "quality": args.quality,
+                "platform": platform.platform(),
+            },
+            "summary": summary,
+        }
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"[INFO] Wrote {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,401 @@
+# lab/bench/microbench.py
+"""
+Microbenchmarks for the face pipeline hot paths.
+- preprocess: preprocess_for_onnx (per frame) vs the reusable Preprocessor
+- detect:     detect_faces per frame vs detect_faces_batch
+- decode:     decode_scrfd_outputs on raw detector outputs
+- embed:      get_face_embedding per crop vs get_face_embeddings_batch
+- match:      per-record cosine loop vs GalleryIndex vs IVFIndex
+- parse:      CSV embedding parse vs binary decode (per record and batched)
+Runs offline on stand-in models (lab.bench.standin_models) unless
+--models real is given. Results are written as JSON; --compare prints the
+change against an earlier result file.
+Usage:
+    python -m lab.bench.microbench --out bench.json
+    python -m lab.bench.microbench --quick --compare bench_main.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+import onnxruntime as ort
+
+from lab.bench.standin_models import synthetic_frame, write_standins
+from lab.db.embedding_codec import decode_embedding, decode_embeddings, encode_embedding
+from lab.face.ann_index import IVFIndex, synthetic_gallery
+from lab.face.models_config import (
+    CONF_THRESHOLD,
+    DETECTION_MODEL_PATH,
+    EMBEDDING_MODEL_PATH,
+    TARGET_DETECTION_SIZE,
+)
+from lab.face.pipeline import (
+    align_face,
+    cosine_similarity,
+    create_session,
+    decode_scrfd_outputs,
+    detect_faces,
+    detect_faces_batch,
+    get_face_embedding,
+    get_face_embeddings_batch,
+    preprocess_for_onnx,
+)
+from lab.face.preprocess import Preprocessor
+
+RESOLUTIONS = [(640, 480), (1280, 720), (1920, 1080)]
+BATCH_SIZES = [1, 4, 8, 16]
+GALLERY_SIZES = [1_000, 10_000, 100_000]
+FACES_PER_FRAME = 3
+LOOP_MATCH_MAX_N = 20_000  # the per-record Python loop gets too slow beyond this
+
+QUICK = {
+    "resolutions": [(640, 480), (1280, 720)],
+    "batches": [1, 8],
+    "gallery_sizes": [1_000, 10_000],
+    "repeats": 5,
+}
+
+
+# -------------------------------
+# Timing
+# -------------------------------
+def measure(
+    fn: Callable, items: int = 1, repeats: int = 20, warmup: int = 2
+) -> Dict[str, float]:
+    """Wall time of `fn()` over `repeats` runs; throughput is items/second."""
+    for _ in range(warmup):
+        fn()
+    times = np.empty(repeats)
+    for i in range(repeats):
+        t0 = time.perf_counter()
+        fn()
+        times[i] = time.perf_counter() - t0
+    mean = float(times.mean())
+    return {
+        "ms_mean": round(mean * 1000.0, 4),
+        "ms_p50": round(float(np.percentile(times, 50)) * 1000.0, 4),
+        "ms_p95": round(float(np.percentile(times, 95)) * 1000.0, 4),
+        "ms_min": round(float(times.min()) * 1000.0, 4),
+        "items_per_s": round(items / mean, 2) if mean > 0 else 0.0,
+    }
+
+
+class Results:
+    def __init__(self, repeats: int):
+        self.repeats = repeats
+        self.rows: List[dict] = []
+
+    def add(self, stage: str, variant: str, params: dict, fn, items=1, repeats=None):
+        stats = measure(fn, items, repeats or self.repeats)
+        row = {"stage": stage, "variant": variant, "params": params, **stats}
+        self.rows.append(row)
+        print(
+            f"{stage:<10} {variant:<26} {_fmt_params(params):<40} "
+            f"{stats['ms_mean']:>10.3f} ms {stats['items_per_s']:>12.1f}/s"
+        )
+        return row
+
+
+def _fmt_params(params: dict) -> str:
+    return " ".join(f"{k}={v}" for k, v in params.items())
+
+
+def _res(size) -> str:
+    return f"{size[0]}x{size[1]}"
+
+
+# -------------------------------
+# Stages
+# -------------------------------
+def bench_preprocess(res: Results, resolutions, batches) -> None:
+    prep = Preprocessor(TARGET_DETECTION_SIZE)
+    for size in resolutions:
+        for b in batches:
+            frames = [synthetic_frame(*size, FACES_PER_FRAME, seed=i) for i in range(b)]
+            params = {"res": _res(size), "batch": b}
+            res.add(
+                "preprocess",
+                "preprocess_for_onnx",
+                params,
+                lambda: np.concatenate(
+                    [preprocess_for_onnx(f, TARGET_DETECTION_SIZE) for f in frames]
+                ),
+                items=b,
+            )
+            res.add("preprocess", "Preprocessor", params, lambda: prep(frames), b)
+
+
+def bench_detect(res: Results, det, resolutions, batches) -> None:
+    for size in resolutions:
+        frame = synthetic_frame(*size, FACES_PER_FRAME)
+        res.add(
+            "detect",
+            "detect_faces",
+            {"res": _res(size)},
+            lambda: detect_faces(det, frame),
+        )
+        for b in batches:
+            if b == 1:
+                continue
+            frames = [frame] * b
+            res.add(
+                "detect",
+                "detect_faces_batch",
+                {"res": _res(size), "batch": b},
+                lambda: detect_faces_batch(det, frames),
+                items=b,
+            )
+
+
+def bench_decode(res: Results, det) -> None:
+    name = det.get_inputs()[0].name
+    for faces in (0, FACES_PER_FRAME, 20):
+        frame = synthetic_frame(*RESOLUTIONS[0], faces)
+        inp = preprocess_for_onnx(frame, TARGET_DETECTION_SIZE)
+        outputs = det.run(None, {name: inp})
+        res.add(
+            "decode",
+            "decode_scrfd_outputs",
+            {"faces": faces},
+            lambda: decode_scrfd_outputs(
+                outputs, CONF_THRESHOLD, TARGET_DETECTION_SIZE
+            ),
+        )
+
+
+def bench_embed(res: Results, emb, batches) -> None:
+    rng = np.random.default_rng(0)
+    for b in batches:
+        crops = [rng.integers(0, 256, (140, 120, 3), dtype=np.uint8) for _ in range(b)]
+        aligned = [align_face(c) for c in crops]
+        params = {"batch": b}
+        res.add(
+            "embed",
+            "get_face_embedding",
+            params,
+            lambda: [get_face_embedding(emb, c) for c in crops],
+            items=b,
+        )
+        res.add(
+            "embed",
+            "get_face_embeddings_batch",
+            params,
+            lambda: get_face_embeddings_batch(emb, aligned),
+            items=b,
+        )
+
+
+def bench_match(res: Results, gallery_sizes, queries: int = 8) -> None:
+    for n in gallery_sizes:
+        base, q = synthetic_gallery(n, queries)
+        params = {"gallery": n, "queries": queries}
+        if n <= LOOP_MATCH_MAX_N:
+            # the original server loop: one cosine per stored record
+            records = list(zip(base.ids, base.profile_ids, base.matrix))
+
+            def loop_match():
+                for vec in q:
+                    best = (-1.0, None, None)
+                    for rec_id, prof_id, emb_g in records:
+                        sim = cosine_similarity(vec, emb_g)
+                        if sim > best[0]:
+                            best = (sim, rec_id, prof_id)
+
+            res.add("match", "cosine_loop", params, loop_match, queries, repeats=3)
+        res.add(
+            "match",
+            "GalleryIndex.best_match",
+            params,
+            lambda: [base.best_match(v) for v in q],
+            queries,
+        )
+        res.add(
+            "match",
+            "GalleryIndex.best_matches",
+            params,
+            lambda: base.best_matches(q),
+            queries,
+        )
+        ivf = IVFIndex.train(base, iters=5)
+        res.add(
+            "match",
+            "IVFIndex.search",
+            {**params, "nlist": ivf.nlist, "nprobe": ivf.nprobe},
+            lambda: ivf.search(q, 1),
+            queries,
+        )
+
+
+def bench_parse(res: Results, gallery_sizes) -> None:
+    rng = np.random.default_rng(0)
+    for n in gallery_sizes:
+        vecs = rng.standard_normal((n, 512)).astype(np.float32)
+        csv = [",".join(map(str, v.tolist())) for v in vecs]
+        blobs = [encode_embedding(v) for v in vecs]
+        params = {"records": n}
+        res.add(
+            "parse",
+            "csv_fromstring",
+            params,
+            lambda: [np.fromstring(s, sep=",") for s in csv],
+            n,
+            repeats=3,
+        )
+        res.add(
+            "parse",
+            "decode_embedding",
+            params,
+            lambda: [decode_embedding(b) for b in blobs],
+            n,
+        )
+        res.add(
+            "parse", "decode_embeddings", params, lambda: decode_embeddings(blobs), n
+        )
+
+
+# -------------------------------
+# Setup / reporting
+# -------------------------------
+def load_sessions(models: str, workdir: Path):
+    """(detector, embedder) sessions: real models or freshly written stand-ins."""
+    if models == "real":
+        return (
+            create_session(DETECTION_MODEL_PATH, "SCRFD model"),
+            create_session(EMBEDDING_MODEL_PATH, "ArcFace model"),
+        )
+    scrfd, _, arcface = write_standins(workdir)
+    return (
+        create_session(str(scrfd), "stand-in SCRFD", use_cache=False),
+        create_session(str(arcface), "stand-in ArcFace", use_cache=False),
+    )
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=Path(__file__).resolve().parent,
+        )
+        return out.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def metadata(models: str) -> dict:
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": _git_commit(),
+        "models": models,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "onnxruntime": ort.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def _key(row: dict) -> str:
+    return f"{row['stage']}|{row['variant']}|{_fmt_params(row['params'])}"
+
+
+def compare(current: List[dict], baseline_path: str, threshold_pct: float) -> int:
+    """
+    Print mean-latency change per benchmark against a previous result file.
+    Returns how many benchmarks got slower by more than `threshold_pct`.
+    """
+    with open(baseline_path) as f:
+        baseline = {_key(r): r for r in json.load(f)["results"]}
+    print(f"\n[INFO] Change vs {baseline_path} (mean latency, + is slower)")
+    regressions = 0
+    for row in current:
+        old = baseline.get(_key(row))
+        if old is None or not old["ms_mean"]:
+            continue
+        change = (row["ms_mean"] / old["ms_mean"] - 1.0) * 100.0
+        flag = ""
+        if change > threshold_pct:
+            regressions += 1
+            flag = "  <-- slower"
+        print(f"{_key(row):<70} {change:>+8.1f}%{flag}")
+    return regressions
+
+
+STAGES = ["preprocess", "detect", "decode", "embed", "match", "parse"]
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Face pipeline microbenchmarks")
+    parser.add_argument("--models", choices=["standin", "real"], default="standin")
+    parser.add_argument("--stages", default=",".join(STAGES))
+    parser.add_argument("--quick", action="store_true", help="small grid for CI")
+    parser.add_argument("--repeats", type=int, default=20)
+    parser.add_argument("--out", default="", help="write results JSON here")
+    parser.add_argument("--compare", default="", help="earlier results JSON")
+    parser.add_argument(
+        "--threshold-pct",
+        type=float,
+        default=10.0,
+        help="slowdown that counts as a regression in --compare",
+    )
+    parser.add_argument(
+        "--fail-on-regression",
+        action="store_true",
+        help="exit 1 if --compare finds a regression (CI)",
+    )
+    args = parser.parse_args(argv)
+
+    resolutions, batches, gallery_sizes = RESOLUTIONS, BATCH_SIZES, GALLERY_SIZES
+    repeats = args.repeats
+    if args.quick:
+        resolutions, batches = QUICK["resolutions"], QUICK["batches"]
+        gallery_sizes, repeats = QUICK["gallery_sizes"], QUICK["repeats"]
+    stages = [s for s in args.stages.split(",") if s]
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        parser.error(f"unknown stages: {sorted(unknown)}")
+
+    res = Results(repeats)
+    with tempfile.TemporaryDirectory() as tmp:
+        det = emb = None
+        if {"detect", "decode", "embed"} & set(stages):
+            det, emb = load_sessions(args.models, Path(tmp))
+        if "preprocess" in stages:
+            bench_preprocess(res, resolutions, batches)
+        if "detect" in stages:
+            bench_detect(res, det, resolutions, batches)
+        if "decode" in stages:
+            bench_decode(res, det)
+        if "embed" in stages:
+            bench_embed(res, emb, batches)
+        if "match" in stages:
+            bench_match(res, gallery_sizes)
+        if "parse" in stages:
+            bench_parse(res, gallery_sizes)
+
+    report = {"meta": metadata(args.models), "results": res.rows}
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"[INFO] Wrote {len(res.rows)} results -> {args.out}")
+    if args.compare:
+        regressions = compare(res.rows, args.compare, args.threshold_pct)
+        if regressions and args.fail_on_regression:
+            print(f"[ERROR] {regressions} benchmark(s) regressed")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
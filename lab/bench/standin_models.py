@@ -0,0 +1,195 @@
+# lab/bench/standin_models.py
+"""
+Small stand-in ONNX models with the production input/output signatures.
+- SCRFD: input (N,3,H,W) float32; per stride 8/16/32 and 2 anchors per cell,
+  scores (-1,1), box distances (-1,4), landmarks (-1,10)
+  A cell scores high when its patch is bright, so a synthetic frame with K
+  bright squares on a dark background yields about K faces after NMS
+- ArcFace: input (N,3,112,112) float32 -> (N,512) embedding
+Used by the benchmarks (and CI) when lab/face/models/ is not available.
+Usage:
+    python -m lab.bench.standin_models --out /tmp/standin_models
+"""
+
+import argparse
+from pathlib import Path
+from typing import Tuple
+
+import numpy as np
+import onnx
+from onnx import TensorProto, helper, numpy_helper
+
+from lab.face.models_config import ARCFACE_INPUT_SIZE, TARGET_DETECTION_SIZE
+
+SCRFD_STRIDES = (8, 16, 32)
+SCRFD_ANCHORS = 2
+FACE_HALF_SIZE = 32  # px; every stand-in detection is a 64x64 box
+_OPSET = 13
+
+
+def _save(graph, path: Path) -> Path:
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", _OPSET)])
+    model.ir_version = 8  # loadable by older onnxruntime builds
+    onnx.checker.check_model(model)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    onnx.save(model, str(path))
+    return path
+
+
+def make_scrfd(path: Path, batch="N") -> Path:
+    """SCRFD-like detector; `batch` is a fixed int or a symbolic name."""
+    nodes, inits, outputs = [], [], {1: [], 4: [], 10: []}
+    base = SCRFD_STRIDES[0]
+    nodes.append(
+        helper.make_node(
+            "AveragePool",
+            ["input"],
+            ["pool_base"],
+            kernel_shape=[base, base],
+            strides=[base, base],
+        )
+    )
+    for s in SCRFD_STRIDES:
+        # face-sized window centred on each anchor: the score peaks at the
+        # centre of a bright square, so NMS leaves one box per square
+        k, half, step = 2 * FACE_HALF_SIZE // base, FACE_HALF_SIZE // base, s // base
+        nodes.append(
+            helper.make_node(
+                "AveragePool",
+                ["pool_base"],
+                [f"pool{s}"],
+                kernel_shape=[k, k],
+                strides=[step, step],
+                pads=[half] * 2 + [k - step - half] * 2,
+            )
+        )
+        for dim in (1, 4, 10):
+            channels = SCRFD_ANCHORS * dim
+            if dim == 1:
+                # logit = 40 * (mean intensity - 0.65); input is in [0, 1]
+                weight = np.full((channels, 3, 1, 1), 40.0 / 3.0, np.float32)
+                bias = np.full(channels, -26.0, np.float32)
+            elif dim == 4:
+                # constant distances (l, t, r, b) in stride units
+                weight = np.zeros((channels, 3, 1, 1), np.float32)
+                bias = np.full(channels, FACE_HALF_SIZE / s, np.float32)
+            else:
+                # eyes, nose, mouth corners relative to the anchor centre
+                pts = np.array(
+                    [[-12, -8], [12, -8], [0, 4], [-10, 16], [10, 16]], np.float32
+                )
+                weight = np.zeros((channels, 3, 1, 1), np.float32)
+                bias = np.tile(pts.reshape(-1) / s, SCRFD_ANCHORS).astype(np.float32)
+            name = f"{('score', 'bbox', 'kps')[(1, 4, 10).index(dim)]}_{s}"
+            inits += [
+                numpy_helper.from_array(weight, f"{name}_w"),
+                numpy_helper.from_array(bias, f"{name}_b"),
+                numpy_helper.from_array(np.array([-1, dim], np.int64), f"{name}_shape"),
+            ]
+            src = f"{name}_conv"
+            nodes.append(
+                helper.make_node("Conv", [f"pool{s}", f"{name}_w", f"{name}_b"], [src])
+            )
+            if dim == 1:
+                nodes.append(helper.make_node("Sigmoid", [src], [f"{name}_sig"]))
+                src = f"{name}_sig"
+            nodes.append(
+                helper.make_node("Transpose", [src], [f"{name}_t"], perm=[0, 2, 3, 1])
+            )
+            nodes.append(
+                helper.make_node("Reshape", [f"{name}_t", f"{name}_shape"], [name])
+            )
+            outputs[dim].append(
+                helper.make_tensor_value_info(name, TensorProto.FLOAT, [None, dim])
+            )
+
+    graph = helper.make_graph(
+        nodes,
+        "scrfd_standin",
+        [
+            helper.make_tensor_value_info(
+                "input", TensorProto.FLOAT, [batch, 3, "h", "w"]
+            )
+        ],
+        outputs[1] + outputs[4] + outputs[10],
+        inits,
+    )
+    return _save(graph, path)
+
+
+def make_arcface(path: Path, batch="N", dim: int = 512, seed: int = 0) -> Path:
+    """Two strided convs + global pooling + projection to `dim`."""
+    rng = np.random.default_rng(seed)
+    w, h = ARCFACE_INPUT_SIZE
+    inits = [
+        numpy_helper.from_array(
+            (rng.standard_normal((32, 3, 3, 3)) * 0.2).astype(np.float32), "c1_w"
+        ),
+        numpy_helper.from_array(
+            (rng.standard_normal((64, 32, 3, 3)) * 0.05).astype(np.float32), "c2_w"
+        ),
+        numpy_helper.from_array(
+            rng.standard_normal((64, dim)).astype(np.float32), "proj_w"
+        ),
+    ]
+    nodes = [
+        helper.make_node("Conv", ["input", "c1_w"], ["c1"], strides=[2, 2]),
+        helper.make_node("Relu", ["c1"], ["r1"]),
+        helper.make_node("Conv", ["r1", "c2_w"], ["c2"], strides=[2, 2]),
+        helper.make_node("Relu", ["c2"], ["r2"]),
+        helper.make_node("GlobalAveragePool", ["r2"], ["gap"]),
+        helper.make_node("Flatten", ["gap"], ["flat"]),
+        helper.make_node("MatMul", ["flat", "proj_w"], ["embedding"]),
+    ]
+    graph = helper.make_graph(
+        nodes,
+        "arcface_standin",
+        [helper.make_tensor_value_info("input", TensorProto.FLOAT, [batch, 3, h, w])],
+        [helper.make_tensor_value_info("embedding", TensorProto.FLOAT, [batch, dim])],
+        inits,
+    )
+    return _save(graph, path)
+
+
+def write_standins(out_dir: Path) -> Tuple[Path, Path, Path]:
+    """scrfd.onnx, det_10g.onnx (same graph) and w600k_r50.onnx in `out_dir`."""
+    out_dir = Path(out_dir)
+    return (
+        make_scrfd(out_dir / "scrfd.onnx"),
+        make_scrfd(out_dir / "det_10g.onnx"),
+        make_arcface(out_dir / "w600k_r50.onnx"),
+    )
+
+
+# -------------------------------
+# Synthetic frames
+# -------------------------------
+def synthetic_frame(
+    width: int, height: int, faces: int = 3, seed: int = 0
+) -> np.ndarray:
+    """
+    Dark noisy BGR frame with `faces` bright, non-overlapping rectangles,
+    sized to be 64x64 once the frame is resized to the detector input.
+    """
+    rng = np.random.default_rng(seed)
+    frame = rng.integers(0, 40, (height, width, 3), dtype=np.uint8)
+    in_w, in_h = TARGET_DETECTION_SIZE
+    fw = round(2 * FACE_HALF_SIZE * width / in_w)
+    fh = round(2 * FACE_HALF_SIZE * height / in_h)
+    cols = max(1, (width - fw // 2) // (2 * fw))
+    for i in range(faces):
+        row, col = divmod(i, cols)
+        x = fw // 2 + col * 2 * fw
+        y = fh // 2 + row * 2 * fh
+        if y + fh > height:
+            break
+        frame[y : y + fh, x : x + fw] = rng.integers(200, 256, 3, dtype=np.uint8)
+    return frame
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write stand-in ONNX models")
+    parser.add_argument("--out", default="bench_models", help="output directory")
+    args = parser.parse_args()
+    for p in write_standins(Path(args.out)):
+        print(f"[INFO] Wrote {p}")
@@ -1,9 +1,21 @@
 # lab/db/create_db.py
+"""
+Create the lab database tables, plus any indexes added to the models since
+an existing database was created.
+Usage:
+    python -m lab.db.create_db
+"""
+
+import lab.db.models  # noqa: F401  (registers the tables on Base.metadata)
 from lab.db.test_database import Base, engine
 
 
 def init_db():
     Base.metadata.create_all(bind=engine)
+    # create_all skips tables that already exist, including their new indexes
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
     print("[INFO] Test database initialized.")
 
 
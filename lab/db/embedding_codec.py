@@ -0,0 +1,71 @@
+# lab/db/embedding_codec.py
+"""
+Binary codec for FaceEmbedding.embedding.
+- Vectors are stored as raw little-endian float32 (2048 bytes for 512-dim)
+- Optional float16 mode halves storage (1024 bytes); dtype is inferred from length
+- Legacy comma-separated strings are still readable until migrated
+"""
+
+from typing import Iterable, Optional, Union
+
+import numpy as np
+
+EMBEDDING_DIM = 512
+EMBEDDING_STORAGE_DTYPE = "float32"  # "float32" | "float16"
+
+_DTYPES = {
+    "float32": np.dtype("<f4"),
+    "float16": np.dtype("<f2"),
+}
+_BY_NBYTES = {EMBEDDING_DIM * dt.itemsize: dt for dt in _DTYPES.values()}
+
+
+def _storage_dtype(dtype: Optional[str]) -> np.dtype:
+    name = dtype or EMBEDDING_STORAGE_DTYPE
+    if name not in _DTYPES:
+        raise ValueError(f"Unsupported embedding storage dtype: {name}")
+    return _DTYPES[name]
+
+
+def encode_embedding(vec: np.ndarray, dtype: Optional[str] = None) -> bytes:
+    """Serialize a 512-dim vector to raw float32 (or float16) bytes."""
+    arr = np.asarray(vec).reshape(-1)
+    if arr.shape[0] != EMBEDDING_DIM:
+        raise ValueError(f"Expected {EMBEDDING_DIM}-dim embedding, got {arr.shape[0]}")
+    return arr.astype(_storage_dtype(dtype), copy=False).tobytes()
+
+
+def decode_embedding(value: Union[bytes, memoryview, str]) -> np.ndarray:
+    """
+    Deserialize a stored embedding to a (512,) float32 array.
+    float32 blobs are decoded zero-copy (read-only view on the bytes);
+    float16 blobs are upcast, and legacy CSV strings are parsed.
+    """
+    if isinstance(value, str):
+        return np.array(value.split(","), dtype=np.float32)
+
+    buf = memoryview(value)
+    dt = _BY_NBYTES.get(buf.nbytes)
+    if dt is None:
+        raise ValueError(f"Unexpected embedding blob size: {buf.nbytes} bytes")
+    arr = np.frombuffer(buf, dtype=dt)
+    return arr if dt == _DTYPES["float32"] else arr.astype(np.float32)
+
+
+def decode_embeddings(values: Iterable[Union[bytes, memoryview, str]]) -> np.ndarray:
+    """
+    Deserialize many stored embeddings into one (N,512) float32 matrix.
+    Uniform float32 blobs are joined and decoded with a single frombuffer.
+    """
+    values = list(values)
+    if not values:
+        return np.zeros((0, EMBEDDING_DIM), dtype=np.float32)
+
+    f32_nbytes = EMBEDDING_DIM * 4
+    if all(
+        not isinstance(v, str) and memoryview(v).nbytes == f32_nbytes for v in values
+    ):
+        joined = b"".join(values)
+        return np.frombuffer(joined, dtype="<f4").reshape(len(values), EMBEDDING_DIM)
+
+    return np.stack([decode_embedding(v) for v in values])
@@ -0,0 +1,54 @@
+# lab/db/migrate_embeddings.py
+"""
+Convert legacy CSV-string embeddings in face_embeddings to binary blobs in place.
+Usage:
+    python -m lab.db.migrate_embeddings            # float32 blobs
+    python -m lab.db.migrate_embeddings --float16  # half-size blobs
+"""
+
+import argparse
+
+from sqlalchemy import text
+
+from lab.db.embedding_codec import decode_embedding, encode_embedding
+from lab.db.test_database import engine
+
+CHUNK_SIZE = 1000
+
+
+def migrate(dtype: str = "float32", chunk_size: int = CHUNK_SIZE) -> int:
+    """Rewrite every text-typed embedding row as a blob. Returns rows converted."""
+    converted = 0
+    select_sql = text(
+        "SELECT id, embedding FROM face_embeddings "
+        "WHERE typeof(embedding) = 'text' ORDER BY id LIMIT :n"
+    )
+    update_sql = text("UPDATE face_embeddings SET embedding = :emb WHERE id = :id")
+
+    while True:
+        # one transaction per chunk keeps the write lock short
+        with engine.begin() as conn:
+            rows = conn.execute(select_sql, {"n": chunk_size}).fetchall()
+            if not rows:
+                break
+            params = [
+                {
+                    "id": row.id,
+                    "emb": encode_embedding(decode_embedding(row.embedding), dtype),
+                }
+                for row in rows
+            ]
+            conn.execute(update_sql, params)
+        converted += len(rows)
+        print(f"[INFO] Converted {converted} row(s)...")
+
+    print(f"[INFO] Migration done: {converted} row(s) converted to {dtype} blobs.")
+    return converted
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--float16", action="store_true", help="store as float16")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    args = parser.parse_args()
+    migrate("float16" if args.float16 else "float32", args.chunk_size)
@@ -1,7 +1,7 @@
 # lab/db/models.py
 from datetime import datetime
 
-from sqlalchemy import Column, DateTime, Float, Integer, String
+from sqlalchemy import Column, DateTime, Float, Integer, LargeBinary
 
 from lab.db.test_database import Base
 
@@ -10,7 +10,26 @@ class FaceEmbedding(Base):
     __tablename__ = "face_embeddings"
 
     id = Column(Integer, primary_key=True, index=True)
-    profile_id = Column(Integer, nullable=False)
-    embedding = Column(String, nullable=False)
+    profile_id = Column(Integer, nullable=False, index=True)
+    embedding = Column(LargeBinary, nullable=False)  # see lab.db.embedding_codec
     confidence = Column(Float, default=0.0)
-    created_at = Column(DateTime, default=datetime.utcnow)
+    # watermark for incremental gallery refreshes (lab.face.gallery_cache)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+
+class ProfileTemplate(Base):
+    """
+    Search templates per profile (see lab.face.templates).
+    kind 0: sum of the profile's unit embeddings (normalize -> centroid), so
+            adding or removing an embedding is one vector add/subtract
+    kind 1: k-medoid sub-template (a unit embedding of the profile)
+    """
+
+    __tablename__ = "profile_templates"
+
+    id = Column(Integer, primary_key=True, index=True)
+    profile_id = Column(Integer, nullable=False, index=True)
+    kind = Column(Integer, nullable=False, default=0)
+    embedding = Column(LargeBinary, nullable=False)  # see lab.db.embedding_codec
+    source_count = Column(Integer, nullable=False, default=0)  # embeddings summed
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -1,13 +1,79 @@
 # lab/db/test_database.py
-from sqlalchemy import create_engine
-from sqlalchemy.orm import declarative_base, sessionmaker
+"""
+Engine and sessions for the lab SQLite database.
+- Every connection gets WAL journaling and the pragmas below, so readers
+  (live matching) and a writer (enrollment) do not block each other, and a
+  second writer waits (busy_timeout) instead of failing with "database is locked"
+- `session_scope()` for synchronous code; asyncio code hands DB work to
+  `run_db_blocking()`, which runs it on a small DB thread pool, never on the loop
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Callable, Iterator, TypeVar
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import Session, declarative_base, sessionmaker
 
 # SQLite برای سادگی
 SQLALCHEMY_DATABASE_URL = "sqlite:///lab/test_lab.db"
 
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",  # readers never wait for the writer
+    "synchronous": "NORMAL",  # safe with WAL; fsync at checkpoints only
+    "cache_size": -65536,  # KiB when negative -> 64 MB page cache
+    "temp_store": "MEMORY",
+    "mmap_size": 268435456,  # 256 MB memory-mapped reads
+    "busy_timeout": 5000,  # ms a writer waits for the lock before failing
+}
+DB_THREADS = 4  # run_db_blocking() worker threads
+
 engine = create_engine(
     SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
 )
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
+
+
+@event.listens_for(engine, "connect")
+def _set_sqlite_pragmas(dbapi_conn, _record) -> None:
+    cursor = dbapi_conn.cursor()
+    for name, value in SQLITE_PRAGMAS.items():
+        cursor.execute(f"PRAGMA {name}={value}")
+    cursor.close()
+
+
+# -------------------------------
+# Sessions
+# -------------------------------
+T = TypeVar("T")
+_executor = None  # ThreadPoolExecutor, created on first use
+
+
+@contextmanager
+def session_scope() -> Iterator[Session]:
+    """Session that commits on success, rolls back on error, always closes."""
+    db = SessionLocal()
+    try:
+        yield db
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+def db_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(DB_THREADS, thread_name_prefix="db")
+    return _executor
+
+
+async def run_db_blocking(fn: Callable[..., T], *args) -> T:
+    """Await a callable that manages its own sessions, on the DB thread pool."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(db_executor(), fn, *args)
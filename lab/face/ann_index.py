@@ -0,0 +1,318 @@
+# lab/face/ann_index.py
+"""
+IVF (inverted file) approximate nearest-neighbour index for large galleries.
+- Coarse quantizer: spherical k-means centroids over normalized embeddings
+- Each embedding lives in the inverted list of its nearest centroid
+- A query scores only the `nprobe` closest lists instead of the whole gallery
+Usage:
+    python -m lab.face.ann_index build                 # train from DB and save
+    python -m lab.face.ann_index report --synthetic 200000
+"""
+
+import argparse
+import time
+from pathlib import Path
+from typing import Optional, Tuple
+
+import numpy as np
+
+from lab.face.gallery import GalleryIndex, l2_normalize
+from lab.face.models_config import ANN_INDEX_PATH, IVF_NLIST, IVF_NPROBE
+
+_ASSIGN_CHUNK = 65536  # rows per centroid-assignment matmul (bounds memory)
+
+
+# -------------------------------
+# Coarse quantizer
+# -------------------------------
+def auto_nlist(n: int) -> int:
+    """Rule of thumb: about 4*sqrt(N) lists."""
+    return int(max(1, min(n, round(4 * np.sqrt(max(n, 1))))))
+
+
+def assign_to_centroids(matrix: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """Nearest centroid (by cosine) for every normalized row."""
+    out = np.empty(matrix.shape[0], dtype=np.int64)
+    for start in range(0, matrix.shape[0], _ASSIGN_CHUNK):
+        chunk = matrix[start : start + _ASSIGN_CHUNK]
+        out[start : start + len(chunk)] = np.argmax(chunk @ centroids.T, axis=1)
+    return out
+
+
+def train_centroids(
+    matrix: np.ndarray, nlist: int, iters: int = 20, seed: int = 0
+) -> np.ndarray:
+    """Spherical k-means on (a sample of) normalized embeddings."""
+    rng = np.random.default_rng(seed)
+    n = matrix.shape[0]
+    nlist = max(1, min(nlist, n))
+    sample = matrix
+    if n > 256 * nlist:  # enough points per centroid for stable training
+        sample = matrix[rng.choice(n, 256 * nlist, replace=False)]
+
+    centroids = sample[rng.choice(sample.shape[0], nlist, replace=False)].copy()
+    for _ in range(iters):
+        assign = assign_to_centroids(sample, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, sample)
+        counts = np.bincount(assign, minlength=nlist)
+        empty = counts == 0
+        if empty.any():  # reseed dead centroids on random points
+            sums[empty] = sample[rng.choice(sample.shape[0], int(empty.sum()))]
+        centroids = l2_normalize(sums)
+    return centroids
+
+
+# -------------------------------
+# IVF index
+# -------------------------------
+class IVFIndex(GalleryIndex):
+    """
+    Drop-in replacement for GalleryIndex with approximate search.
+    Rows are stored grouped by inverted list; `offsets[c]:offsets[c+1]`
+    is the slice of list `c`.
+    """
+
+    def __init__(
+        self,
+        base: GalleryIndex,
+        centroids: np.ndarray,
+        nprobe: int = IVF_NPROBE,
+        assign: Optional[np.ndarray] = None,
+    ):
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        self.nprobe = nprobe
+        self.threshold = base.threshold
+
+        if assign is None:
+            assign = assign_to_centroids(base.matrix, self.centroids)
+        order = np.argsort(assign, kind="stable")
+        self.ids = base.ids[order]
+        self.profile_ids = base.profile_ids[order]
+        self.matrix = np.ascontiguousarray(base.matrix[order])
+        self.assign = assign[order]
+        counts = np.bincount(self.assign, minlength=len(self.centroids))
+        self.offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+
+    @classmethod
+    def train(
+        cls,
+        base: GalleryIndex,
+        nlist: int = IVF_NLIST,
+        nprobe: int = IVF_NPROBE,
+        iters: int = 20,
+    ):
+        """Train a coarse quantizer on `base` (nlist=0 picks it from N)."""
+        if len(base) == 0:
+            raise ValueError("Cannot train an IVF index on an empty gallery")
+        nlist = nlist or auto_nlist(len(base))
+        return cls(base, train_centroids(base.matrix, nlist, iters), nprobe)
+
+    @classmethod
+    def from_saved(cls, base: GalleryIndex, saved: "IVFIndex"):
+        """
+        Index `base` with a saved index's centroids, reusing stored list
+        assignments for ids it already knows and assigning only the rest.
+        """
+        order = np.argsort(saved.ids)  # saved indexes are never empty
+        pos = np.searchsorted(saved.ids, base.ids, sorter=order)
+        pos = order[np.minimum(pos, len(order) - 1)]
+        known = saved.ids[pos] == base.ids
+        assign = np.empty(len(base), dtype=np.int64)
+        assign[known] = saved.assign[pos[known]]
+        assign[~known] = assign_to_centroids(base.matrix[~known], saved.centroids)
+        return cls(base, saved.centroids, saved.nprobe, assign)
+
+    @property
+    def nlist(self) -> int:
+        return self.centroids.shape[0]
+
+    def merged(self, added: GalleryIndex, removed_ids=()):
+        """Apply an incremental update; only the added rows are assigned."""
+        drop = np.union1d(np.asarray(list(removed_ids), np.int64), added.ids)
+        keep = ~np.isin(self.ids, drop)
+        flat = GalleryIndex.merged(self, added, removed_ids)
+        assign = np.concatenate(
+            [self.assign[keep], assign_to_centroids(added.matrix, self.centroids)]
+        )
+        return IVFIndex(flat, self.centroids, self.nprobe, assign)
+
+    def search(
+        self, queries: np.ndarray, k: int = 1, nprobe: Optional[int] = None
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Top-k over the `nprobe` nearest inverted lists per query."""
+        q = l2_normalize(np.atleast_2d(queries))
+        nprobe = max(1, min(nprobe or self.nprobe, self.nlist))
+        k = max(0, min(k, len(self)))
+
+        ids = np.full((q.shape[0], k), -1, np.int64)
+        profile_ids = np.full((q.shape[0], k), -1, np.int64)
+        scores = np.full((q.shape[0], k), -np.inf, np.float32)
+        if k == 0:
+            return ids, profile_ids, scores
+
+        coarse = q @ self.centroids.T  # (Q,nlist)
+        probes = np.argpartition(-coarse, nprobe - 1, axis=1)[:, :nprobe]
+        for qi in range(q.shape[0]):
+            rows = np.concatenate(
+                [np.arange(self.offsets[c], self.offsets[c + 1]) for c in probes[qi]]
+            )
+            if rows.size == 0:
+                continue
+            sims = self.matrix[rows] @ q[qi]
+            kk = min(k, rows.size)
+            top = np.argpartition(-sims, kk - 1)[:kk] if kk < rows.size else None
+            top = np.argsort(-sims) if top is None else top[np.argsort(-sims[top])]
+            ids[qi, :kk] = self.ids[rows[top]]
+            profile_ids[qi, :kk] = self.profile_ids[rows[top]]
+            scores[qi, :kk] = sims[top]
+        return ids, profile_ids, scores
+
+    # -------------------------------
+    # Persistence
+    # -------------------------------
+    def save(self, path: str = ANN_INDEX_PATH) -> None:
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        np.savez(
+            path,
+            centroids=self.centroids,
+            ids=self.ids,
+            profile_ids=self.profile_ids,
+            matrix=self.matrix,
+            assign=self.assign,
+            nprobe=np.int64(self.nprobe),
+            threshold=np.float32(self.threshold),
+        )
+
+    @classmethod
+    def load(cls, path: str = ANN_INDEX_PATH):
+        with np.load(path) as data:
+            base = GalleryIndex._from_normalized(
+                data["ids"],
+                data["profile_ids"],
+                data["matrix"],
+                float(data["threshold"]),
+            )
+            return cls(base, data["centroids"], int(data["nprobe"]), data["assign"])
+
+
+def index_for_gallery(base: GalleryIndex, path: str = ANN_INDEX_PATH) -> GalleryIndex:
+    """
+    Wrap a freshly loaded gallery in an IVF index: reuse the saved quantizer
+    at `path` if there is one, otherwise train and save it.
+    An empty gallery stays exact (nothing to train on yet).
+    """
+    if Path(path).exists():
+        return IVFIndex.from_saved(base, IVFIndex.load(path))
+    if len(base) == 0:
+        print("[WARN] IVF mode requested but gallery is empty; using exact search.")
+        return base
+    index = IVFIndex.train(base)
+    index.save(path)
+    print(f"[INFO] Trained IVF index (nlist={index.nlist}) -> {path}")
+    return index
+
+
+# -------------------------------
+# CLI: build / report
+# -------------------------------
+def build_from_db(
+    path: str = ANN_INDEX_PATH, nlist: int = IVF_NLIST, nprobe: int = IVF_NPROBE
+) -> IVFIndex:
+    from lab.db.models import FaceEmbedding
+    from lab.db.test_database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        base = GalleryIndex.from_records(db.query(FaceEmbedding).all())
+    finally:
+        db.close()
+
+    t0 = time.perf_counter()
+    index = IVFIndex.train(base, nlist=nlist, nprobe=nprobe)
+    index.save(path)
+    print(
+        f"[INFO] IVF index built: N={len(index)}, nlist={index.nlist}, "
+        f"nprobe={index.nprobe}, {time.perf_counter() - t0:.1f}s -> {path}"
+    )
+    return index
+
+
+def synthetic_gallery(n: int, n_queries: int, seed: int = 0):
+    """Clustered random embeddings (identities + noise) for offline reports."""
+    rng = np.random.default_rng(seed)
+    n_profiles = max(1, n // 4)
+    centers = l2_normalize(rng.standard_normal((n_profiles, 512)))
+    profile_ids = rng.integers(0, n_profiles, n)
+    emb = centers[profile_ids] + 0.6 * l2_normalize(rng.standard_normal((n, 512)))
+    base = GalleryIndex(np.arange(n), profile_ids, emb)
+    pick = rng.integers(0, n_profiles, n_queries)
+    queries = centers[pick] + 0.6 * l2_normalize(rng.standard_normal((n_queries, 512)))
+    return base, l2_normalize(queries)
+
+
+def _search_each(index: GalleryIndex, queries: np.ndarray, k: int, **kw):
+    """One query at a time (like the per-face server path); returns (ids, ms/query)."""
+    t0 = time.perf_counter()
+    ids = np.vstack([index.search(q, k, **kw)[0] for q in queries])
+    return ids, (time.perf_counter() - t0) * 1000.0 / len(queries)
+
+
+def recall_report(
+    base: GalleryIndex,
+    queries: np.ndarray,
+    index: IVFIndex,
+    nprobes=(1, 2, 4, 8, 16, 32),
+    k: int = 10,
+) -> list:
+    """Recall@1 / recall@k and per-query latency for each nprobe vs exact search."""
+    exact_ids, exact_ms = _search_each(base, queries, k)
+    rows = [("exact", "-", 1.0, 1.0, exact_ms)]
+    for nprobe in nprobes:
+        if nprobe > index.nlist:
+            break
+        ann_ids, ms = _search_each(index, queries, k, nprobe=nprobe)
+        r1 = float(np.mean(ann_ids[:, 0] == exact_ids[:, 0]))
+        rk = float(
+            np.mean([len(np.intersect1d(a, e)) / k for a, e in zip(ann_ids, exact_ids)])
+        )
+        rows.append(("ivf", nprobe, r1, rk, ms))
+
+    print(f"[INFO] N={len(base)}, nlist={index.nlist}, queries={len(queries)}")
+    print(
+        f"{'mode':<6} {'nprobe':>6} {'recall@1':>9} {f'recall@{k}':>10} {'ms/query':>9}"
+    )
+    for mode, nprobe, r1, rk, ms in rows:
+        print(f"{mode:<6} {nprobe:>6} {r1:>9.4f} {rk:>10.4f} {ms:>9.3f}")
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="IVF face index tools")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    b = sub.add_parser("build", help="train from face_embeddings and save")
+    b.add_argument("--out", default=ANN_INDEX_PATH)
+    b.add_argument("--nlist", type=int, default=IVF_NLIST)
+    b.add_argument("--nprobe", type=int, default=IVF_NPROBE)
+    r = sub.add_parser("report", help="recall vs latency against exact search")
+    r.add_argument("--index", default=ANN_INDEX_PATH)
+    r.add_argument("--synthetic", type=int, default=0, help="use N random embeddings")
+    r.add_argument("--nlist", type=int, default=IVF_NLIST)
+    r.add_argument("--queries", type=int, default=200)
+    r.add_argument("--k", type=int, default=10)
+    args = parser.parse_args()
+
+    if args.cmd == "build":
+        build_from_db(args.out, args.nlist, args.nprobe)
+    elif args.synthetic:
+        base, queries = synthetic_gallery(args.synthetic, args.queries)
+        recall_report(base, queries, IVFIndex.train(base, nlist=args.nlist), k=args.k)
+    else:
+        index = IVFIndex.load(args.index)
+        base = GalleryIndex._from_normalized(
+            index.ids, index.profile_ids, index.matrix, index.threshold
+        )
+        rng = np.random.default_rng(0)
+        pick = rng.integers(0, len(base), args.queries)
+        noise = 0.3 * l2_normalize(rng.standard_normal((args.queries, 512)))
+        recall_report(base, l2_normalize(base.matrix[pick] + noise), index, k=args.k)
@@ -0,0 +1,147 @@
+# lab/face/cascade.py
+"""
+Two-stage face detector with load-adaptive input resolution.
+- Stage 1: light det_10g model at a reduced input size
+- Stage 2: main SCRFD model, only when stage 1 is ambiguous or finds nothing
+- Input sizes step down a ladder when detection latency exceeds the budget
+"""
+
+import threading
+import time
+from collections import Counter
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import onnxruntime as ort
+
+from lab.face.models_config import (
+    CASCADE_CONFIDENT_SCORE,
+    CASCADE_LATENCY_BUDGET_MS,
+    CASCADE_LIGHT_MIN_SCORE,
+    CASCADE_LIGHT_SIZES,
+    CASCADE_MAIN_SIZES,
+    CONF_THRESHOLD,
+)
+from lab.face.pipeline import detect_faces_full, session_input_size
+
+_EMA_ALPHA = 0.2
+_STEP_DOWN_LOAD = 1.0  # ema / budget above this -> lower resolution
+_STEP_UP_LOAD = 0.6  # ema / budget below this -> higher resolution
+
+
+class DetectorCascade:
+    """
+    Drop-in detector: `detect(frame)` returns (boxes, scores, landmarks, path).
+    `path` is one of:
+    - "light": every light-pass face was confident, main model skipped
+    - "main_ambiguous": some light-pass face scored below CASCADE_CONFIDENT_SCORE
+    - "main_empty": light pass found nothing, re-checked with the main model
+    - "light_empty": light pass found nothing and the server is loaded (no re-check)
+    """
+
+    def __init__(
+        self,
+        light_session: ort.InferenceSession,
+        main_session: ort.InferenceSession,
+        light_sizes=CASCADE_LIGHT_SIZES,
+        main_sizes=CASCADE_MAIN_SIZES,
+        budget_ms: float = CASCADE_LATENCY_BUDGET_MS,
+    ):
+        self.light_session = light_session
+        self.main_session = main_session
+        # models exported with fixed input sizes cannot adapt
+        self.light_sizes = self._ladder(light_session, light_sizes)
+        self.main_sizes = self._ladder(main_session, main_sizes)
+        self.budget_ms = budget_ms
+        self.level = 0
+        self.external_load = 0.0
+        self._ema_ms: Optional[float] = None
+        self._lock = threading.Lock()
+        self.path_counts: Counter = Counter()
+        self.level_counts: Counter = Counter()
+
+    @staticmethod
+    def _ladder(session, sizes):
+        fixed = session_input_size(session, None)
+        return [fixed] if fixed is not None else list(sizes)
+
+    # -------------------------------
+    # Load adaptation
+    # -------------------------------
+    @property
+    def max_level(self) -> int:
+        return max(len(self.light_sizes), len(self.main_sizes)) - 1
+
+    def report_load(self, load: float) -> None:
+        """External load hint (e.g. queue fill 0..1); >= 1 forces a step down."""
+        self.external_load = load
+
+    def _record(self, elapsed_ms: float, path: str, level: int) -> None:
+        """Count the frame and adapt the level; detect() runs on pool threads."""
+        with self._lock:
+            self.path_counts[path] += 1
+            self.level_counts[level] += 1
+            if self._ema_ms is None:
+                self._ema_ms = elapsed_ms
+            else:
+                self._ema_ms += _EMA_ALPHA * (elapsed_ms - self._ema_ms)
+            load = max(self._ema_ms / self.budget_ms, self.external_load)
+            if load > _STEP_DOWN_LOAD and self.level < self.max_level:
+                self.level += 1
+                self._ema_ms = None  # re-measure at the new size
+            elif load < _STEP_UP_LOAD and self.level > 0:
+                self.level -= 1
+                self._ema_ms = None
+
+    @staticmethod
+    def _size(sizes, level: int) -> Tuple[int, int]:
+        return sizes[min(level, len(sizes) - 1)]
+
+    # -------------------------------
+    # Detection
+    # -------------------------------
+    def detect(self, frame_bgr: np.ndarray):
+        t0 = time.perf_counter()
+        level = self.level
+
+        boxes, scores, lmks = detect_faces_full(
+            self.light_session,
+            frame_bgr,
+            self._size(self.light_sizes, level),
+            CASCADE_LIGHT_MIN_SCORE,
+        )
+        if len(scores) and scores.min() >= CASCADE_CONFIDENT_SCORE:
+            path = "light"
+        elif len(scores) or level == 0:
+            # ambiguous faces always escalate; empty frames only when not loaded
+            path = "main_ambiguous" if len(scores) else "main_empty"
+            boxes, scores, lmks = detect_faces_full(
+                self.main_session,
+                frame_bgr,
+                self._size(self.main_sizes, level),
+                CONF_THRESHOLD,
+            )
+        else:
+            path = "light_empty"
+
+        self._record((time.perf_counter() - t0) * 1000.0, path, level)
+        return boxes, scores, lmks, path
+
+    def detect_boxes(self, frame_bgr: np.ndarray):
+        """Same output as pipeline.detect_faces (int boxes)."""
+        boxes, _, _, _ = self.detect(frame_bgr)
+        return boxes.astype(np.int64).tolist()
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            paths, levels = dict(self.path_counts), dict(self.level_counts)
+            level = self.level
+        total = sum(paths.values()) or 1
+        return {
+            "frames": sum(paths.values()),
+            "paths": {k: round(v / total, 4) for k, v in paths.items()},
+            "levels": levels,
+            "level": level,
+            "light_size": self._size(self.light_sizes, level),
+            "main_size": self._size(self.main_sizes, level),
+        }
@@ -0,0 +1,380 @@
+# lab/face/enroll.py
+"""
+Bulk enrollment of member photos into face_embeddings.
+- Input: a directory (DIR/<profile_id>/*.jpg or DIR/<profile_id>_*.jpg) or a
+  CSV manifest of `image_path,profile_id` (paths relative to the manifest)
+- Decode, detection and embedding run in a process pool; every job takes a
+  chunk of images through one batched detector run and one batched ArcFace run
+- The highest-scoring face per image is enrolled; embeddings too close to one
+  already stored (or enrolled earlier in the run) for the same profile are
+  skipped as near-duplicates
+- Rows are written with one multi-row INSERT and one transaction per chunk,
+  which also updates the profiles' templates (lab.face.templates)
+Running servers pick the new rows up on their next gallery refresh (or on
+SIGHUP); `--snapshot` re-exports the gallery snapshot so servers started
+later map it instead of reading the new rows from the DB.
+Usage:
+    python -m lab.face.enroll --dir photos/ --snapshot
+    python -m lab.face.enroll --manifest members.csv --workers 8 --failures bad.csv
+"""
+
+import argparse
+import csv
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+from sqlalchemy import insert, select
+
+from lab.db.embedding_codec import decode_embeddings, encode_embedding
+from lab.db.models import FaceEmbedding
+from lab.db.test_database import engine
+from lab.face import templates
+from lab.face.gallery import l2_normalize
+from lab.face.models_config import (
+    ENROLL_DUPLICATE_SIMILARITY,
+    ENROLL_IMAGES_PER_JOB,
+    ENROLL_INSERT_CHUNK,
+    ENROLL_WORKERS,
+)
+from lab.face.pipeline import (
+    align_face,
+    create_detection_session,
+    create_embedding_session,
+    crop_faces,
+    detect_faces_batch,
+    get_face_embeddings_batch,
+    sanity_check_embedding,
+)
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp", ".webp"}
+
+
+# -------------------------------
+# Input
+# -------------------------------
+def _profile_from_name(path: Path) -> Optional[int]:
+    """`123.jpg` / `123_front.jpg` -> 123."""
+    head = path.stem.split("_", 1)[0]
+    return int(head) if head.isdigit() else None
+
+
+def collect_from_dir(directory: str) -> Tuple[List[Tuple[str, int]], List[str]]:
+    """-> ([(image path, profile id)], [paths whose profile id is unknown])"""
+    items, unknown = [], []
+    for path in sorted(Path(directory).rglob("*")):
+        if path.suffix.lower() not in IMAGE_EXTENSIONS or not path.is_file():
+            continue
+        parent = path.parent.name
+        if path.parent != Path(directory) and parent.isdigit():
+            items.append((str(path), int(parent)))
+            continue
+        profile_id = _profile_from_name(path)
+        if profile_id is None:
+            unknown.append(str(path))
+        else:
+            items.append((str(path), profile_id))
+    return items, unknown
+
+
+def collect_from_manifest(manifest: str) -> Tuple[List[Tuple[str, int]], List[str]]:
+    """CSV `image_path,profile_id`; a header row is skipped."""
+    base = Path(manifest).parent
+    items, bad = [], []
+    with open(manifest, newline="") as f:
+        for lineno, row in enumerate(csv.reader(f), 1):
+            if not row or row[0].startswith("#"):
+                continue
+            if len(row) < 2 or not row[1].strip().isdigit():
+                if lineno > 1:  # line 1 may be a header
+                    bad.append(f"{manifest}:{lineno}")
+                continue
+            path = Path(row[0].strip())
+            items.append(
+                (str(path if path.is_absolute() else base / path), int(row[1]))
+            )
+    return items, bad
+
+
+# -------------------------------
+# Worker side
+# -------------------------------
+_state = {}
+
+
+def _init_worker(intra_op_threads: int) -> None:
+    _state["det"] = create_detection_session(intra_op_threads=intra_op_threads)
+    _state["emb"] = create_embedding_session(intra_op_threads=intra_op_threads)
+
+
+def embed_images(
+    paths: List[str],
+) -> List[Tuple[Optional[np.ndarray], float, Optional[str]]]:
+    """
+    Decode a chunk of images, detect faces in one batched run and embed the
+    best face of each in one batched run.
+    Returns (embedding, detection score, error) per path, in order.
+    """
+    out: List[Tuple[Optional[np.ndarray], float, Optional[str]]] = [
+        (None, 0.0, None)
+    ] * len(paths)
+    frames, owners = [], []
+    for i, path in enumerate(paths):
+        img = cv2.imread(path)
+        if img is None:
+            out[i] = (None, 0.0, "unreadable image")
+            continue
+        frames.append(img)
+        owners.append(i)
+
+    crops, crop_owners, crop_scores = [], [], []
+    for i, img, (boxes, scores, _) in zip(
+        owners, frames, detect_faces_batch(_state["det"], frames)
+    ):
+        if len(boxes) == 0:
+            out[i] = (None, 0.0, "no face detected")
+            continue
+        best = int(np.argmax(scores))
+        crop, _ = crop_faces(img, [boxes[best].astype(np.int64).tolist()])
+        if not crop:
+            out[i] = (None, 0.0, "empty face crop")
+            continue
+        crops.append(align_face(crop[0]))
+        crop_owners.append(i)
+        crop_scores.append(float(scores[best]))
+
+    vecs = get_face_embeddings_batch(_state["emb"], crops)
+    for i, score, vec in zip(crop_owners, crop_scores, vecs):
+        if sanity_check_embedding(vec):
+            out[i] = (vec, score, None)
+        else:
+            out[i] = (None, score, "invalid embedding")
+    return out
+
+
+# -------------------------------
+# Near-duplicates
+# -------------------------------
+class DuplicateFilter:
+    """Per-profile set of unit vectors; rejects anything too close to one."""
+
+    def __init__(self, threshold: float = ENROLL_DUPLICATE_SIMILARITY):
+        self.threshold = threshold
+        self._by_profile: Dict[int, np.ndarray] = {}
+
+    def seed_from_db(self, profile_ids, chunk: int = 500) -> int:
+        """Load the embeddings already stored for these profiles."""
+        profile_ids = sorted(set(profile_ids))
+        loaded = 0
+        with engine.connect() as conn:
+            for start in range(0, len(profile_ids), chunk):
+                stmt = select(FaceEmbedding.profile_id, FaceEmbedding.embedding).where(
+                    FaceEmbedding.profile_id.in_(profile_ids[start : start + chunk])
+                )
+                rows = conn.execute(stmt).fetchall()
+                if not rows:
+                    continue
+                mat = l2_normalize(decode_embeddings(row.embedding for row in rows))
+                pids = np.array([row.profile_id for row in rows])
+                for pid in np.unique(pids):
+                    self._add(int(pid), mat[pids == pid])
+                loaded += len(rows)
+        return loaded
+
+    def _add(self, profile_id: int, unit: np.ndarray) -> None:
+        unit = unit.reshape(-1, unit.shape[-1])
+        known = self._by_profile.get(profile_id)
+        self._by_profile[profile_id] = (
+            unit if known is None else np.concatenate([known, unit])
+        )
+
+    def accept(self, profile_id: int, vec: np.ndarray) -> bool:
+        """True (and remembered) unless a near-duplicate is already known."""
+        unit = l2_normalize(vec.reshape(1, -1).astype(np.float32))[0]
+        known = self._by_profile.get(profile_id)
+        if known is not None and float((known @ unit).max()) >= self.threshold:
+            return False
+        self._add(profile_id, unit)
+        return True
+
+
+# -------------------------------
+# Writer
+# -------------------------------
+def insert_rows(rows: List[dict]) -> None:
+    """One transaction: one executemany INSERT plus the profile templates."""
+    if rows:
+        with engine.begin() as conn:
+            conn.execute(insert(FaceEmbedding), rows)
+            templates.add_embeddings(
+                conn,
+                [row["profile_id"] for row in rows],
+                decode_embeddings(row["embedding"] for row in rows),
+            )
+
+
+# -------------------------------
+# Main
+# -------------------------------
+def enroll(
+    items: List[Tuple[str, int]],
+    workers: int = ENROLL_WORKERS,
+    images_per_job: int = ENROLL_IMAGES_PER_JOB,
+    insert_chunk: int = ENROLL_INSERT_CHUNK,
+    dedup_threshold: float = ENROLL_DUPLICATE_SIMILARITY,
+    dry_run: bool = False,
+) -> Tuple[Dict[str, float], List[Tuple[str, str]]]:
+    """Returns (summary counters, [(image path, reason)] failures)."""
+    workers = workers or os.cpu_count() or 1
+    # split cores between workers so ORT thread pools do not oversubscribe
+    intra = max(1, (os.cpu_count() or 1) // workers)
+    counts = {"images": len(items), "enrolled": 0, "duplicates": 0, "failed": 0}
+    failures: List[Tuple[str, str]] = []
+
+    t0 = time.perf_counter()
+    dedup = DuplicateFilter(dedup_threshold)
+    existing = dedup.seed_from_db(pid for _, pid in items)
+    print(f"[INFO] {existing} stored embedding(s) loaded for duplicate checks")
+
+    chunks = [
+        items[i : i + images_per_job] for i in range(0, len(items), images_per_job)
+    ]
+    pending: List[dict] = []
+    t_insert = 0.0
+    with ProcessPoolExecutor(
+        workers,
+        mp_context=get_context("spawn"),
+        initializer=_init_worker,
+        initargs=(intra,),
+    ) as executor:
+        print(f"[INFO] {workers} worker(s), {intra} ORT thread(s) each")
+        jobs = executor.map(embed_images, [[p for p, _ in c] for c in chunks])
+        done = 0
+        for chunk, results in zip(chunks, jobs):
+            for (path, profile_id), (vec, score, error) in zip(chunk, results):
+                if error is not None:
+                    failures.append((path, error))
+                    counts["failed"] += 1
+                elif not dedup.accept(profile_id, vec):
+                    counts["duplicates"] += 1
+                else:
+                    pending.append(
+                        {
+                            "profile_id": profile_id,
+                            "embedding": encode_embedding(vec),
+                            "confidence": score,
+                        }
+                    )
+
+            if len(pending) >= insert_chunk:
+                t = time.perf_counter()
+                if not dry_run:
+                    insert_rows(pending)
+                t_insert += time.perf_counter() - t
+                counts["enrolled"] += len(pending)
+                pending = []
+
+            done += len(chunk)
+            if done % (images_per_job * 50) < len(chunk) or done == len(items):
+                rate = done / (time.perf_counter() - t0)
+                print(f"[INFO] {done}/{len(items)} images ({rate:.1f}/s)")
+
+    t = time.perf_counter()
+    if not dry_run:
+        insert_rows(pending)
+    t_insert += time.perf_counter() - t
+    counts["enrolled"] += len(pending)
+
+    elapsed = time.perf_counter() - t0
+    counts["seconds"] = round(elapsed, 2)
+    counts["images_per_s"] = round(len(items) / elapsed, 1) if elapsed else 0.0
+    counts["insert_seconds"] = round(t_insert, 2)
+    return counts, failures
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Bulk face enrollment")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--dir", help="DIR/<profile_id>/*.jpg or DIR/<pid>_*.jpg")
+    source.add_argument("--manifest", help="CSV of image_path,profile_id")
+    parser.add_argument(
+        "--workers", type=int, default=ENROLL_WORKERS, help="0 = one per core"
+    )
+    parser.add_argument(
+        "--images-per-job",
+        type=int,
+        default=ENROLL_IMAGES_PER_JOB,
+        help="images per batched worker job",
+    )
+    parser.add_argument(
+        "--insert-chunk",
+        type=int,
+        default=ENROLL_INSERT_CHUNK,
+        help="rows per INSERT transaction",
+    )
+    parser.add_argument(
+        "--dedup-threshold",
+        type=float,
+        default=ENROLL_DUPLICATE_SIMILARITY,
+        help="same-profile cosine at/above which an image is skipped (>1 disables)",
+    )
+    parser.add_argument("--dry-run", action="store_true", help="do not write")
+    parser.add_argument("--failures", default="", help="write failures as CSV")
+    parser.add_argument(
+        "--snapshot",
+        action="store_true",
+        help="export a new gallery snapshot afterwards (lab.face.snapshot)",
+    )
+    args = parser.parse_args(argv)
+
+    if args.dir:
+        items, unmapped = collect_from_dir(args.dir)
+        unmapped_reason = "no profile id in path"
+    else:
+        items, unmapped = collect_from_manifest(args.manifest)
+        unmapped_reason = "bad manifest row"
+    if not items:
+        print("[ERROR] No images to enroll.")
+        return 1
+    print(f"[INFO] {len(items)} image(s) for {len({p for _, p in items})} profile(s)")
+
+    counts, failures = enroll(
+        items,
+        args.workers,
+        args.images_per_job,
+        args.insert_chunk,
+        args.dedup_threshold,
+        args.dry_run,
+    )
+    failures = [(u, unmapped_reason) for u in unmapped] + failures
+
+    print(
+        f"[INFO] Done in {counts['seconds']}s ({counts['images_per_s']} images/s, "
+        f"{counts['insert_seconds']}s in DB writes): enrolled={counts['enrolled']} "
+        f"duplicates={counts['duplicates']} failed={len(failures)}"
+        + (" [dry run]" if args.dry_run else "")
+    )
+    for path, reason in failures[:20]:
+        print(f"[WARN] {path}: {reason}")
+    if len(failures) > 20:
+        print(f"[WARN] ... {len(failures) - 20} more")
+    if args.failures and failures:
+        with open(args.failures, "w", newline="") as f:
+            csv.writer(f).writerows([("image_path", "reason"), *failures])
+        print(f"[INFO] Failures written to {args.failures}")
+    if args.snapshot and not args.dry_run:
+        from lab.face import snapshot
+
+        path = snapshot.export()
+        print(f"[INFO] Gallery snapshot exported: {path.name}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
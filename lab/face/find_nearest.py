@@ -8,12 +8,10 @@ Usage:
 import sys
 
 import cv2
-import numpy as np
 
-from lab.db.models import FaceEmbedding
-from lab.db.test_database import SessionLocal
+from lab.face.ann_index import IVFIndex
+from lab.face.gallery_cache import GalleryCache
 from lab.face.pipeline import (
-    cosine_similarity,
     detect_faces,
     get_face_embedding,
     initialize_onnx_sessions,
@@ -21,7 +19,7 @@ from lab.face.pipeline import (
 )
 
 
-def run(image_path: str):
+def run(image_path: str, top_k: int = 5):
     # 1) Read image
     img = cv2.imread(image_path)
     if img is None:
@@ -50,27 +48,36 @@ def run(image_path: str):
         print("[ERROR] Invalid embedding.")
         return
 
-    # 6) Compare with DB embeddings
-    db = SessionLocal()
-    try:
-        records = db.query(FaceEmbedding).all()
-        if not records:
-            print("[WARN] No embeddings stored in DB.")
-            return
-
-        best_id, best_profile, best_sim = None, None, -1.0
-        for rec in records:
-            emb_back = np.fromstring(rec.embedding, sep=",")
-            sim = cosine_similarity(vec, emb_back)
-            print(f"[DEBUG] id={rec.id}, profile={rec.profile_id}, sim={sim:.4f}")
-            if sim > best_sim:
-                best_id, best_profile, best_sim = rec.id, rec.profile_id, sim
-
+    # 6) Compare with the gallery, built the way the server builds it: the
+    # mapped snapshot + rows changed since (or the whole table if none), then
+    # the IVF index (saved quantizer, new rows assigned) or templates per mode
+    cache = GalleryCache()
+    cache.load()
+    gallery = cache.index
+    if isinstance(gallery, IVFIndex):
         print(
-            f"[INFO] Nearest match: id={best_id}, profile_id={best_profile}, similarity={best_sim:.4f}"
+            f"[INFO] Using IVF index ({gallery.nlist} lists, nprobe={gallery.nprobe})"
         )
-    finally:
-        db.close()
+
+    if not len(gallery):
+        print("[WARN] No embeddings stored in DB.")
+        return
+
+    ids, profiles, sims = gallery.search(vec, k=top_k)
+    for rec_id, prof_id, sim in zip(ids[0], profiles[0], sims[0]):
+        if rec_id >= 0:  # IVF leaves -1 when the probed lists run out
+            print(f"[DEBUG] id={rec_id}, profile={prof_id}, sim={sim:.4f}")
+    if ids[0, 0] < 0:
+        print("[WARN] No match in the probed IVF lists.")
+        return
+
+    # best match = first row of the top-k result (no second search)
+    best_sim = float(sims[0, 0])
+    verdict = "ACCEPT" if best_sim >= gallery.threshold else "REJECT"
+    print(
+        f"[INFO] Nearest match: id={ids[0, 0]}, profile_id={profiles[0, 0]}, "
+        f"similarity={best_sim:.4f} ({verdict} @ {gallery.threshold:.2f})"
+    )
 
 
 if __name__ == "__main__":
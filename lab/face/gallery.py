@@ -0,0 +1,155 @@
+# lab/face/gallery.py
+"""
+In-memory face gallery for fast nearest-neighbour matching.
+- All embeddings live in one contiguous, L2-normalized float32 matrix
+- Cosine similarity for any number of queries is a single matrix multiply
+"""
+
+from typing import Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from lab.db.embedding_codec import EMBEDDING_DIM, decode_embeddings
+from lab.face.models_config import COSINE_LOGIN_THRESHOLD
+
+
+# -------------------------------
+# Utility functions
+# -------------------------------
+def l2_normalize(mat: np.ndarray) -> np.ndarray:
+    """Row-wise L2 normalization to float32. Zero rows stay zero."""
+    mat = np.asarray(mat, dtype=np.float32)
+    norms = np.linalg.norm(mat, axis=-1, keepdims=True)
+    np.maximum(norms, np.finfo(np.float32).tiny, out=norms)
+    return np.ascontiguousarray(mat / norms, dtype=np.float32)
+
+
+def top_k(sims: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Column indices and scores of the k best per row of (Q,N) `sims`, best first."""
+    if k < sims.shape[1]:
+        top = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+    else:
+        top = np.broadcast_to(np.arange(sims.shape[1]), sims.shape)
+    top_scores = np.take_along_axis(sims, top, axis=1)
+    order = np.argsort(-top_scores, axis=1)
+    top = np.take_along_axis(top, order, axis=1)
+    return top, np.take_along_axis(top_scores, order, axis=1)
+
+
+# -------------------------------
+# Gallery index
+# -------------------------------
+class GalleryIndex:
+    """
+    Exact cosine search over enrolled face embeddings.
+    `search` returns (ids, profile_ids, scores), each shaped (num_queries, k),
+    best match first.
+    """
+
+    def __init__(
+        self,
+        ids: Iterable[int],
+        profile_ids: Iterable[int],
+        embeddings: np.ndarray,
+        threshold: float = COSINE_LOGIN_THRESHOLD,
+    ):
+        self.ids = np.asarray(list(ids), dtype=np.int64)
+        self.profile_ids = np.asarray(list(profile_ids), dtype=np.int64)
+        emb = np.asarray(embeddings, dtype=np.float32).reshape(-1, EMBEDDING_DIM)
+        if not (len(self.ids) == len(self.profile_ids) == emb.shape[0]):
+            raise ValueError("ids, profile_ids and embeddings must have equal length")
+        self.matrix = l2_normalize(emb)  # (N,512)
+        self.threshold = threshold
+
+    @classmethod
+    def _from_normalized(cls, ids, profile_ids, matrix, threshold):
+        """Wrap arrays that are already normalized, skipping the copy."""
+        index = cls.__new__(cls)
+        index.ids = ids
+        index.profile_ids = profile_ids
+        index.matrix = matrix
+        index.threshold = threshold
+        return index
+
+    @classmethod
+    def from_records(cls, records, threshold: float = COSINE_LOGIN_THRESHOLD):
+        """Build from FaceEmbedding rows."""
+        records = list(records)
+        if not records:
+            return cls.empty(threshold)
+        ids = [rec.id for rec in records]
+        profile_ids = [rec.profile_id for rec in records]
+        embeddings = decode_embeddings(rec.embedding for rec in records)
+        return cls(ids, profile_ids, embeddings, threshold)
+
+    @classmethod
+    def empty(cls, threshold: float = COSINE_LOGIN_THRESHOLD):
+        return cls([], [], np.zeros((0, EMBEDDING_DIM), np.float32), threshold)
+
+    def merged(self, added: "GalleryIndex", removed_ids: Iterable[int] = ()):
+        """
+        Return a new index with `removed_ids` dropped and `added` appended.
+        Entries in `added` replace existing entries with the same id.
+        The current index is left untouched so readers never see a partial update.
+        """
+        drop = np.union1d(np.asarray(list(removed_ids), np.int64), added.ids)
+        keep = ~np.isin(self.ids, drop)
+        return GalleryIndex._from_normalized(
+            np.concatenate([self.ids[keep], added.ids]),
+            np.concatenate([self.profile_ids[keep], added.profile_ids]),
+            np.ascontiguousarray(np.concatenate([self.matrix[keep], added.matrix])),
+            self.threshold,
+        )
+
+    def __len__(self) -> int:
+        return self.matrix.shape[0]
+
+    @property
+    def nbytes(self) -> int:
+        """Memory held by the search arrays."""
+        return self.matrix.nbytes + self.ids.nbytes + self.profile_ids.nbytes
+
+    def search(
+        self, queries: np.ndarray, k: int = 1
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Top-k cosine matches for one (512,) or many (Q,512) query vectors."""
+        q = l2_normalize(np.atleast_2d(queries))
+        k = max(0, min(k, len(self)))
+        if k == 0:
+            shape = (q.shape[0], 0)
+            return (
+                np.empty(shape, np.int64),
+                np.empty(shape, np.int64),
+                np.empty(shape, np.float32),
+            )
+
+        top, scores = top_k(q @ self.matrix.T, k)  # (Q,N) similarities
+        return self.ids[top], self.profile_ids[top], scores
+
+    def best_match(self, vec: np.ndarray) -> Optional[dict]:
+        """Nearest gallery entry for a single embedding, with accept/reject flag."""
+        return self.best_matches(vec)[0]
+
+    def best_matches(self, queries: np.ndarray) -> List[Optional[dict]]:
+        """
+        Nearest gallery entry per query row. None when the gallery is empty or
+        the search found nothing for that row (approximate indexes mark such
+        rows with id -1).
+        """
+        ids, profile_ids, scores = self.search(queries, k=1)
+        if scores.shape[1] == 0:
+            return [None] * scores.shape[0]
+        matches: List[Optional[dict]] = []
+        for i in range(scores.shape[0]):
+            if ids[i, 0] < 0:  # nothing found (e.g. empty IVF lists probed)
+                matches.append(None)
+                continue
+            matches.append(
+                {
+                    "id": int(ids[i, 0]),
+                    "profile_id": int(profile_ids[i, 0]),
+                    "similarity": float(scores[i, 0]),
+                    "accepted": bool(scores[i, 0] >= self.threshold),
+                }
+            )
+        return matches
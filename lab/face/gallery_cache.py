@@ -0,0 +1,201 @@
+# lab/face/gallery_cache.py
+"""
+Process-wide gallery cache shared by all websocket connections.
+- Full load once at startup, then incremental refreshes
+- Startup maps the exported gallery snapshot (lab.face.snapshot) when there
+  is one and reads only the rows changed since, instead of the whole table
+- New rows are found with an (id, created_at) watermark; deletions by id diff
+- Each refresh builds a new GalleryIndex and swaps one reference (atomic read)
+- Optionally held as int8/float16 codes (GALLERY_CODES) with the float32
+  rows mapped for the exact re-rank; refreshes encode only the new rows
+"""
+
+import asyncio
+import threading
+import time
+from datetime import datetime
+from typing import Optional, Tuple
+
+from sqlalchemy import and_, func, or_
+
+from lab.db.models import FaceEmbedding
+from lab.db.test_database import SessionLocal, run_db_blocking
+from lab.face.gallery import GalleryIndex
+from lab.face.models_config import (
+    ANN_INDEX_PATH,
+    GALLERY_CODES,
+    GALLERY_REFRESH_SECONDS,
+    GALLERY_SEARCH_MODE,
+    GALLERY_SNAPSHOT_DIR,
+)
+
+
+class GalleryCache:
+    """Holds the current GalleryIndex; readers just use `cache.index`."""
+
+    def __init__(
+        self,
+        session_factory=SessionLocal,
+        refresh_interval: float = GALLERY_REFRESH_SECONDS,
+        search_mode: str = GALLERY_SEARCH_MODE,
+        codes: str = GALLERY_CODES,
+        snapshot_dir: str = GALLERY_SNAPSHOT_DIR,
+    ):
+        if search_mode not in ("exact", "ivf", "templates"):
+            raise ValueError(f"Unknown gallery search mode: {search_mode}")
+        self._session_factory = session_factory
+        self.refresh_interval = refresh_interval
+        self.search_mode = search_mode
+        self.codes = codes  # in-memory representation for exact search
+        self.snapshot_dir = snapshot_dir  # "" -> always load from the DB
+        self._index = GalleryIndex.empty()
+        self._max_id = 0
+        self._max_created_at: Optional[datetime] = None
+        self._refresh_lock = threading.Lock()  # one writer at a time
+        self._wakeup: Optional[asyncio.Event] = None
+        self.last_refresh = 0.0
+
+    @property
+    def index(self) -> GalleryIndex:
+        return self._index
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    # -------------------------------
+    # Loading
+    # -------------------------------
+    def _advance_watermark(self, rows) -> None:
+        for rec in rows:
+            self._max_id = max(self._max_id, rec.id)
+            if rec.created_at is not None and (
+                self._max_created_at is None or rec.created_at > self._max_created_at
+            ):
+                self._max_created_at = rec.created_at
+
+    def _changes(self, db, current: GalleryIndex):
+        """Rows past the watermark, and ids in `current` no longer in the DB."""
+        # created_at catches rowids reused after deleting the newest row
+        cond = FaceEmbedding.id > self._max_id
+        if self._max_created_at is not None:
+            cond = or_(cond, FaceEmbedding.created_at > self._max_created_at)
+        new_rows = db.query(FaceEmbedding).filter(cond).all()
+
+        # every row in `current` is at or below the watermark: if the DB still
+        # has that many of them, nothing was deleted and the id diff is skipped
+        old = FaceEmbedding.id <= self._max_id
+        if self._max_created_at is not None:
+            old = and_(
+                old,
+                or_(
+                    FaceEmbedding.created_at.is_(None),
+                    FaceEmbedding.created_at <= self._max_created_at,
+                ),
+            )
+        if db.query(func.count(FaceEmbedding.id)).filter(old).scalar() == len(current):
+            return new_rows, set()
+        live_ids = {row_id for (row_id,) in db.query(FaceEmbedding.id)}
+        return new_rows, set(current.ids.tolist()) - live_ids
+
+    def _load_snapshot(self, db) -> Optional[GalleryIndex]:
+        """Map the exported snapshot and apply the DB changes made since."""
+        from lab.face import snapshot
+
+        opened = snapshot.open_snapshot(self.snapshot_dir, self._index.threshold)
+        if opened is None:
+            return None
+        index, (self._max_id, self._max_created_at) = opened
+        new_rows, removed = self._changes(db, index)
+        if new_rows or removed:
+            added = GalleryIndex.from_records(new_rows, index.threshold)
+            index = index.merged(added, removed)
+            self._advance_watermark(new_rows)
+        print(
+            f"[INFO] Gallery snapshot mapped: {len(index.base)} embeddings, "
+            f"+{len(new_rows)} -{len(removed)} since export."
+        )
+        return index
+
+    def load(self) -> int:
+        """
+        Full load: the mapped snapshot plus its delta when one was exported,
+        else the whole face_embeddings table. Returns gallery size.
+        """
+        with self._refresh_lock:
+            db = self._session_factory()
+            try:
+                self._max_id, self._max_created_at = 0, None
+                index = self._load_snapshot(db) if self.snapshot_dir else None
+                if index is None:
+                    rows = db.query(FaceEmbedding).order_by(FaceEmbedding.id).all()
+                    index = GalleryIndex.from_records(rows, self._index.threshold)
+                    self._advance_watermark(rows)
+                if self.search_mode == "templates":
+                    from lab.face import templates
+
+                    index = templates.index_for_gallery(index, db)
+            finally:
+                db.close()
+            if self.search_mode == "ivf":
+                from lab.face.ann_index import index_for_gallery
+
+                index = index_for_gallery(index, ANN_INDEX_PATH)
+            elif self.search_mode == "exact" and self.codes != "float32":
+                from lab.face.gallery_codes import compress
+
+                index = compress(index, self.codes)
+            self._index = index
+            self.last_refresh = time.time()
+        print(
+            f"[INFO] Gallery loaded: {len(self._index)} embeddings "
+            f"({type(self._index).__name__})."
+        )
+        return len(self._index)
+
+    def refresh(self) -> Tuple[int, int]:
+        """
+        Pull only rows past the watermark plus the set of deleted ids.
+        Returns (added, removed). Safe to call from a worker thread.
+        """
+        with self._refresh_lock:
+            current = self._index
+            db = self._session_factory()
+            try:
+                new_rows, removed = self._changes(db, current)
+            finally:
+                db.close()
+
+            if new_rows or removed:
+                added = GalleryIndex.from_records(new_rows, current.threshold)
+                self._index = current.merged(added, removed)
+                self._advance_watermark(new_rows)
+            self.last_refresh = time.time()
+
+        if new_rows or removed:
+            print(
+                f"[INFO] Gallery refreshed: +{len(new_rows)} -{len(removed)} "
+                f"(size={len(self._index)})"
+            )
+        return len(new_rows), len(removed)
+
+    # -------------------------------
+    # Background refresh
+    # -------------------------------
+    def request_refresh(self) -> None:
+        """Signal the refresh loop to run now instead of waiting for the timer."""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def run_refresh_loop(self) -> None:
+        """Refresh on a timer or when signalled; DB work runs off the event loop."""
+        self._wakeup = asyncio.Event()
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.refresh_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await run_db_blocking(self.refresh)
+            except Exception as exc:  # keep serving the last good gallery
+                print(f"[WARN] Gallery refresh failed: {exc}")
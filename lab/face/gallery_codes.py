@@ -0,0 +1,261 @@
+# lab/face/gallery_codes.py
+"""
+Compressed in-memory gallery: scan float16 or int8 codes, re-rank exactly.
+- int8: 512 B + one float32 scale per face (per-vector max-abs scaling),
+  vs 2 KB float32; scans about as fast as float32 (decoded in small chunks)
+- float16: 1 KB per face, but numpy converts float16 in software so a full
+  scan is several times slower than float32
+- The best `rerank` rows per query are re-scored exactly against float32
+  rows that stay out of the process heap: the mapped gallery snapshot
+  (lab.face.snapshot), or an unlinked temp file mapped the same way when the
+  gallery came from the DB. Those pages sit in the OS page cache, shared
+  between processes and evictable; only the shortlist's rows are read
+- Ids and profile ids stay in parallel int64 arrays next to one contiguous
+  code matrix (no per-row Python objects)
+- CompressedIndex: drop-in for GalleryIndex (GALLERY_CODES in models_config)
+Usage:
+    python -m lab.face.gallery_codes report --synthetic 200000
+    python -m lab.face.gallery_codes report --codes int8 --rerank 8
+"""
+
+import argparse
+from typing import Iterable, Optional, Tuple
+
+import numpy as np
+
+from lab.db.embedding_codec import EMBEDDING_DIM
+from lab.face.gallery import GalleryIndex, l2_normalize
+from lab.face.models_config import GALLERY_CODES, GALLERY_RERANK
+from lab.face.snapshot import SnapshotIndex, map_private
+
+CODE_TYPES = ("int8", "float16")
+_SCAN_CHUNK = 512  # rows decoded per scan matmul (1 MB float32, stays in cache)
+_ENCODE_CHUNK = 65536  # mapped rows encoded at a time (32 MB float32)
+
+
+# -------------------------------
+# Encoding
+# -------------------------------
+def encode(matrix: np.ndarray, codes: str) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """
+    Normalized (N,512) float32 rows -> (codes, per-row scales or None).
+    int8 scales also undo the rounding's norm change, so decoded rows are
+    unit length and scan scores are cosines.
+    """
+    if codes == "float16":
+        return np.ascontiguousarray(matrix, dtype=np.float16), None
+    if codes == "int8":
+        scales = np.abs(matrix).max(axis=1) / 127.0
+        np.maximum(scales, np.finfo(np.float32).tiny, out=scales)
+        q = np.rint(matrix / scales[:, None])
+        scales /= np.maximum(np.linalg.norm(q * scales[:, None], axis=1), 1e-12)
+        return np.ascontiguousarray(q, dtype=np.int8), scales.astype(np.float32)
+    raise ValueError(f"Unknown gallery codes: {codes}")
+
+
+def decode(codes: np.ndarray, scales: Optional[np.ndarray]) -> np.ndarray:
+    """Codes -> float32 rows (unit length up to float16/int8 error)."""
+    out = codes.astype(np.float32)
+    if scales is not None:
+        out *= scales[:, None]
+    return out
+
+
+def _encode_source(source: SnapshotIndex, codes: str):
+    """Encode the live rows of `source` in order, a chunk of the mapping at a time."""
+    base = source.base.matrix
+    parts = []
+    for start in range(0, len(base), _ENCODE_CHUNK):
+        live = ~source.removed[start : start + _ENCODE_CHUNK]
+        parts.append(
+            encode(np.asarray(base[start : start + _ENCODE_CHUNK])[live], codes)
+        )
+    parts.append(encode(source.delta.matrix, codes))
+    scales = None if parts[0][1] is None else np.concatenate([p[1] for p in parts])
+    return np.ascontiguousarray(np.concatenate([p[0] for p in parts])), scales
+
+
+# -------------------------------
+# Compressed index
+# -------------------------------
+class CompressedIndex(GalleryIndex):
+    """
+    GalleryIndex over float16/int8 codes. `search` has the same contract
+    (ids, profile_ids, scores); scores are exact float32 cosines from the
+    re-rank. Code row j is live row j of `source`, the mapped float32 gallery.
+    """
+
+    def __init__(
+        self, base: GalleryIndex, codes: str = "int8", rerank: int = GALLERY_RERANK
+    ):
+        self.source = base if isinstance(base, SnapshotIndex) else map_private(base)
+        self.threshold = base.threshold
+        self.code_type = codes
+        self.rerank = rerank
+        self.codes, self.scales = _encode_source(self.source, codes)
+
+    @classmethod
+    def _from_codes(cls, source, codes, scales, code_type, rerank):
+        index = cls.__new__(cls)
+        index.source, index.codes, index.scales = source, codes, scales
+        index.code_type, index.rerank = code_type, rerank
+        index.threshold = source.threshold
+        return index
+
+    @property
+    def ids(self) -> np.ndarray:
+        return self.source.ids
+
+    @property
+    def profile_ids(self) -> np.ndarray:
+        return self.source.profile_ids
+
+    @property
+    def matrix(self) -> np.ndarray:
+        """Exact float32 rows. Materializes the full matrix: tools only."""
+        return self.source.matrix
+
+    @property
+    def nbytes(self) -> int:
+        """Private memory; the mapped float32 rows live in the page cache."""
+        total = self.codes.nbytes + self.source.nbytes
+        return total + (0 if self.scales is None else self.scales.nbytes)
+
+    def __len__(self) -> int:
+        return self.codes.shape[0]
+
+    def merged(self, added: GalleryIndex, removed_ids: Iterable[int] = ()):
+        """
+        Apply an incremental update; only the added rows are encoded. Rows
+        keep the source's live order: kept rows, then `added`.
+        """
+        removed_ids = np.asarray(list(removed_ids), np.int64)
+        keep = ~np.isin(self.ids, np.union1d(removed_ids, added.ids))
+        codes, scales = encode(added.matrix, self.code_type)
+        if scales is not None:
+            scales = np.concatenate([self.scales[keep], scales])
+        return CompressedIndex._from_codes(
+            self.source.merged(added, removed_ids),
+            np.ascontiguousarray(np.concatenate([self.codes[keep], codes])),
+            scales,
+            self.code_type,
+            self.rerank,
+        )
+
+    def scan(self, q: np.ndarray) -> np.ndarray:
+        """Approximate (Q,N) similarities straight from the codes."""
+        sims = np.empty((q.shape[0], len(self)), np.float32)
+        for start in range(0, len(self), _SCAN_CHUNK):
+            chunk = self.codes[start : start + _SCAN_CHUNK].astype(np.float32)
+            sims[:, start : start + len(chunk)] = q @ chunk.T
+        if self.scales is not None:
+            sims *= self.scales
+        return sims
+
+    def search(
+        self, queries: np.ndarray, k: int = 1, rerank: Optional[int] = None
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Top-k: scan the codes, re-rank max(k, rerank) rows on exact float32."""
+        q = l2_normalize(np.atleast_2d(queries))
+        n = len(self)
+        k = max(0, min(k, n))
+        r = max(k, min(self.rerank if rerank is None else rerank, n))
+        if k == 0:
+            shape = (q.shape[0], 0)
+            return (
+                np.empty(shape, np.int64),
+                np.empty(shape, np.int64),
+                np.empty(shape, np.float32),
+            )
+
+        sims = self.scan(q)
+        if r < n:
+            cand = np.argpartition(-sims, r - 1, axis=1)[:, :r]
+        else:
+            cand = np.broadcast_to(np.arange(n), (q.shape[0], n))
+
+        # (Q,r,512) exact rows of the shortlist, read from the mapping
+        ids, profile_ids, rows = self.source.rows(cand)
+        exact = np.einsum("qrd,qd->qr", rows, q)
+
+        order = np.argsort(-exact, axis=1)[:, :k]
+        return (
+            np.take_along_axis(ids, order, axis=1),
+            np.take_along_axis(profile_ids, order, axis=1),
+            np.take_along_axis(exact, order, axis=1),
+        )
+
+
+def compress(
+    base: GalleryIndex, codes: str = GALLERY_CODES, rerank: int = GALLERY_RERANK
+) -> GalleryIndex:
+    """Wrap a float32 gallery per GALLERY_CODES ("float32" leaves it as is)."""
+    if codes == "float32":
+        return base
+    index = CompressedIndex(base, codes, rerank)
+    print(
+        f"[INFO] Gallery codes: {codes}, {len(base) * EMBEDDING_DIM * 4 / 2**20:.1f}"
+        f" MB float32 mapped for re-rank, {index.nbytes / 2**20:.1f} MB in memory"
+    )
+    return index
+
+
+# -------------------------------
+# Report: memory and recall vs float32
+# -------------------------------
+def report(
+    base: GalleryIndex,
+    queries: np.ndarray,
+    code_types=CODE_TYPES,
+    reranks=(0, 32, 128),
+    k: int = 10,
+) -> list:
+    """Memory, recall@1 / recall@k and per-query latency vs float32 search."""
+    from lab.face.ann_index import _search_each
+
+    exact_ids, exact_ms = _search_each(base, queries, k)
+    rows = [("float32", "-", base.nbytes, 1.0, 1.0, exact_ms)]
+    for codes in code_types:
+        index = CompressedIndex(base, codes)
+        for rerank in reranks:
+            got, ms = _search_each(index, queries, k, rerank=rerank)
+            r1 = float(np.mean(got[:, 0] == exact_ids[:, 0]))
+            rk = float(
+                np.mean([len(np.intersect1d(a, e)) / k for a, e in zip(got, exact_ids)])
+            )
+            rows.append((codes, max(rerank, k), index.nbytes, r1, rk, ms))
+
+    print(f"[INFO] N={len(base)}, queries={len(queries)} (MB: process heap only)")
+    print(
+        f"{'codes':<8} {'rerank':>6} {'MB':>8} {'B/face':>7} "
+        f"{'recall@1':>9} {f'recall@{k}':>10} {'ms/query':>9}"
+    )
+    for codes, rerank, nbytes, r1, rk, ms in rows:
+        print(
+            f"{codes:<8} {rerank:>6} {nbytes / 2**20:>8.1f} "
+            f"{nbytes / max(len(base), 1):>7.0f} {r1:>9.4f} {rk:>10.4f} {ms:>9.3f}"
+        )
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compressed gallery tools")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    r = sub.add_parser("report", help="memory and recall vs float32 search")
+    r.add_argument("--synthetic", type=int, default=100000)
+    r.add_argument("--queries", type=int, default=200)
+    r.add_argument("--codes", choices=CODE_TYPES, action="append")
+    r.add_argument("--rerank", type=int, action="append")
+    r.add_argument("--k", type=int, default=10)
+    args = parser.parse_args()
+
+    from lab.face.ann_index import synthetic_gallery
+
+    base, queries = synthetic_gallery(args.synthetic, args.queries)
+    report(
+        base,
+        queries,
+        tuple(args.codes or CODE_TYPES),
+        tuple(args.rerank or (0, 32, 128)),
+        k=args.k,
+    )
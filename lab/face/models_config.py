@@ -10,11 +10,98 @@ DETECTION_MODEL_LIGHT = str(MODELS_DIR / "det_10g.onnx")  # optional light
 EMBEDDING_MODEL_PATH = str(MODELS_DIR / "w600k_r50.onnx")  # ArcFace
 GENDERAGE_MODEL_PATH = str(MODELS_DIR / "genderage.onnx")  # aux
 
+# INT8 models (built by `python -m lab.face.quantize`)
+USE_INT8_MODELS = False
+DETECTION_MODEL_INT8 = str(MODELS_DIR / "scrfd.int8.onnx")
+EMBEDDING_MODEL_INT8 = str(MODELS_DIR / "w600k_r50.int8.onnx")
+
+# onnxruntime session
+ORT_PROVIDERS = ["CPUExecutionProvider"]
+ORT_INTRA_OP_THREADS = 0  # 0 -> onnxruntime default (physical cores)
+ORT_INTER_OP_THREADS = 0  # only used in "parallel" execution mode
+ORT_EXECUTION_MODE = "sequential"  # "sequential" | "parallel"
+ORT_GRAPH_OPT_LEVEL = "all"  # "disable" | "basic" | "extended" | "all"
+ORT_ENABLE_CPU_MEM_ARENA = True
+ORT_ENABLE_MEM_PATTERN = True
+ORT_OPTIMIZED_MODEL_DIR = str(MODELS_DIR / "optimized")  # host-specific; "" disables
+ORT_WARMUP_RUNS = 3  # dummy runs at startup
+
 # image sizes
 TARGET_DETECTION_SIZE = (640, 640)  # tune per model
 ARCFACE_INPUT_SIZE = (112, 112)  # ArcFace standard
+LETTERBOX_DETECTION = False  # keep aspect ratio (pad) for the detector input
+
+# batching
+EMBEDDING_MAX_BATCH = 32  # max face crops per ArcFace run
+
+# detection mode
+DETECTION_MODE = "single"  # "single" (main SCRFD) | "cascade" (det_10g first)
+CASCADE_LIGHT_SIZES = [(320, 320), (256, 256), (192, 192)]  # by load level
+CASCADE_MAIN_SIZES = [(640, 640), (480, 480), (320, 320)]  # by load level
+CASCADE_LIGHT_MIN_SCORE = 0.30  # light-pass floor; below this counts as "no face"
+CASCADE_CONFIDENT_SCORE = 0.70  # light-pass faces below this are ambiguous
+CASCADE_LATENCY_BUDGET_MS = 40.0  # detection time that counts as full load
+
+# inference workers (websocket server)
+INFERENCE_POOL_MODE = "thread"  # "thread" | "process"
+# thread workers share one set of sessions; process workers load one each
+INFERENCE_WORKERS = 2  # concurrent jobs; 0 -> os.cpu_count()
+INFERENCE_QUEUE_SIZE = 8  # jobs allowed to wait beyond the running ones
+
+# micro-batching across connections (websocket server)
+MICROBATCH_DET_MAX = 8  # frames per detector run
+MICROBATCH_DET_WAIT_MS = 4.0  # max time the oldest frame waits for a batch
+MICROBATCH_EMB_MAX = EMBEDDING_MAX_BATCH  # face crops per ArcFace run
+MICROBATCH_EMB_WAIT_MS = 2.0
+
+# backpressure / flow control (websocket server)
+FLOW_WINDOW_FRAMES = 30  # recent frames used for the drop ratio
+FLOW_DROP_RATIO_HIGH = 0.25  # above this the client is asked to slow down
+FLOW_CONTROL_INTERVAL_S = 2.0  # min time between flow-control messages
+FLOW_QUALITY_STEP = 10  # suggested JPEG quality change per message
+STREAM_PIPELINE_DEPTH = 2  # frames of one connection in flight at once
+
+# metrics (websocket server, Prometheus text format on the stream port)
+METRICS_PATH = "/metrics"
+METRICS_PREFIX = "gymy"
+# per-stage latency histogram buckets (ms)
+METRICS_BUCKETS_MS = (0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+# bulk enrollment (lab.face.enroll)
+ENROLL_WORKERS = 0  # 0 -> os.cpu_count()
+ENROLL_IMAGES_PER_JOB = 16  # images decoded/detected/embedded per worker job
+ENROLL_INSERT_CHUNK = 1000  # rows per INSERT transaction
+ENROLL_DUPLICATE_SIMILARITY = 0.95  # same-profile cosine at/above this is skipped
+
+# tracking (websocket server)
+TRACK_IOU_THRESHOLD = 0.3  # min IoU to link a detection to a track
+TRACK_REEMBED_EVERY = 15  # frames between re-embeddings of an identified track
+TRACK_REEMBED_IOU = 0.5  # re-embed early if the box drifted below this IoU
+TRACK_MAX_MISSES = 5  # frames a track survives without a detection
 
 # thresholds
 CONF_THRESHOLD = 0.5
 NMS_IOU_THRESHOLD = 0.45
 COSINE_LOGIN_THRESHOLD = 0.40
+
+# gallery cache
+GALLERY_REFRESH_SECONDS = 5.0  # incremental DB poll interval
+# mapped on load when exported (`python -m lab.face.snapshot export`); "" disables
+GALLERY_SNAPSHOT_DIR = str(ROOT / "index" / "gallery_snapshot")
+GALLERY_SNAPSHOT_KEEP = 2  # versions kept on disk after an export
+
+# gallery search
+GALLERY_SEARCH_MODE = "exact"  # "exact" | "ivf" (approximate) | "templates"
+ANN_INDEX_PATH = str(ROOT / "index" / "gallery_ivf.npz")
+IVF_NLIST = 0  # inverted lists; 0 -> ~4*sqrt(N)
+IVF_NPROBE = 8  # lists scanned per query (recall vs latency)
+# compressed gallery (lab.face.gallery_codes), exact search mode only:
+# "float32" | "int8" (1/4 memory) | "float16" (1/2, slow scan); float32 rows
+# stay mapped (snapshot or temp file) for the exact re-rank
+GALLERY_CODES = "float32"
+GALLERY_RERANK = 32  # scan rows per query re-ranked exactly on float32
+
+# profile templates (lab.face.templates, GALLERY_SEARCH_MODE = "templates")
+TEMPLATE_MEDOIDS = 0  # k-medoid sub-templates per profile besides the centroid
+TEMPLATE_MEDOID_MIN_EMBEDDINGS = 6  # smaller profiles keep the centroid only
+TEMPLATE_CANDIDATES = 16  # profiles per query re-ranked on raw embeddings
@@ -5,8 +5,11 @@ Pipeline for face detection and embedding extraction using ONNX models.
 - ArcFace: Face embedding (512-dim vector)
 """
 
+import os
+import threading
+import time
 from pathlib import Path
-from typing import List, Tuple
+from typing import Dict, List, Optional, Tuple
 
 import cv2
 import numpy as np
@@ -15,15 +18,33 @@ import onnxruntime as ort
 from lab.face.models_config import (
     ARCFACE_INPUT_SIZE,
     CONF_THRESHOLD,
+    DETECTION_MODEL_INT8,
+    DETECTION_MODEL_LIGHT,
     DETECTION_MODEL_PATH,
+    EMBEDDING_MAX_BATCH,
+    EMBEDDING_MODEL_INT8,
     EMBEDDING_MODEL_PATH,
+    LETTERBOX_DETECTION,
     NMS_IOU_THRESHOLD,
+    ORT_ENABLE_CPU_MEM_ARENA,
+    ORT_ENABLE_MEM_PATTERN,
+    ORT_EXECUTION_MODE,
+    ORT_GRAPH_OPT_LEVEL,
+    ORT_INTER_OP_THREADS,
+    ORT_INTRA_OP_THREADS,
+    ORT_OPTIMIZED_MODEL_DIR,
+    ORT_PROVIDERS,
+    ORT_WARMUP_RUNS,
     TARGET_DETECTION_SIZE,
+    USE_INT8_MODELS,
 )
+from lab.face.preprocess import boxes_to_original, get_preprocessor
+from lab.face.scrfd import decode_scrfd, decode_scrfd_batch
 
 # --- Global sessions ---
 _det_session = None
 _emb_session = None
+_det_light_session = None
 
 
 # -------------------------------
@@ -37,20 +58,6 @@ def _ensure_exists(path_str: str, label: str) -> str:
     return str(p)
 
 
-def _to_xyxy(box: np.ndarray) -> List[float]:
-    """
-    Convert a box to [x1, y1, x2, y2].
-    If the provided box looks like [x, y, w, h] (i.e., x2<=x1 or y2<=y1),
-    convert it to [x, y, x+w, y+h]. Otherwise, assume it's already [x1,y1,x2,y2].
-    """
-    x1, y1, x2, y2 = float(box[0]), float(box[1]), float(box[2]), float(box[3])
-    if x2 <= x1 or y2 <= y1:
-        # Interpret as [x, y, w, h]
-        x2 = x1 + max(0.0, x2)
-        y2 = y1 + max(0.0, y2)
-    return [x1, y1, x2, y2]
-
-
 def _clip_box_xyxy(box_xyxy: List[float], img_shape: Tuple[int, int, int]) -> List[int]:
     """
     Clip box coordinates to image bounds and convert to ints.
@@ -78,30 +85,156 @@ def _valid_box(box_xyxy: List[int]) -> bool:
 # -------------------------------
 # Model initialization
 # -------------------------------
+_GRAPH_OPT_LEVELS = {
+    "disable": ort.GraphOptimizationLevel.ORT_DISABLE_ALL,
+    "basic": ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+    "extended": ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+    "all": ort.GraphOptimizationLevel.ORT_ENABLE_ALL,
+}
+_EXECUTION_MODES = {
+    "sequential": ort.ExecutionMode.ORT_SEQUENTIAL,
+    "parallel": ort.ExecutionMode.ORT_PARALLEL,
+}
+
+
+def _optimized_cache_path(model_path: str) -> Path:
+    """Cache file keyed by model name, opt level and onnxruntime version."""
+    p = Path(model_path)
+    tag = f"{ORT_GRAPH_OPT_LEVEL}-ort{ort.__version__}"
+    return Path(ORT_OPTIMIZED_MODEL_DIR) / f"{p.stem}.{tag}.onnx"
+
+
+def build_session_options(
+    model_path: str, intra_op_threads: Optional[int] = None, use_cache: bool = True
+) -> Tuple[ort.SessionOptions, str]:
+    """
+    Session options from models_config, plus the file to load.
+    If an optimized copy newer than the source model is cached, it is loaded
+    with graph optimization disabled; otherwise ORT writes one on first load.
+    `use_cache=False` skips the cache (e.g. throwaway benchmark models).
+    """
+    so = ort.SessionOptions()
+    so.intra_op_num_threads = (
+        ORT_INTRA_OP_THREADS if intra_op_threads is None else intra_op_threads
+    )
+    so.inter_op_num_threads = ORT_INTER_OP_THREADS
+    so.execution_mode = _EXECUTION_MODES[ORT_EXECUTION_MODE]
+    so.graph_optimization_level = _GRAPH_OPT_LEVELS[ORT_GRAPH_OPT_LEVEL]
+    so.enable_cpu_mem_arena = ORT_ENABLE_CPU_MEM_ARENA
+    so.enable_mem_pattern = ORT_ENABLE_MEM_PATTERN
+
+    if not use_cache or not ORT_OPTIMIZED_MODEL_DIR or ORT_GRAPH_OPT_LEVEL == "disable":
+        return so, model_path
+
+    cached = _optimized_cache_path(model_path)
+    if cached.exists() and cached.stat().st_mtime >= Path(model_path).stat().st_mtime:
+        so.graph_optimization_level = ort.GraphOptimizationLevel.ORT_DISABLE_ALL
+        return so, str(cached)
+
+    cached.parent.mkdir(parents=True, exist_ok=True)
+    # unique temp name: several workers may build the same cache at once
+    so.optimized_model_filepath = f"{cached}.{os.getpid()}.{threading.get_ident()}"
+    return so, model_path
+
+
+def create_session(
+    model_path: str,
+    label: str,
+    intra_op_threads: Optional[int] = None,
+    use_cache: bool = True,
+) -> ort.InferenceSession:
+    """Create an InferenceSession with the configured options and providers."""
+    path = _ensure_exists(model_path, label)
+    so, load_path = build_session_options(path, intra_op_threads, use_cache)
+    session = ort.InferenceSession(load_path, sess_options=so, providers=ORT_PROVIDERS)
+    if so.optimized_model_filepath and Path(so.optimized_model_filepath).exists():
+        os.replace(so.optimized_model_filepath, _optimized_cache_path(path))
+    return session
+
+
+def create_detection_session(**kwargs) -> ort.InferenceSession:
+    """Main SCRFD session (INT8 variant when USE_INT8_MODELS is set)."""
+    if USE_INT8_MODELS:
+        return create_session(DETECTION_MODEL_INT8, "SCRFD INT8 model", **kwargs)
+    return create_session(DETECTION_MODEL_PATH, "SCRFD model", **kwargs)
+
+
+def create_embedding_session(**kwargs) -> ort.InferenceSession:
+    """ArcFace session (INT8 variant when USE_INT8_MODELS is set)."""
+    if USE_INT8_MODELS:
+        return create_session(EMBEDDING_MODEL_INT8, "ArcFace INT8 model", **kwargs)
+    return create_session(EMBEDDING_MODEL_PATH, "ArcFace model", **kwargs)
+
+
+def create_light_detection_session(**kwargs) -> ort.InferenceSession:
+    """Light det_10g session used by the detector cascade."""
+    return create_session(DETECTION_MODEL_LIGHT, "det_10g model", **kwargs)
+
+
 def initialize_onnx_sessions():
     """Initialize ONNX sessions for detection and embedding models."""
     global _det_session, _emb_session
 
     if _det_session is None:
-        det_path = _ensure_exists(DETECTION_MODEL_PATH, "SCRFD model")
-        _det_session = ort.InferenceSession(
-            det_path, providers=["CPUExecutionProvider"]
-        )
+        _det_session = create_detection_session()
 
     if _emb_session is None:
-        emb_path = _ensure_exists(EMBEDDING_MODEL_PATH, "ArcFace model")
-        _emb_session = ort.InferenceSession(
-            emb_path, providers=["CPUExecutionProvider"]
-        )
+        _emb_session = create_embedding_session()
 
     return _det_session, _emb_session
 
 
+def initialize_light_detector():
+    """Initialize the light det_10g session used by the detector cascade."""
+    global _det_light_session
+
+    if _det_light_session is None:
+        _det_light_session = create_light_detection_session()
+    return _det_light_session
+
+
+def session_input_size(
+    session: ort.InferenceSession, default: Tuple[int, int]
+) -> Tuple[int, int]:
+    """Model input (w, h) if the graph fixes it, else `default`."""
+    shape = session.get_inputs()[0].shape
+    h, w = shape[2], shape[3]
+    if isinstance(h, int) and isinstance(w, int) and h > 0 and w > 0:
+        return (w, h)
+    return default
+
+
+def warmup_sessions(
+    det_session: ort.InferenceSession,
+    emb_session: ort.InferenceSession,
+    runs: int = ORT_WARMUP_RUNS,
+) -> None:
+    """
+    Run dummy inputs through both models so memory arenas and kernels are
+    set up before the first real frame.
+    """
+    w, h = TARGET_DETECTION_SIZE
+    det_input = np.zeros((1, 3, h, w), dtype=np.float32)
+    det_name = det_session.get_inputs()[0].name
+
+    ew, eh = ARCFACE_INPUT_SIZE
+    emb_batch = _session_batch_dim(emb_session) or 1
+    emb_input = np.zeros((emb_batch, 3, eh, ew), dtype=np.float32)
+    emb_name = emb_session.get_inputs()[0].name
+
+    for _ in range(max(0, runs)):
+        det_session.run(None, {det_name: det_input})
+        emb_session.run(None, {emb_name: emb_input})
+
+
 # -------------------------------
 # Preprocessing
 # -------------------------------
 def preprocess_for_onnx(image: np.ndarray, target_size: tuple[int, int]) -> np.ndarray:
-    """Resize, normalize, and convert image to ONNX input format."""
+    """
+    Resize, normalize, and convert image to ONNX input format.
+    Returns a fresh array; hot paths use lab.face.preprocess.Preprocessor instead.
+    """
     resized = cv2.resize(image, target_size)
     rgb_image = cv2.cvtColor(resized, cv2.COLOR_BGR2RGB)
     normalized = rgb_image.astype(np.float32) / 255.0
@@ -113,68 +246,97 @@ def preprocess_for_onnx(image: np.ndarray, target_size: tuple[int, int]) -> np.n
 # -------------------------------
 # Detection helpers
 # -------------------------------
-def decode_scrfd_outputs(outputs, conf_threshold=0.5) -> List[np.ndarray]:
+def decode_scrfd_outputs(
+    outputs, conf_threshold=CONF_THRESHOLD, input_size=TARGET_DETECTION_SIZE
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
     """
-    Decode SCRFD outputs (boxes, scores).
-    SCRFD ONNX usually has multiple outputs: boxes, scores, landmarks.
-    Returns filtered boxes (as float arrays) after confidence threshold and NMS.
+    Decode SCRFD outputs (scores, box distances, landmarks per stride).
+    Returns (boxes (K,4) xyxy, scores (K,), landmarks (K,5,2)) in model-input
+    pixels, after confidence threshold and NMS.
     """
-    all_boxes, all_scores = [], []
-
-    for out in outputs:
-        shape = out.shape
-        if shape[-1] == 4:  # boxes
-            all_boxes.append(out.reshape(-1, 4))
-        elif shape[-1] == 1 or len(shape) == 1:  # scores
-            all_scores.append(out.reshape(-1))
-
-    if not all_boxes or not all_scores:
-        return []
-
-    boxes = np.vstack(all_boxes).astype(np.float32)  # (N,4)
-    scores = np.hstack(all_scores).astype(np.float32)  # (N,)
+    return decode_scrfd(outputs, input_size, conf_threshold, NMS_IOU_THRESHOLD)
 
-    keep = scores > conf_threshold
-    boxes = boxes[keep]
-    scores = scores[keep]
 
-    if len(boxes) == 0:
-        return []
-
-    indices = cv2.dnn.NMSBoxes(
-        bboxes=boxes.tolist(),
-        scores=scores.tolist(),
-        score_threshold=conf_threshold,
-        nms_threshold=NMS_IOU_THRESHOLD,
+def detect_faces_full(
+    det_session: ort.InferenceSession,
+    frame_bgr: np.ndarray,
+    input_size: Tuple[int, int] = TARGET_DETECTION_SIZE,
+    conf_threshold: float = CONF_THRESHOLD,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Run SCRFD detection on a frame at model input size (w, h).
+    Returns (boxes, scores, landmarks) arrays in original frame coordinates.
+    """
+    prep = get_preprocessor(input_size, LETTERBOX_DETECTION)
+    inp, (transform,) = prep([frame_bgr])
+    input_name = det_session.get_inputs()[0].name
+    outputs = det_session.run(None, {input_name: inp})
+    boxes, scores, landmarks = decode_scrfd_outputs(outputs, conf_threshold, input_size)
+    return (
+        boxes_to_original(boxes, transform),
+        scores,
+        boxes_to_original(landmarks, transform),
     )
 
-    if len(indices) == 0:
-        return []
-
-    # Normalize indices to a flat list
-    flat_indices = []
-    for i in indices:
-        if isinstance(i, (list, tuple, np.ndarray)):
-            flat_indices.append(int(i[0]))
-        else:
-            flat_indices.append(int(i))
 
-    filtered_boxes = [boxes[idx] for idx in flat_indices]
-    return filtered_boxes
+def detect_faces_batch(
+    det_session: ort.InferenceSession,
+    frames_bgr: List[np.ndarray],
+    input_size: Tuple[int, int] = TARGET_DETECTION_SIZE,
+    conf_threshold: float = CONF_THRESHOLD,
+    timings: Optional[Dict[str, float]] = None,
+) -> List[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+    """
+    Batched detect_faces_full: frames are stacked into (B,3,H,W) and the
+    detector runs once per chunk (chunk = the model's fixed batch, if any).
+    If `timings` is given, seconds spent in "preprocess", "detect" and "nms"
+    (SCRFD decode + NMS) are added to it.
+    """
+    if not frames_bgr:
+        return []
+    chunk = _session_batch_dim(det_session) or len(frames_bgr)
+    input_name = det_session.get_inputs()[0].name
+    prep = get_preprocessor(input_size, LETTERBOX_DETECTION)
+    spent = {"preprocess": 0.0, "detect": 0.0, "nms": 0.0}
+
+    results = []
+    for start in range(0, len(frames_bgr), chunk):
+        frames = frames_bgr[start : start + chunk]
+        t0 = time.perf_counter()
+        inp, transforms = prep(frames)
+        t1 = time.perf_counter()
+        outputs = det_session.run(None, {input_name: inp})
+        t2 = time.perf_counter()
+        decoded = decode_scrfd_batch(
+            outputs, input_size, conf_threshold, NMS_IOU_THRESHOLD, len(frames)
+        )
+        spent["preprocess"] += t1 - t0
+        spent["detect"] += t2 - t1
+        spent["nms"] += time.perf_counter() - t2
+        for (boxes, scores, landmarks), transform in zip(decoded, transforms):
+            results.append(
+                (
+                    boxes_to_original(boxes, transform),
+                    scores,
+                    boxes_to_original(landmarks, transform),
+                )
+            )
+    if timings is not None:
+        for stage, seconds in spent.items():
+            timings[stage] = timings.get(stage, 0.0) + seconds
+    return results
 
 
 def detect_faces(
     det_session: ort.InferenceSession, frame_bgr: np.ndarray
 ) -> List[List[int]]:
     """
-    Run SCRFD detection on a frame, return raw bounding boxes as ints.
+    Run SCRFD detection on a frame, return raw bounding boxes as ints
+    in original frame coordinates.
     Note: Boxes are returned without clipping to image size; clipping happens before crop.
     """
-    inp = preprocess_for_onnx(frame_bgr, TARGET_DETECTION_SIZE)
-    input_name = det_session.get_inputs()[0].name
-    outputs = det_session.run(None, {input_name: inp})
-    boxes = decode_scrfd_outputs(outputs, CONF_THRESHOLD)
-    return [list(map(int, _to_xyxy(box))) for box in boxes]
+    boxes, _, _ = detect_faces_full(det_session, frame_bgr)
+    return boxes.astype(np.int64).tolist()
 
 
 # -------------------------------
@@ -196,15 +358,50 @@ def get_face_embedding(
     return emb.flatten()
 
 
-def extract_embeddings_from_frame(frame_bgr: np.ndarray) -> List[np.ndarray]:
+def _session_batch_dim(session: ort.InferenceSession):
+    """Fixed batch size of the first model input, or None if dynamic."""
+    dim = session.get_inputs()[0].shape[0]
+    return dim if isinstance(dim, int) and dim > 0 else None
+
+
+def get_face_embeddings_batch(
+    emb_session: ort.InferenceSession,
+    face_imgs_bgr: List[np.ndarray],
+    max_batch: int = EMBEDDING_MAX_BATCH,
+) -> np.ndarray:
     """
-    Detect faces in a frame and return embeddings for each.
-    Includes box normalization and clipping to avoid empty crops.
+    Extract embeddings for many cropped faces, stacking them into
+    (B,3,112,112) tensors so ArcFace runs once per chunk of `max_batch`.
+    Returns an (N,512) array in input order.
     """
-    det_session, emb_session = initialize_onnx_sessions()
-    raw_boxes = detect_faces(det_session, frame_bgr)
+    if not face_imgs_bgr:
+        return np.zeros((0, 512), dtype=np.float32)
+
+    # Models exported with a fixed batch of 1 cannot take stacked inputs
+    fixed = _session_batch_dim(emb_session)
+    if fixed is not None:
+        max_batch = fixed
+    max_batch = max(1, max_batch)
+
+    input_name = emb_session.get_inputs()[0].name
+    # resize (align) + normalize straight into a reused (N,3,112,112) buffer
+    batch, _ = get_preprocessor(ARCFACE_INPUT_SIZE)(face_imgs_bgr)
+
+    outputs = []
+    for start in range(0, batch.shape[0], max_batch):
+        chunk = batch[start : start + max_batch]
+        outputs.append(emb_session.run(None, {input_name: chunk})[0])
+    return np.concatenate(outputs).reshape(len(face_imgs_bgr), -1)
+
 
-    embeddings = []
+def crop_faces(
+    frame_bgr: np.ndarray, raw_boxes: List[List[int]]
+) -> Tuple[List[np.ndarray], List[List[int]]]:
+    """
+    Clip boxes to the frame and cut out non-empty face crops.
+    Returns (crops, clipped_boxes) with matching order.
+    """
+    crops, kept = [], []
     for box in raw_boxes:
         # Clip to image bounds and ensure positive area
         clipped = _clip_box_xyxy(box, frame_bgr.shape)
@@ -216,11 +413,23 @@ def extract_embeddings_from_frame(frame_bgr: np.ndarray) -> List[np.ndarray]:
         if crop.size == 0:
             continue
 
-        vec = get_face_embedding(emb_session, crop)
-        if sanity_check_embedding(vec):
-            embeddings.append(vec)
+        crops.append(crop)
+        kept.append(clipped)
+    return crops, kept
+
+
+def extract_embeddings_from_frame(frame_bgr: np.ndarray) -> List[np.ndarray]:
+    """
+    Detect faces in a frame and return embeddings for each.
+    Includes box normalization and clipping to avoid empty crops.
+    All faces are embedded in a single batched ArcFace run.
+    """
+    det_session, emb_session = initialize_onnx_sessions()
+    raw_boxes = detect_faces(det_session, frame_bgr)
 
-    return embeddings
+    crops, _ = crop_faces(frame_bgr, raw_boxes)
+    vecs = get_face_embeddings_batch(emb_session, crops)
+    return [vec for vec in vecs if sanity_check_embedding(vec)]
 
 
 # -------------------------------
@@ -0,0 +1,111 @@
+# lab/face/preprocess.py
+"""
+Allocation-free preprocessing for ONNX inputs.
+- One pre-allocated NCHW float32 blob per preprocessor, grown to the largest batch seen
+- Resize, BGR->RGB, /255 scaling and HWC->CHW happen in a single pass into the blob
+- Optional letterbox keeps aspect ratio; transforms map boxes back to the frame
+"""
+
+import threading
+from typing import Dict, List, Sequence, Tuple
+
+import cv2
+import numpy as np
+
+# (scale_x, scale_y, pad_x, pad_y): model = original * scale + pad
+Transform = Tuple[float, float, float, float]
+
+_SCALE = np.float32(255.0)
+
+
+class Preprocessor:
+    """
+    Reusable preprocessor for one model input size (w, h).
+    The returned blob is a view on an internal buffer: it is only valid until
+    the next call, so use it (session.run) before preprocessing again.
+    """
+
+    def __init__(
+        self, target_size: Tuple[int, int], letterbox: bool = False, pad_value=0
+    ):
+        self.target_size = target_size  # cv2 order (w, h)
+        self.letterbox = letterbox
+        self.pad_value = np.float32(pad_value) / _SCALE
+        w, h = target_size
+        self._blob = np.empty((0, 3, h, w), dtype=np.float32)
+        self._resized: Dict[Tuple[int, int], np.ndarray] = {}
+
+    def _blob_for(self, n: int) -> np.ndarray:
+        if self._blob.shape[0] < n:
+            w, h = self.target_size
+            self._blob = np.empty((n, 3, h, w), dtype=np.float32)
+        return self._blob[:n]
+
+    def _resize(self, image: np.ndarray, size: Tuple[int, int]) -> np.ndarray:
+        """cv2.resize into a cached uint8 buffer for this output size."""
+        if image.shape[1] == size[0] and image.shape[0] == size[1]:
+            return image
+        buf = self._resized.get(size)
+        if buf is None:
+            buf = self._resized[size] = np.empty((size[1], size[0], 3), np.uint8)
+        cv2.resize(image, size, dst=buf)
+        return buf
+
+    def __call__(
+        self, images: Sequence[np.ndarray]
+    ) -> Tuple[np.ndarray, List[Transform]]:
+        """BGR uint8 images -> ((N,3,H,W) float32 RGB in [0,1], transforms)."""
+        if isinstance(images, np.ndarray) and images.ndim == 3:
+            images = [images]
+        w, h = self.target_size
+        blob = self._blob_for(len(images))
+        transforms = []
+
+        for i, img in enumerate(images):
+            ih, iw = img.shape[:2]
+            if self.letterbox:
+                scale = min(w / iw, h / ih)
+                nw, nh = max(1, round(iw * scale)), max(1, round(ih * scale))
+                px, py = (w - nw) // 2, (h - nh) // 2
+                blob[i].fill(self.pad_value)
+                transforms.append((nw / iw, nh / ih, float(px), float(py)))
+            else:
+                nw, nh, px, py = w, h, 0, 0
+                transforms.append((w / iw, h / ih, 0.0, 0.0))
+
+            resized = self._resize(img, (nw, nh))
+            for c in range(3):  # BGR -> RGB while converting to CHW float
+                np.divide(
+                    resized[:, :, 2 - c],
+                    _SCALE,
+                    out=blob[i, c, py : py + nh, px : px + nw],
+                    dtype=np.float32,
+                    casting="unsafe",
+                )
+        return blob, transforms
+
+
+def boxes_to_original(boxes: np.ndarray, transform: Transform) -> np.ndarray:
+    """Map (N,4+) xyxy boxes (and x,y pairs after) from model space to the frame."""
+    sx, sy, px, py = transform
+    out = np.array(boxes, dtype=np.float32, copy=True)
+    out[..., 0::2] = (out[..., 0::2] - px) / sx
+    out[..., 1::2] = (out[..., 1::2] - py) / sy
+    return out
+
+
+# -------------------------------
+# Per-thread instances
+# -------------------------------
+_local = threading.local()
+
+
+def get_preprocessor(target_size: Tuple[int, int], letterbox: bool = False):
+    """Preprocessor owned by the calling thread (buffers are not shared)."""
+    cache = getattr(_local, "preprocessors", None)
+    if cache is None:
+        cache = _local.preprocessors = {}
+    key = (tuple(target_size), letterbox)
+    if key not in cache:
+        cache[key] = Preprocessor(target_size, letterbox)
+    return cache[key]
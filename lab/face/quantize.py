@@ -0,0 +1,235 @@
+# lab/face/quantize.py
+"""
+Build static INT8 versions of the SCRFD and ArcFace models and gate them on accuracy.
+- Calibration: images from a folder (detector on full frames, ArcFace on face crops)
+- Gate (README pass criteria): FP32 vs INT8 self-similarity > 0.99, same
+  accept/reject decisions around COSINE_LOGIN_THRESHOLD, detector boxes kept
+- INT8 files are only written to their final paths when the gate passes
+Usage:
+    python -m lab.face.quantize path/to/calibration_images [--eval-dir DIR] [--force]
+"""
+
+import argparse
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import cv2
+import numpy as np
+from onnxruntime.quantization import (
+    CalibrationDataReader,
+    CalibrationMethod,
+    QuantFormat,
+    QuantType,
+    quantize_static,
+)
+from onnxruntime.quantization.shape_inference import quant_pre_process
+
+from lab.face.gallery import l2_normalize
+from lab.face.models_config import (
+    ARCFACE_INPUT_SIZE,
+    COSINE_LOGIN_THRESHOLD,
+    DETECTION_MODEL_INT8,
+    DETECTION_MODEL_PATH,
+    EMBEDDING_MODEL_INT8,
+    EMBEDDING_MODEL_PATH,
+    TARGET_DETECTION_SIZE,
+)
+from lab.face.pipeline import (
+    align_face,
+    create_session,
+    crop_faces,
+    detect_faces,
+    get_face_embeddings_batch,
+    preprocess_for_onnx,
+)
+
+IMAGE_EXTS = {".jpg", ".jpeg", ".png", ".bmp", ".webp"}
+
+# acceptance gate
+MIN_SELF_SIMILARITY = 0.99  # cosine(FP32, INT8) for every face
+MIN_DECISION_AGREEMENT = 0.99  # same accept/reject on face pairs
+MIN_BOX_RECALL = 0.95  # FP32 boxes re-found by INT8 at IoU >= 0.5
+
+
+# -------------------------------
+# Calibration data
+# -------------------------------
+def load_images(folder: str, limit: int = 0) -> List[np.ndarray]:
+    paths = sorted(p for p in Path(folder).rglob("*") if p.suffix.lower() in IMAGE_EXTS)
+    if limit:
+        paths = paths[:limit]
+    images = [img for img in (cv2.imread(str(p)) for p in paths) if img is not None]
+    if not images:
+        raise FileNotFoundError(f"No readable images in {folder}")
+    return images
+
+
+def collect_face_crops(det_session, images: List[np.ndarray]) -> List[np.ndarray]:
+    """Face crops found by the FP32 detector; whole image if none is found."""
+    crops = []
+    for img in images:
+        found, _ = crop_faces(img, detect_faces(det_session, img))
+        crops.extend(found or [img])
+    return crops
+
+
+class _TensorReader(CalibrationDataReader):
+    """Feeds pre-built (1,3,H,W) tensors to quantize_static."""
+
+    def __init__(self, input_name: str, tensors: List[np.ndarray]):
+        self._feeds = iter([{input_name: t} for t in tensors])
+
+    def get_next(self) -> Optional[Dict[str, np.ndarray]]:
+        return next(self._feeds, None)
+
+
+def _quantize(src: str, dst: str, input_name: str, tensors: List[np.ndarray]):
+    # shape inference + graph cleanup first, as recommended for static quantization
+    prepped = str(Path(dst).with_suffix(".prep.onnx"))
+    quant_pre_process(src, prepped, skip_symbolic_shape=True)
+    quantize_static(
+        prepped,
+        dst,
+        _TensorReader(input_name, tensors),
+        quant_format=QuantFormat.QDQ,
+        activation_type=QuantType.QInt8,
+        weight_type=QuantType.QInt8,
+        per_channel=True,
+        calibrate_method=CalibrationMethod.MinMax,
+    )
+
+
+# -------------------------------
+# Accuracy gate
+# -------------------------------
+def _iou(a, b) -> float:
+    ix = max(0, min(a[2], b[2]) - max(a[0], b[0]))
+    iy = max(0, min(a[3], b[3]) - max(a[1], b[1]))
+    inter = ix * iy
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+def evaluate(det_fp32, det_int8, emb_fp32, emb_int8, images) -> Dict[str, float]:
+    """Compare FP32 and INT8 outputs on the same images."""
+    # detector: how many FP32 boxes does INT8 still find?
+    matched = total = 0
+    for img in images:
+        ref = detect_faces(det_fp32, img)
+        got = detect_faces(det_int8, img)
+        total += len(ref)
+        matched += sum(any(_iou(r, g) >= 0.5 for g in got) for r in ref)
+    box_recall = matched / total if total else 1.0
+
+    # embedder: same crops through both models
+    crops = collect_face_crops(det_fp32, images)
+    ref = l2_normalize(get_face_embeddings_batch(emb_fp32, crops))
+    got = l2_normalize(get_face_embeddings_batch(emb_int8, crops))
+    self_sim = np.sum(ref * got, axis=1)
+
+    # separation: accept/reject on every pair must not flip
+    iu = np.triu_indices(len(crops), k=1)
+    ref_pairs = (ref @ ref.T)[iu]
+    got_pairs = (got @ got.T)[iu]
+    flips = (ref_pairs >= COSINE_LOGIN_THRESHOLD) != (
+        got_pairs >= COSINE_LOGIN_THRESHOLD
+    )
+    agree = 1.0 - float(flips.mean()) if len(ref_pairs) else 1.0
+
+    return {
+        "faces": float(len(crops)),
+        "box_recall": box_recall,
+        "self_sim_min": float(self_sim.min()),
+        "self_sim_mean": float(self_sim.mean()),
+        "pair_decision_agreement": agree,
+        "pair_sim_max_abs_diff": (
+            float(np.abs(ref_pairs - got_pairs).max()) if len(ref_pairs) else 0.0
+        ),
+    }
+
+
+def passes(report: Dict[str, float]) -> bool:
+    return (
+        report["self_sim_min"] > MIN_SELF_SIMILARITY
+        and report["pair_decision_agreement"] >= MIN_DECISION_AGREEMENT
+        and report["box_recall"] >= MIN_BOX_RECALL
+    )
+
+
+# -------------------------------
+# Entry point
+# -------------------------------
+def run(
+    calib_dir: str,
+    eval_dir: Optional[str] = None,
+    limit: int = 200,
+    force: bool = False,
+) -> bool:
+    calib = load_images(calib_dir, limit)
+    evals = load_images(eval_dir, limit) if eval_dir else calib
+    print(f"[INFO] Calibration images: {len(calib)}, evaluation images: {len(evals)}")
+
+    det_fp32 = create_session(DETECTION_MODEL_PATH, "SCRFD model")
+    emb_fp32 = create_session(EMBEDDING_MODEL_PATH, "ArcFace model")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        det_tmp = str(Path(tmp) / Path(DETECTION_MODEL_INT8).name)
+        emb_tmp = str(Path(tmp) / Path(EMBEDDING_MODEL_INT8).name)
+
+        print("[INFO] Quantizing detector...")
+        det_tensors = [preprocess_for_onnx(img, TARGET_DETECTION_SIZE) for img in calib]
+        _quantize(
+            DETECTION_MODEL_PATH, det_tmp, det_fp32.get_inputs()[0].name, det_tensors
+        )
+
+        print("[INFO] Quantizing embedder...")
+        emb_tensors = [
+            preprocess_for_onnx(align_face(crop), ARCFACE_INPUT_SIZE)
+            for crop in collect_face_crops(det_fp32, calib)
+        ]
+        _quantize(
+            EMBEDDING_MODEL_PATH, emb_tmp, emb_fp32.get_inputs()[0].name, emb_tensors
+        )
+
+        report = evaluate(
+            det_fp32,
+            create_session(det_tmp, "SCRFD INT8 model"),
+            emb_fp32,
+            create_session(emb_tmp, "ArcFace INT8 model"),
+            evals,
+        )
+        for key, value in report.items():
+            print(f"[INFO] {key}: {value:.4f}")
+
+        ok = passes(report)
+        if not ok and not force:
+            print("[ERROR] INT8 models failed the accuracy gate; not installed.")
+            return False
+
+        shutil.move(det_tmp, DETECTION_MODEL_INT8)
+        shutil.move(emb_tmp, EMBEDDING_MODEL_INT8)
+
+    verdict = "passed" if ok else "FAILED (installed with --force)"
+    print(
+        f"[INFO] Accuracy gate {verdict}: {DETECTION_MODEL_INT8}, {EMBEDDING_MODEL_INT8}"
+    )
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Static INT8 quantization with accuracy gate"
+    )
+    parser.add_argument("calib_dir", help="folder of calibration images")
+    parser.add_argument(
+        "--eval-dir", help="held-out images for the gate (default: calib_dir)"
+    )
+    parser.add_argument("--limit", type=int, default=200, help="max images per folder")
+    parser.add_argument(
+        "--force", action="store_true", help="install even if the gate fails"
+    )
+    args = parser.parse_args()
+    sys.exit(0 if run(args.calib_dir, args.eval_dir, args.limit, args.force) else 1)
@@ -0,0 +1,163 @@
+# lab/face/scrfd.py
+"""
+Vectorized SCRFD output decoding.
+- Outputs are grouped per stride: scores (N,1), box distances (N,4), landmarks (N,10)
+- Anchor-centre grids are cached per (input size, stride, anchors per cell)
+- Distances -> xyxy boxes and 5-point landmarks in NumPy, then a NumPy NMS
+All results are arrays in model-input pixel coordinates.
+"""
+
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+_STRIDE_CANDIDATES = (8, 16, 32, 64, 128)
+PRE_NMS_TOPK = 500  # bounds the O(K^2) IoU matrix on noisy frames
+_anchor_cache: Dict[Tuple[int, int, int, int], np.ndarray] = {}
+
+# (boxes (K,4) xyxy, scores (K,), landmarks (K,5,2))
+Detections = Tuple[np.ndarray, np.ndarray, np.ndarray]
+
+
+# -------------------------------
+# Anchors
+# -------------------------------
+def anchor_centers(input_hw: Tuple[int, int], stride: int, num_anchors: int):
+    """(H/s * W/s * A, 2) anchor centres in pixels, cached per configuration."""
+    key = (input_hw[0], input_hw[1], stride, num_anchors)
+    centers = _anchor_cache.get(key)
+    if centers is None:
+        fh, fw = input_hw[0] // stride, input_hw[1] // stride
+        ys, xs = np.mgrid[:fh, :fw]
+        centers = np.stack([xs, ys], axis=-1).reshape(-1, 2).astype(np.float32)
+        centers *= stride
+        if num_anchors > 1:
+            centers = np.repeat(centers, num_anchors, axis=0)
+        centers.setflags(write=False)
+        _anchor_cache[key] = centers
+    return centers
+
+
+def _stride_for(count: int, input_hw: Tuple[int, int]) -> Tuple[int, int]:
+    """Infer (stride, anchors per cell) from a level's prediction count."""
+    for stride in _STRIDE_CANDIDATES:
+        cells = (input_hw[0] // stride) * (input_hw[1] // stride)
+        if cells and count % cells == 0 and count // cells in (1, 2, 3):
+            return stride, count // cells
+    raise ValueError(f"Cannot map {count} SCRFD predictions to a stride")
+
+
+# -------------------------------
+# NMS
+# -------------------------------
+def nms(boxes: np.ndarray, scores: np.ndarray, iou_threshold: float) -> np.ndarray:
+    """
+    Greedy NMS on xyxy boxes; returns kept indices, best score first.
+    Pairwise IoU is computed once as a matrix, so the Python loop only
+    visits boxes that actually overlap something.
+    """
+    if len(boxes) == 0:
+        return np.zeros(0, dtype=np.int64)
+    order = np.argsort(-scores, kind="stable")
+    x1, y1, x2, y2 = boxes[order].T
+    areas = np.maximum(0.0, x2 - x1) * np.maximum(0.0, y2 - y1)
+
+    w = np.maximum(0.0, np.minimum(x2[:, None], x2) - np.maximum(x1[:, None], x1))
+    h = np.maximum(0.0, np.minimum(y2[:, None], y2) - np.maximum(y1[:, None], y1))
+    inter = w * h
+    iou = inter / np.maximum(areas[:, None] + areas - inter, 1e-9)
+    overlaps = np.triu(iou > iou_threshold, k=1)  # higher score suppresses lower
+
+    keep = np.ones(len(order), dtype=bool)
+    for i in np.flatnonzero(overlaps.any(axis=1)):
+        if keep[i]:
+            keep[overlaps[i]] = False
+    return order[keep]
+
+
+# -------------------------------
+# Decoding
+# -------------------------------
+def _group_outputs(outputs: Sequence[np.ndarray], batch: int):
+    """Split outputs into per-level (scores, distances, landmarks) by last dim."""
+    by_dim: Dict[int, List[np.ndarray]] = {1: [], 4: [], 10: []}
+    for out in outputs:
+        dim = out.shape[-1] if out.ndim > 1 else 1
+        if dim in by_dim:
+            by_dim[dim].append(out.reshape(batch, -1, dim))
+    if not by_dim[1] or len(by_dim[1]) != len(by_dim[4]):
+        raise ValueError("Unexpected SCRFD output layout")
+    # levels are matched by prediction count (stride 8 has the most)
+    for dim in by_dim:
+        by_dim[dim].sort(key=lambda a: -a.shape[1])
+    kps = by_dim[10] if len(by_dim[10]) == len(by_dim[1]) else [None] * len(by_dim[1])
+    return list(zip(by_dim[1], by_dim[4], kps))
+
+
+def decode_scrfd_batch(
+    outputs: Sequence[np.ndarray],
+    input_size: Tuple[int, int],
+    conf_threshold: float,
+    nms_threshold: float,
+    batch: int = 1,
+    pre_nms_topk: int = PRE_NMS_TOPK,
+) -> List[Detections]:
+    """
+    Decode raw SCRFD outputs for `batch` images of model input size (w, h).
+    Only predictions above `conf_threshold` are decoded, and at most
+    `pre_nms_topk` of them (highest scores) go into NMS.
+    """
+    input_hw = (input_size[1], input_size[0])
+    levels = _group_outputs(outputs, batch)
+
+    results = []
+    for b in range(batch):
+        boxes, scores, lmks = [], [], []
+        for score_out, dist_out, kps_out in levels:
+            s = score_out[b, :, 0]
+            idx = np.flatnonzero(s > conf_threshold)
+            if idx.size == 0:
+                continue
+            stride, num_anchors = _stride_for(s.shape[0], input_hw)
+            centers = anchor_centers(input_hw, stride, num_anchors)[idx]  # (K,2)
+
+            dist = dist_out[b, idx] * stride  # (K,4) l,t,r,b
+            boxes.append(
+                np.concatenate([centers - dist[:, :2], centers + dist[:, 2:]], 1)
+            )
+            scores.append(s[idx])
+            if kps_out is not None:
+                kps = kps_out[b, idx].reshape(-1, 5, 2) * stride
+                lmks.append(kps + centers[:, None, :])
+            else:
+                lmks.append(np.zeros((idx.size, 5, 2), np.float32))
+
+        if not boxes:
+            results.append(
+                (
+                    np.zeros((0, 4), np.float32),
+                    np.zeros(0, np.float32),
+                    np.zeros((0, 5, 2), np.float32),
+                )
+            )
+            continue
+
+        boxes_b = np.concatenate(boxes).astype(np.float32, copy=False)
+        scores_b = np.concatenate(scores).astype(np.float32, copy=False)
+        lmks_b = np.concatenate(lmks).astype(np.float32, copy=False)
+        if len(scores_b) > pre_nms_topk:
+            top = np.argpartition(-scores_b, pre_nms_topk - 1)[:pre_nms_topk]
+            boxes_b, scores_b, lmks_b = boxes_b[top], scores_b[top], lmks_b[top]
+        keep = nms(boxes_b, scores_b, nms_threshold)
+        results.append((boxes_b[keep], scores_b[keep], lmks_b[keep]))
+    return results
+
+
+def decode_scrfd(
+    outputs: Sequence[np.ndarray],
+    input_size: Tuple[int, int],
+    conf_threshold: float,
+    nms_threshold: float,
+) -> Detections:
+    """Single-image version of decode_scrfd_batch."""
+    return decode_scrfd_batch(outputs, input_size, conf_threshold, nms_threshold)[0]
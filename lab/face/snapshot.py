@@ -0,0 +1,352 @@
+# lab/face/snapshot.py
+"""
+On-disk gallery snapshots: start a server without parsing face_embeddings.
+- A snapshot is a directory of .npy files: normalized float32 matrix (N,512),
+  ids, profile ids, plus meta.json with the format version and the DB
+  watermark (max id, max created_at) it was exported at
+- .npy data is 64-byte aligned; `np.load(mmap_mode="r")` maps it read-only,
+  so every process opening the same snapshot shares one copy in the page cache
+- Exports go to a new versioned directory and `CURRENT` is swapped atomically;
+  readers never see a half-written snapshot
+- SnapshotIndex: mapped base + small in-memory delta (rows added since the
+  watermark) + a mask of base rows deleted since; refreshes never copy the base
+Usage:
+    python -m lab.face.snapshot export
+    python -m lab.face.snapshot info
+    python -m lab.face.snapshot bench
+"""
+
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Iterable, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import func, select
+
+from lab.db.embedding_codec import EMBEDDING_DIM, decode_embeddings
+from lab.db.models import FaceEmbedding
+from lab.face.gallery import GalleryIndex, l2_normalize, top_k
+from lab.face.models_config import (
+    COSINE_LOGIN_THRESHOLD,
+    GALLERY_SNAPSHOT_DIR,
+    GALLERY_SNAPSHOT_KEEP,
+)
+
+FORMAT_VERSION = 1
+_EXPORT_CHUNK = 10000  # rows decoded per DB fetch while exporting
+
+# (max id, max created_at) of the exported rows
+Watermark = Tuple[int, Optional[datetime]]
+
+
+# -------------------------------
+# Overlay index
+# -------------------------------
+class SnapshotIndex(GalleryIndex):
+    """
+    GalleryIndex over a mapped snapshot plus the changes since it was taken.
+    Rows are [base rows..., delta rows...]; deleted base rows are masked out
+    of every search instead of being removed from the mapped matrix.
+    """
+
+    def __init__(
+        self,
+        base: GalleryIndex,
+        delta: Optional[GalleryIndex] = None,
+        removed: Optional[np.ndarray] = None,
+    ):
+        self.base = base
+        self.delta = delta if delta is not None else GalleryIndex.empty(base.threshold)
+        self.removed = (
+            removed if removed is not None else np.zeros(len(base.ids), dtype=bool)
+        )
+        self.threshold = base.threshold
+        self._removed_rows = np.flatnonzero(self.removed)
+        self._row_ids = np.concatenate([base.ids, self.delta.ids])
+        self._row_profile_ids = np.concatenate(
+            [base.profile_ids, self.delta.profile_ids]
+        )
+        self._live = np.concatenate([~self.removed, np.ones(len(self.delta), bool)])
+
+    @property
+    def ids(self) -> np.ndarray:
+        return self._row_ids[self._live]
+
+    @property
+    def profile_ids(self) -> np.ndarray:
+        return self._row_profile_ids[self._live]
+
+    @property
+    def matrix(self) -> np.ndarray:
+        """Live rows as one in-memory matrix (copies the base: tools only)."""
+        return np.concatenate([self.base.matrix[~self.removed], self.delta.matrix])
+
+    @property
+    def nbytes(self) -> int:
+        """Private memory only; the mapped base lives in the shared page cache."""
+        return self.delta.nbytes + self._row_ids.nbytes + self._row_profile_ids.nbytes
+
+    def __len__(self) -> int:
+        return len(self._live) - len(self._removed_rows)
+
+    def merged(self, added: GalleryIndex, removed_ids: Iterable[int] = ()):
+        """Apply an incremental update to the delta; the base stays mapped."""
+        removed_ids = np.asarray(list(removed_ids), np.int64)
+        drop = np.union1d(removed_ids, added.ids)
+        removed = self.removed | np.isin(self.base.ids, drop)
+        return SnapshotIndex(self.base, self.delta.merged(added, removed_ids), removed)
+
+    def rows(self, live: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Ids, profile ids and float32 embeddings at live positions `live`
+        (any shape); base rows are read from the mapping.
+        """
+        shift = self._removed_rows - np.arange(len(self._removed_rows))
+        rows = live + np.searchsorted(shift, live, side="right")
+        nb = len(self.base.ids)
+        in_base = rows < nb
+        emb = np.empty(rows.shape + (EMBEDDING_DIM,), np.float32)
+        emb[in_base] = self.base.matrix[rows[in_base]]
+        emb[~in_base] = self.delta.matrix[rows[~in_base] - nb]
+        return self._row_ids[rows], self._row_profile_ids[rows], emb
+
+    def search(
+        self, queries: np.ndarray, k: int = 1
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        q = l2_normalize(np.atleast_2d(queries))
+        k = max(0, min(k, len(self)))
+        if k == 0:
+            shape = (q.shape[0], 0)
+            return (
+                np.empty(shape, np.int64),
+                np.empty(shape, np.int64),
+                np.empty(shape, np.float32),
+            )
+
+        sims = q @ self.base.matrix.T  # pages fault in from the shared mapping
+        sims[:, self._removed_rows] = -np.inf
+        if len(self.delta):
+            sims = np.concatenate([sims, q @ self.delta.matrix.T], axis=1)
+        top, scores = top_k(sims, k)
+        return self._row_ids[top], self._row_profile_ids[top], scores
+
+
+# -------------------------------
+# Reading
+# -------------------------------
+def current_path(root: str = GALLERY_SNAPSHOT_DIR) -> Optional[Path]:
+    """Directory of the current snapshot version, or None if never exported."""
+    pointer = Path(root) / "CURRENT"
+    if not pointer.exists():
+        return None
+    path = Path(root) / pointer.read_text().strip()
+    return path if path.is_dir() else None
+
+
+def read_meta(path: Path) -> dict:
+    meta = json.loads((path / "meta.json").read_text())
+    if meta.get("version") != FORMAT_VERSION:
+        raise ValueError(
+            f"Snapshot {path} has format version {meta.get('version')}, "
+            f"expected {FORMAT_VERSION}; re-export it"
+        )
+    return meta
+
+
+def open_snapshot(
+    root: str = GALLERY_SNAPSHOT_DIR, threshold: float = COSINE_LOGIN_THRESHOLD
+) -> Optional[Tuple[SnapshotIndex, Watermark]]:
+    """
+    Map the current snapshot. Cost is a few file opens, whatever its size.
+    Returns (index, watermark), or None if there is no usable snapshot.
+    """
+    path = current_path(root)
+    if path is None:
+        return None
+    try:
+        meta = read_meta(path)
+        matrix = np.load(path / "matrix.npy", mmap_mode="r")
+        ids = np.load(path / "ids.npy")
+        profile_ids = np.load(path / "profile_ids.npy")
+    except (OSError, ValueError) as exc:
+        print(f"[WARN] Ignoring gallery snapshot {path}: {exc}")
+        return None
+    if matrix.shape != (meta["count"], EMBEDDING_DIM) or len(ids) != meta["count"]:
+        print(f"[WARN] Ignoring gallery snapshot {path}: size mismatch")
+        return None
+
+    base = GalleryIndex._from_normalized(ids, profile_ids, matrix, threshold)
+    created = meta["max_created_at"]
+    watermark = (meta["max_id"], datetime.fromisoformat(created) if created else None)
+    return SnapshotIndex(base), watermark
+
+
+def map_private(index: GalleryIndex) -> SnapshotIndex:
+    """
+    SnapshotIndex over an unlinked temporary file holding `index`'s rows: for
+    galleries loaded from the DB, so their float32 rows also leave the heap.
+    """
+    if not len(index):  # an empty file cannot be mapped
+        return SnapshotIndex(index)
+    with tempfile.TemporaryFile(prefix="gallery-") as f:
+        matrix = np.memmap(f, np.float32, "w+", shape=index.matrix.shape)
+    matrix[:] = index.matrix
+    matrix.flush()
+    base = GalleryIndex._from_normalized(
+        index.ids, index.profile_ids, matrix, index.threshold
+    )
+    return SnapshotIndex(base)
+
+
+# -------------------------------
+# Writing
+# -------------------------------
+def _write_rows(db, path: Path, max_id: int, count: int) -> Optional[datetime]:
+    """Stream rows with id <= max_id into path/*.npy; returns max created_at."""
+    matrix = np.lib.format.open_memmap(
+        path / "matrix.npy", mode="w+", dtype=np.float32, shape=(count, EMBEDDING_DIM)
+    )
+    ids = np.empty(count, np.int64)
+    profile_ids = np.empty(count, np.int64)
+    max_created: Optional[datetime] = None
+    stmt = (
+        select(
+            FaceEmbedding.id,
+            FaceEmbedding.profile_id,
+            FaceEmbedding.embedding,
+            FaceEmbedding.created_at,
+        )
+        .where(FaceEmbedding.id <= max_id)
+        .order_by(FaceEmbedding.id)
+        .execution_options(yield_per=_EXPORT_CHUNK)
+    )
+    n = 0
+    for chunk in db.execute(stmt).partitions():
+        m = len(chunk)
+        if n + m > count:
+            break
+        ids[n : n + m] = [row.id for row in chunk]
+        profile_ids[n : n + m] = [row.profile_id for row in chunk]
+        matrix[n : n + m] = l2_normalize(decode_embeddings(r.embedding for r in chunk))
+        for row in chunk:
+            if row.created_at is not None and (
+                max_created is None or row.created_at > max_created
+            ):
+                max_created = row.created_at
+        n += m
+    if n != count:  # rows deleted (or rowids reused) while exporting
+        raise RuntimeError("face_embeddings changed during export; run it again")
+
+    matrix.flush()
+    del matrix
+    np.save(path / "ids.npy", ids)
+    np.save(path / "profile_ids.npy", profile_ids)
+    return max_created
+
+
+def export(root: str = GALLERY_SNAPSHOT_DIR, keep: int = GALLERY_SNAPSHOT_KEEP) -> Path:
+    """
+    Write face_embeddings (up to its current max id) to a new snapshot version
+    and make it current. Memory stays bounded by one fetch chunk.
+    """
+    from lab.db.test_database import session_scope
+
+    with session_scope() as db:
+        max_id = db.execute(select(func.max(FaceEmbedding.id))).scalar() or 0
+        count = db.execute(
+            select(func.count()).where(FaceEmbedding.id <= max_id)
+        ).scalar()
+        name = f"v{datetime.now():%Y%m%d-%H%M%S}-{max_id}"
+        final = Path(root) / name
+        tmp = Path(root) / (name + ".tmp")
+        tmp.mkdir(parents=True, exist_ok=True)
+        try:
+            max_created = _write_rows(db, tmp, max_id, count)
+        except BaseException:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+
+    meta = {
+        "version": FORMAT_VERSION,
+        "count": count,
+        "dim": EMBEDDING_DIM,
+        "max_id": int(max_id),
+        "max_created_at": max_created.isoformat() if max_created else None,
+        "exported_at": datetime.now().isoformat(timespec="seconds"),
+    }
+    (tmp / "meta.json").write_text(json.dumps(meta, indent=2))
+    if final.exists():  # same second, same max id: identical snapshot
+        shutil.rmtree(tmp)
+    else:
+        os.replace(tmp, final)
+    pointer = Path(root) / "CURRENT.tmp"
+    pointer.write_text(name + "\n")
+    os.replace(pointer, Path(root) / "CURRENT")  # atomic switch for new readers
+    _prune(Path(root), keep)
+    return final
+
+
+def _prune(root: Path, keep: int) -> None:
+    """Drop all but the newest `keep` versions (processes still mapping an
+    old one keep their pages until they exit)."""
+    versions = sorted(
+        p
+        for p in root.iterdir()
+        if p.is_dir() and p.name.startswith("v") and p.suffix != ".tmp"
+    )
+    for old in versions[: max(0, len(versions) - max(keep, 1))]:
+        shutil.rmtree(old, ignore_errors=True)
+
+
+# -------------------------------
+# CLI: export / info / bench
+# -------------------------------
+def bench(root: str = GALLERY_SNAPSHOT_DIR) -> None:
+    """Cold start from the DB vs from the snapshot (+ delta)."""
+    from lab.face.gallery_cache import GalleryCache
+
+    for label, snapshot_dir in (("database", ""), ("snapshot", root)):
+        t0 = time.perf_counter()
+        cache = GalleryCache(
+            search_mode="exact", codes="float32", snapshot_dir=snapshot_dir
+        )
+        cache.load()
+        print(
+            f"[INFO] {label:<8} {len(cache)} embeddings in "
+            f"{(time.perf_counter() - t0) * 1000.0:.1f} ms"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Gallery snapshot tools")
+    parser.add_argument("--dir", default=GALLERY_SNAPSHOT_DIR)
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    e = sub.add_parser("export", help="write a new snapshot version")
+    e.add_argument("--keep", type=int, default=GALLERY_SNAPSHOT_KEEP)
+    sub.add_parser("info", help="show the current snapshot")
+    sub.add_parser("bench", help="cold-start time: database vs snapshot")
+    args = parser.parse_args()
+
+    if args.cmd == "export":
+        t0 = time.perf_counter()
+        path = export(args.dir, args.keep)
+        meta = read_meta(path)
+        print(
+            f"[INFO] Snapshot {path.name}: {meta['count']} embeddings, "
+            f"watermark id={meta['max_id']}, {time.perf_counter() - t0:.2f}s"
+        )
+    elif args.cmd == "info":
+        path = current_path(args.dir)
+        if path is None:
+            print(f"[WARN] No snapshot in {args.dir}")
+        else:
+            print(f"[INFO] {path}")
+            print(json.dumps(read_meta(path), indent=2))
+    else:
+        bench(args.dir)
@@ -0,0 +1,578 @@
+# lab/face/templates.py
+"""
+Per-profile templates: search about one vector per member, then re-rank the
+raw embeddings of the best few members only.
+- Centroid: normalized mean of a profile's unit embeddings
+- Sub-templates (optional): k medoids of a profile's embeddings, for members
+  enrolled with very different photos (glasses, beard, lighting)
+- Stored in profile_templates; enrollment and `remove` update them in the
+  same transaction (add/remove is one vector add/subtract on the centroid
+  sum), `sync` repairs profiles changed by other writers
+- Loading reads the stored centroid sums instead of re-summing the gallery;
+  a refresh re-sums only the profiles it touches
+- TemplateIndex: drop-in for GalleryIndex (GALLERY_SEARCH_MODE = "templates")
+Usage:
+    python -m lab.face.templates sync
+    python -m lab.face.templates rebuild --medoids 3
+    python -m lab.face.templates remove --profile 42
+    python -m lab.face.templates report --profiles 20000 --per-profile 5
+"""
+
+import argparse
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import delete, func, insert, select, update
+
+from lab.db.embedding_codec import EMBEDDING_DIM, decode_embeddings, encode_embedding
+from lab.db.models import FaceEmbedding, ProfileTemplate
+from lab.face.gallery import GalleryIndex, l2_normalize
+from lab.face.models_config import (
+    TEMPLATE_CANDIDATES,
+    TEMPLATE_MEDOID_MIN_EMBEDDINGS,
+    TEMPLATE_MEDOIDS,
+)
+
+KIND_CENTROID = 0  # embedding = sum of unit embeddings
+KIND_MEDOID = 1
+
+# profile id -> (embeddings summarized, (k,512) unit medoids)
+MedoidMap = Dict[int, Tuple[int, np.ndarray]]
+# (sorted profile ids, embeddings summarized, (P,512) sums of unit embeddings)
+SumTable = Tuple[np.ndarray, np.ndarray, np.ndarray]
+
+
+# -------------------------------
+# Template math
+# -------------------------------
+def k_medoids(unit: np.ndarray, k: int, iters: int = 10) -> np.ndarray:
+    """
+    k medoids of unit rows under cosine distance (deterministic: farthest-
+    first seeding from the point nearest the centroid, then alternate
+    assignment / medoid update). Returns (k,512) rows of `unit`.
+    """
+    n = unit.shape[0]
+    k = max(1, min(k, n))
+    sims = unit @ unit.T  # profiles are small; (n,n) is cheap
+    chosen = [int(np.argmax(sims.sum(axis=1)))]
+    while len(chosen) < k:
+        nearest = sims[:, chosen].max(axis=1)
+        chosen.append(int(np.argmin(nearest)))
+    medoids = np.array(chosen)
+    for _ in range(iters):
+        assign = np.argmax(sims[:, medoids], axis=1)
+        updated = medoids.copy()
+        for c in range(k):
+            members = np.flatnonzero(assign == c)
+            if members.size:
+                within = sims[np.ix_(members, members)].sum(axis=1)
+                updated[c] = members[np.argmax(within)]
+        if np.array_equal(updated, medoids):
+            break
+        medoids = updated
+    return unit[medoids]
+
+
+def profile_medoids(
+    unit: np.ndarray,
+    medoids: int = TEMPLATE_MEDOIDS,
+    min_embeddings: int = TEMPLATE_MEDOID_MIN_EMBEDDINGS,
+) -> np.ndarray:
+    """Sub-templates for one profile; empty unless it is large enough."""
+    if medoids <= 0 or unit.shape[0] < max(min_embeddings, medoids):
+        return np.zeros((0, EMBEDDING_DIM), np.float32)
+    return k_medoids(unit, medoids)
+
+
+def segment_sums(matrix: np.ndarray, starts: np.ndarray, counts: np.ndarray):
+    """
+    Sums of the contiguous row groups `starts[i]:starts[i]+counts[i]`.
+    Groups of equal size are summed together as one (m,n,512) gather, which
+    is much faster than np.add.reduceat along rows.
+    """
+    out = np.zeros((len(starts), matrix.shape[1]), np.float32)
+    for n in np.unique(counts):
+        groups = np.flatnonzero(counts == n)
+        rows = starts[groups, None] + np.arange(n)
+        out[groups] = matrix[rows].sum(axis=1)
+    return out
+
+
+def _rerank(matrix, rows, query, k):
+    """Exact top-k of `matrix[rows]` for one query -> (positions in rows, sims)."""
+    sims = matrix[rows] @ query
+    kk = min(k, rows.size)
+    if kk < rows.size:
+        top = np.argpartition(-sims, kk - 1)[:kk]
+        top = top[np.argsort(-sims[top])]
+    else:
+        top = np.argsort(-sims)
+    return top, sims[top]
+
+
+def _splice(old: np.ndarray, keep: np.ndarray, at: np.ndarray, new: np.ndarray):
+    """
+    `old[keep]` with `new[j]` inserted before kept row `at[j]` (`at` sorted),
+    written in one pass: runs of kept rows are copied as slices.
+    """
+    src = np.flatnonzero(keep)
+    out = np.empty((len(src) + len(new),) + old.shape[1:], old.dtype)
+    cuts = np.union1d(np.flatnonzero(np.diff(src) != 1) + 1, at)
+    bounds = np.union1d(cuts, [0, len(src)])
+    o = j = 0
+    for a, b in zip(bounds[:-1], bounds[1:]):
+        while j < len(at) and at[j] == a:
+            out[o] = new[j]
+            o, j = o + 1, j + 1
+        out[o : o + b - a] = old[src[a] : src[a] + b - a]
+        o += b - a
+    out[o:] = new[j:]
+    return out
+
+
+def profile_groups(sorted_pids: np.ndarray):
+    """(profiles, starts, counts) of a profile-sorted id array, in one pass."""
+    if not len(sorted_pids):
+        empty = np.zeros(0, np.int64)
+        return empty, empty, empty
+    starts = np.flatnonzero(np.r_[True, sorted_pids[1:] != sorted_pids[:-1]])
+    counts = np.diff(np.r_[starts, len(sorted_pids)])
+    return sorted_pids[starts], starts.astype(np.int64), counts.astype(np.int64)
+
+
+# -------------------------------
+# Template index
+# -------------------------------
+class TemplateIndex(GalleryIndex):
+    """
+    Raw embeddings are stored grouped by profile (`offsets[p]:offsets[p+1]`
+    is profile `profiles[p]`). A query scores every profile by its best
+    template, then exact cosine runs over the raw rows of the top
+    `candidates` profiles only; results are raw rows, as in GalleryIndex.
+    Centroid sums come from `known_sums` (the stored kind-0 templates, or the
+    previous index on a refresh) wherever the embedding count still matches;
+    only the other profiles are summed from the rows.
+    """
+
+    def __init__(
+        self,
+        base: GalleryIndex,
+        known_sums: Optional[SumTable] = None,
+        known_medoids: Optional[MedoidMap] = None,
+        medoids: int = TEMPLATE_MEDOIDS,
+        candidates: int = TEMPLATE_CANDIDATES,
+        presorted: bool = False,
+    ):
+        self.threshold = base.threshold
+        self.medoids = medoids
+        self.candidates = candidates
+
+        if presorted:
+            self.ids, self.profile_ids, self.matrix = (
+                base.ids,
+                base.profile_ids,
+                base.matrix,
+            )
+        else:
+            order = np.argsort(base.profile_ids, kind="stable")
+            self.ids = base.ids[order]
+            self.profile_ids = base.profile_ids[order]
+            self.matrix = np.ascontiguousarray(base.matrix[order])
+        self.profiles, starts, self.counts = profile_groups(self.profile_ids)
+        self.offsets = np.append(starts, len(self.ids)).astype(np.int64)
+
+        self.sums = np.zeros((len(self.profiles), EMBEDDING_DIM), np.float32)
+        fresh = np.ones(len(self.profiles), bool)
+        if known_sums is not None and len(known_sums[0]):
+            k_pids, k_counts, k_sums = known_sums
+            pos = np.minimum(np.searchsorted(k_pids, self.profiles), len(k_pids) - 1)
+            hit = (k_pids[pos] == self.profiles) & (k_counts[pos] == self.counts)
+            self.sums[hit] = k_sums[pos[hit]]
+            fresh = ~hit
+        self.sums[fresh] = segment_sums(self.matrix, starts[fresh], self.counts[fresh])
+        self.summed = int(fresh.sum())  # profiles summed from rows in this build
+        self.centroids = l2_normalize(self.sums)
+
+        # sub-templates: reuse stored/previous ones while the profile is unchanged
+        known = known_medoids or {}
+        self._medoids: MedoidMap = {}
+        mats, owners = [], []
+        large = self.counts >= max(TEMPLATE_MEDOID_MIN_EMBEDDINGS, 1)
+        for p in np.flatnonzero(large) if (medoids > 0 or known) else []:
+            pid, n = int(self.profiles[p]), int(self.counts[p])
+            cached = known.get(pid)
+            if cached is not None and cached[0] == n:
+                med = cached[1]
+            else:
+                med = profile_medoids(
+                    self.matrix[self.offsets[p] : self.offsets[p + 1]], medoids
+                )
+            if len(med):
+                self._medoids[pid] = (n, med)
+                mats.append(med)
+                owners.append(np.full(len(med), p, np.int64))
+        self.medoid_matrix = (
+            np.ascontiguousarray(np.concatenate(mats))
+            if mats
+            else np.zeros((0, EMBEDDING_DIM), np.float32)
+        )
+        self.medoid_owner = np.concatenate(owners) if owners else np.zeros(0, np.int64)
+
+    @property
+    def n_templates(self) -> int:
+        """Vectors scored in the first stage (vs len(self) raw embeddings)."""
+        return len(self.centroids) + len(self.medoid_matrix)
+
+    def merged(self, added: GalleryIndex, removed_ids=()):
+        """
+        Apply an incremental update. Added rows are inserted at their
+        profile's position (no re-sort), and only touched profiles get a new
+        centroid sum and new medoids.
+        """
+        removed = np.asarray(list(removed_ids), np.int64)
+        drop = np.union1d(removed, added.ids)
+        keep = ~np.isin(self.ids, drop)
+        touched = np.union1d(added.profile_ids, self.profile_ids[~keep])
+
+        add = np.argsort(added.profile_ids, kind="stable")
+        kept_pids = self.profile_ids[keep]
+        at = np.searchsorted(kept_pids, added.profile_ids[add], side="right")
+        flat = GalleryIndex._from_normalized(
+            _splice(self.ids, keep, at, added.ids[add]),
+            _splice(self.profile_ids, keep, at, added.profile_ids[add]),
+            _splice(self.matrix, keep, at, added.matrix[add]),
+            self.threshold,
+        )
+        same = ~np.isin(self.profiles, touched)
+        known_sums = (self.profiles[same], self.counts[same], self.sums[same])
+        changed = set(touched.tolist())
+        known_medoids = {p: v for p, v in self._medoids.items() if p not in changed}
+        return TemplateIndex(
+            flat, known_sums, known_medoids, self.medoids, self.candidates, True
+        )
+
+    def profile_scores(self, q: np.ndarray) -> np.ndarray:
+        """(Q,P) best template similarity per profile."""
+        scores = q @ self.centroids.T
+        if len(self.medoid_matrix):
+            sims = q @ self.medoid_matrix.T
+            rows = np.arange(q.shape[0])[:, None]
+            np.maximum.at(scores, (rows, self.medoid_owner[None, :]), sims)
+        return scores
+
+    def search(
+        self, queries: np.ndarray, k: int = 1, candidates: Optional[int] = None
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Top-k raw rows among the `candidates` best profiles per query."""
+        q = l2_normalize(np.atleast_2d(queries))
+        k = max(0, min(k, len(self)))
+        ids = np.full((q.shape[0], k), -1, np.int64)
+        profile_ids = np.full((q.shape[0], k), -1, np.int64)
+        scores = np.full((q.shape[0], k), -np.inf, np.float32)
+        if k == 0:
+            return ids, profile_ids, scores
+
+        c = max(1, min(candidates or self.candidates, len(self.profiles)))
+        coarse = self.profile_scores(q)
+        picks = np.argpartition(-coarse, c - 1, axis=1)[:, :c]
+        for qi in range(q.shape[0]):
+            rows = np.concatenate(
+                [np.arange(self.offsets[p], self.offsets[p + 1]) for p in picks[qi]]
+            )
+            top, sims = _rerank(self.matrix, rows, q[qi], k)
+            kk = len(top)
+            ids[qi, :kk] = self.ids[rows[top]]
+            profile_ids[qi, :kk] = self.profile_ids[rows[top]]
+            scores[qi, :kk] = sims
+        return ids, profile_ids, scores
+
+
+def index_for_gallery(base: GalleryIndex, conn=None) -> TemplateIndex:
+    """
+    Wrap a loaded gallery. With `conn`, the stored templates are used for
+    every profile whose embedding count they still match.
+    """
+    known_sums, known_medoids = (
+        load_templates(conn) if conn is not None else (None, None)
+    )
+    index = TemplateIndex(base, known_sums, known_medoids)
+    print(
+        f"[INFO] Template index: {len(index.profiles)} profiles "
+        f"({len(index.profiles) - index.summed} from stored templates), "
+        f"{index.n_templates} templates for {len(index)} embeddings"
+    )
+    return index
+
+
+# -------------------------------
+# profile_templates table
+# -------------------------------
+def _profile_units(conn, profile_ids: List[int]) -> Dict[int, np.ndarray]:
+    """Unit raw embeddings per profile, straight from face_embeddings."""
+    out: Dict[int, np.ndarray] = {}
+    for start in range(0, len(profile_ids), 500):
+        stmt = (
+            select(FaceEmbedding.profile_id, FaceEmbedding.embedding)
+            .where(FaceEmbedding.profile_id.in_(profile_ids[start : start + 500]))
+            .order_by(FaceEmbedding.profile_id, FaceEmbedding.id)
+        )
+        rows = conn.execute(stmt).fetchall()
+        if not rows:
+            continue
+        mat = l2_normalize(decode_embeddings(row.embedding for row in rows))
+        pids = np.array([row.profile_id for row in rows])
+        for pid in np.unique(pids):
+            out[int(pid)] = mat[pids == pid]
+    return out
+
+
+def _write_profile(conn, profile_id: int, unit: np.ndarray, medoids: int) -> None:
+    conn.execute(
+        delete(ProfileTemplate).where(ProfileTemplate.profile_id == profile_id)
+    )
+    if not len(unit):
+        return
+    rows = [
+        {
+            "profile_id": profile_id,
+            "kind": KIND_CENTROID,
+            "embedding": encode_embedding(unit.sum(axis=0)),
+            "source_count": len(unit),
+        }
+    ]
+    for med in profile_medoids(unit, medoids):
+        rows.append(
+            {
+                "profile_id": profile_id,
+                "kind": KIND_MEDOID,
+                "embedding": encode_embedding(med),
+                "source_count": len(unit),
+            }
+        )
+    conn.execute(insert(ProfileTemplate), rows)
+
+
+def recompute_profiles(conn, profile_ids: Iterable[int], medoids=TEMPLATE_MEDOIDS):
+    """Rebuild the templates of these profiles from their raw embeddings."""
+    profile_ids = sorted(set(profile_ids))
+    units = _profile_units(conn, profile_ids)
+    empty = np.zeros((0, EMBEDDING_DIM), np.float32)
+    for pid in profile_ids:
+        _write_profile(conn, pid, units.get(pid, empty), medoids)
+    return len(profile_ids)
+
+
+def _apply_delta(conn, profile_ids, vectors, sign: int, medoids: int) -> None:
+    unit = l2_normalize(vectors)
+    pids = np.asarray(profile_ids, np.int64)
+    stale = []
+    for pid in np.unique(pids):
+        delta = sign * unit[pids == pid]
+        row = conn.execute(
+            select(
+                ProfileTemplate.id,
+                ProfileTemplate.embedding,
+                ProfileTemplate.source_count,
+            ).where(
+                ProfileTemplate.profile_id == int(pid),
+                ProfileTemplate.kind == KIND_CENTROID,
+            )
+        ).first()
+        count = (row.source_count if row else 0) + sign * len(delta)
+        # new or emptied profiles, and medoids, are recomputed from the rows
+        if row is None or count <= 0 or medoids > 0:
+            stale.append(int(pid))
+            continue
+        total = decode_embeddings([row.embedding])[0] + delta.sum(axis=0)
+        conn.execute(
+            update(ProfileTemplate)
+            .where(ProfileTemplate.id == row.id)
+            .values(embedding=encode_embedding(total), source_count=count)
+        )
+    if stale:
+        recompute_profiles(conn, stale, medoids)
+
+
+def add_embeddings(conn, profile_ids, vectors, medoids=TEMPLATE_MEDOIDS) -> None:
+    """Call in the transaction that inserted these face_embeddings rows."""
+    _apply_delta(conn, profile_ids, np.atleast_2d(vectors), +1, medoids)
+
+
+def remove_embeddings(conn, ids: Iterable[int], medoids=TEMPLATE_MEDOIDS) -> int:
+    """Delete face_embeddings rows and update their profiles' templates."""
+    ids = list(ids)
+    rows = conn.execute(
+        select(FaceEmbedding.profile_id, FaceEmbedding.embedding).where(
+            FaceEmbedding.id.in_(ids)
+        )
+    ).fetchall()
+    if not rows:
+        return 0
+    conn.execute(delete(FaceEmbedding).where(FaceEmbedding.id.in_(ids)))
+    vectors = decode_embeddings(row.embedding for row in rows)
+    _apply_delta(conn, [row.profile_id for row in rows], vectors, -1, medoids)
+    return len(rows)
+
+
+def sync(conn, medoids=TEMPLATE_MEDOIDS) -> int:
+    """
+    Recompute profiles whose centroid count differs from their number of
+    raw embeddings (rows written without add_embeddings), and drop templates
+    of profiles that no longer have any. Returns profiles recomputed.
+    """
+    raw = dict(
+        conn.execute(
+            select(FaceEmbedding.profile_id, func.count()).group_by(
+                FaceEmbedding.profile_id
+            )
+        ).fetchall()
+    )
+    stored = dict(
+        conn.execute(
+            select(ProfileTemplate.profile_id, ProfileTemplate.source_count).where(
+                ProfileTemplate.kind == KIND_CENTROID
+            )
+        ).fetchall()
+    )
+    stale = [pid for pid, n in raw.items() if stored.get(pid) != n]
+    stale += [pid for pid in stored if pid not in raw]
+    return recompute_profiles(conn, stale, medoids) if stale else 0
+
+
+def rebuild(conn, medoids=TEMPLATE_MEDOIDS) -> int:
+    conn.execute(delete(ProfileTemplate))
+    pids = [pid for (pid,) in conn.execute(select(FaceEmbedding.profile_id).distinct())]
+    return recompute_profiles(conn, pids, medoids)
+
+
+def load_templates(conn) -> Tuple[SumTable, MedoidMap]:
+    """Stored centroid sums (kind 0) and sub-templates (kind 1)."""
+    rows = conn.execute(
+        select(
+            ProfileTemplate.profile_id,
+            ProfileTemplate.kind,
+            ProfileTemplate.embedding,
+            ProfileTemplate.source_count,
+        ).order_by(ProfileTemplate.profile_id, ProfileTemplate.id)
+    ).fetchall()
+    empty = np.zeros((0, EMBEDDING_DIM), np.float32)
+    if not rows:
+        return (np.zeros(0, np.int64), np.zeros(0, np.int64), empty), {}
+    mat = decode_embeddings(row.embedding for row in rows)
+    pids = np.array([row.profile_id for row in rows], np.int64)
+    kinds = np.array([row.kind for row in rows])
+    counts = np.array([row.source_count for row in rows], np.int64)
+
+    c = kinds == KIND_CENTROID  # one per profile, already sorted by profile
+    sums = (pids[c], counts[c], np.ascontiguousarray(mat[c], dtype=np.float32))
+    m = kinds == KIND_MEDOID
+    medoids = {
+        int(pid): (
+            int(counts[m][pids[m] == pid][0]),
+            l2_normalize(mat[m][pids[m] == pid]),
+        )
+        for pid in np.unique(pids[m])
+    }
+    return sums, medoids
+
+
+# -------------------------------
+# CLI: sync / rebuild / remove / report
+# -------------------------------
+def synthetic_profiles(
+    profiles: int, per_profile: int, queries: int, spread: float = 1.2, seed: int = 0
+):
+    """
+    Members with `per_profile` embeddings scattered around an identity vector,
+    and queries that are new noisy views of random members.
+    """
+    rng = np.random.default_rng(seed)
+    centers = l2_normalize(rng.standard_normal((profiles, EMBEDDING_DIM)))
+
+    # spread 1.2: view-to-view cosine ~0.4, as for ArcFace photos of one person
+    def views(owner):
+        noise = l2_normalize(rng.standard_normal((len(owner), EMBEDDING_DIM)))
+        return l2_normalize(centers[owner] + spread * noise)
+
+    owner = np.repeat(np.arange(profiles), per_profile)
+    base = GalleryIndex(np.arange(len(owner)), owner, views(owner))
+    q_owner = rng.integers(0, profiles, queries)
+    return base, views(q_owner), q_owner
+
+
+def report(profiles: int, per_profile: int, queries: int, medoids: int) -> None:
+    base, q, q_owner = synthetic_profiles(profiles, per_profile, queries)
+    t0 = time.perf_counter()
+    index = TemplateIndex(base, medoids=medoids)
+    build_s = time.perf_counter() - t0
+
+    def run(idx, **kw):
+        t = time.perf_counter()
+        _, pids, _ = zip(*[idx.search(q[i], 1, **kw) for i in range(len(q))])
+        ms = (time.perf_counter() - t) * 1000.0 / len(q)
+        return np.array([p[0, 0] for p in pids]), ms
+
+    exact, exact_ms = run(base)
+    print(
+        f"[INFO] {profiles} profiles x {per_profile} = {len(base)} embeddings, "
+        f"{index.n_templates} templates (medoids={medoids}), built in {build_s:.2f}s"
+    )
+    print(f"{'mode':<12} {'cand':>5} {'agree@1':>8} {'correct@1':>10} {'ms/query':>9}")
+    print(
+        f"{'exact':<12} {'-':>5} {1.0:>8.4f} "
+        f"{np.mean(exact == q_owner):>10.4f} {exact_ms:>9.3f}"
+    )
+    for c in (1, 4, 16, 64):
+        if c > len(index.profiles):
+            break
+        got, ms = run(index, candidates=c)
+        print(
+            f"{'templates':<12} {c:>5} {np.mean(got == exact):>8.4f} "
+            f"{np.mean(got == q_owner):>10.4f} {ms:>9.3f}"
+        )
+
+
+if __name__ == "__main__":
+    from lab.db.test_database import engine
+
+    parser = argparse.ArgumentParser(description="Profile template tools")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    for name, text in (
+        ("sync", "recompute profiles that are out of date"),
+        ("rebuild", "recompute every profile (e.g. after changing --medoids)"),
+    ):
+        p = sub.add_parser(name, help=text)
+        p.add_argument("--medoids", type=int, default=TEMPLATE_MEDOIDS)
+    d = sub.add_parser("remove", help="delete embeddings and update templates")
+    d.add_argument("ids", type=int, nargs="*", help="face_embeddings ids")
+    d.add_argument("--profile", type=int, action="append", default=[])
+    d.add_argument("--medoids", type=int, default=TEMPLATE_MEDOIDS)
+    r = sub.add_parser("report", help="recall/latency on synthetic profiles")
+    r.add_argument("--profiles", type=int, default=20000)
+    r.add_argument("--per-profile", type=int, default=5)
+    r.add_argument("--queries", type=int, default=200)
+    r.add_argument("--medoids", type=int, default=TEMPLATE_MEDOIDS)
+    args = parser.parse_args()
+
+    if args.cmd == "report":
+        report(args.profiles, args.per_profile, args.queries, args.medoids)
+    elif args.cmd == "remove":
+        with engine.begin() as conn:
+            ids = list(args.ids)
+            if args.profile:
+                ids += conn.execute(
+                    select(FaceEmbedding.id).where(
+                        FaceEmbedding.profile_id.in_(args.profile)
+                    )
+                ).scalars()
+            n = remove_embeddings(conn, ids, args.medoids)
+        print(f"[INFO] Removed {n} embedding(s); templates updated")
+    else:
+        t0 = time.perf_counter()
+        with engine.begin() as conn:
+            n = (sync if args.cmd == "sync" else rebuild)(conn, args.medoids)
+        print(
+            f"[INFO] Templates {args.cmd}: {n} profile(s) recomputed in "
+            f"{time.perf_counter() - t0:.2f}s"
+        )
@@ -10,6 +10,7 @@ import sys
 import cv2
 import numpy as np
 
+from lab.db.embedding_codec import decode_embedding, encode_embedding
 from lab.db.models import FaceEmbedding
 
 # --- Import DB models and session ---
@@ -55,12 +56,12 @@ def run(image_path: str, profile_id: int = 1):
         print("[ERROR] Invalid embedding.")
         return
 
-    # --- Convert embedding to CSV string ---
-    emb_str = ",".join(map(str, vec.tolist()))
+    # --- Convert embedding to binary blob ---
+    emb_blob = encode_embedding(vec)
 
     # --- Store in DB ---
     db = SessionLocal()
-    face_emb = FaceEmbedding(profile_id=profile_id, embedding=emb_str, confidence=1.0)
+    face_emb = FaceEmbedding(profile_id=profile_id, embedding=emb_blob, confidence=1.0)
     db.add(face_emb)
     db.commit()
     db.refresh(face_emb)
@@ -69,8 +70,9 @@ def run(image_path: str, profile_id: int = 1):
 
     # --- Read back and check ---
     saved = db.query(FaceEmbedding).filter_by(id=face_emb.id).first()
-    emb_back = np.fromstring(saved.embedding, sep=",")
+    emb_back = decode_embedding(saved.embedding)
     print(f"[INFO] Loaded embedding length: {emb_back.shape[0]}")
+    print(f"[INFO] Exact match: {np.array_equal(emb_back, vec.astype(np.float32))}")
     print(f"[INFO] First 5 values (back): {emb_back[:5]}")
 
     db.close()
@@ -10,6 +10,7 @@ import sys
 import cv2
 import numpy as np
 
+from lab.db.embedding_codec import decode_embedding, encode_embedding
 from lab.db.models import FaceEmbedding
 
 # ✅ اتصال به دیتابیس آزمایشگاه
@@ -51,14 +52,14 @@ def run(image_path: str, profile_id: int = 1, confidence: float = 1.0):
         print("[ERROR] Invalid embedding.")
         return
 
-    # 6) Convert to CSV string
-    emb_str = ",".join(map(str, vec.tolist()))
+    # 6) Convert to binary blob
+    emb_blob = encode_embedding(vec)
 
     # 7) Store in lab DB
     db = SessionLocal()
     try:
         record = FaceEmbedding(
-            profile_id=profile_id, embedding=emb_str, confidence=confidence
+            profile_id=profile_id, embedding=emb_blob, confidence=confidence
         )
         db.add(record)
         db.commit()
@@ -69,9 +70,12 @@ def run(image_path: str, profile_id: int = 1, confidence: float = 1.0):
 
         # 8) Read back and verify
         loaded = db.query(FaceEmbedding).filter_by(id=record.id).first()
-        emb_back = np.fromstring(loaded.embedding, sep=",")
+        emb_back = decode_embedding(loaded.embedding)
         same_len = emb_back.shape[0] == vec.shape[0]
-        print(f"[INFO] Loaded len={emb_back.shape[0]} (same_len={same_len})")
+        exact = np.array_equal(emb_back, vec.astype(np.float32))
+        print(
+            f"[INFO] Loaded len={emb_back.shape[0]} (same_len={same_len}, exact={exact})"
+        )
         print(f"[INFO] First 5 values (back): {emb_back[:5]}")
     finally:
         db.close()
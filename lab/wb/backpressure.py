@@ -0,0 +1,117 @@
+# lab/wb/backpressure.py
+"""
+Per-connection backpressure for the stream server.
+- FrameMailbox: single slot, a new frame replaces one that was not picked up
+  yet (latest frame wins), so slow inference never builds a backlog
+- FlowController: watches the drop ratio and processing time and produces
+  flow-control messages asking the client to lower (or raise) fps / quality
+"""
+
+import asyncio
+import time
+from collections import deque
+from typing import Optional
+
+from lab.face.models_config import (
+    FLOW_CONTROL_INTERVAL_S,
+    FLOW_DROP_RATIO_HIGH,
+    FLOW_QUALITY_STEP,
+    FLOW_WINDOW_FRAMES,
+)
+
+_EMA_ALPHA = 0.2
+
+
+class FrameMailbox:
+    def __init__(self):
+        self._item = None
+        self._seq = 0
+        self._ready = asyncio.Event()
+        self._closed = False
+
+    def put(self, item) -> bool:
+        """Store the newest frame; returns True if an unprocessed one was dropped."""
+        self._seq += 1
+        replaced = self._item is not None
+        self._item = (self._seq, item)
+        self._ready.set()
+        return replaced
+
+    async def get(self):
+        """Wait for the next frame -> (seq, item), or None once closed and empty."""
+        while self._item is None:
+            if self._closed:
+                return None
+            self._ready.clear()
+            await self._ready.wait()
+        item, self._item = self._item, None
+        return item
+
+    def close(self) -> None:
+        self._closed = True
+        self._ready.set()
+
+
+class FlowController:
+    def __init__(
+        self,
+        window: int = FLOW_WINDOW_FRAMES,
+        drop_ratio_high: float = FLOW_DROP_RATIO_HIGH,
+        interval_s: float = FLOW_CONTROL_INTERVAL_S,
+        quality_step: int = FLOW_QUALITY_STEP,
+        concurrency: int = 1,
+    ):
+        self.concurrency = concurrency  # frames processed in parallel
+        self.drop_ratio_high = drop_ratio_high
+        self.interval_s = interval_s
+        self.quality_step = quality_step
+        self._outcomes = deque(maxlen=window)  # True = frame was dropped
+        self._proc_ms: Optional[float] = None
+        self._last_sent = 0.0
+        self._throttled = False
+
+    def record_frame(self, dropped: bool) -> None:
+        self._outcomes.append(dropped)
+
+    def record_processing(self, elapsed_ms: float) -> None:
+        if self._proc_ms is None:
+            self._proc_ms = elapsed_ms
+        else:
+            self._proc_ms += _EMA_ALPHA * (elapsed_ms - self._proc_ms)
+
+    @property
+    def drop_ratio(self) -> float:
+        return sum(self._outcomes) / len(self._outcomes) if self._outcomes else 0.0
+
+    def sustainable_fps(self) -> Optional[float]:
+        """Frame rate this connection is currently being served at."""
+        if not self._proc_ms:
+            return None
+        return round(max(1.0, self.concurrency * 1000.0 / self._proc_ms), 1)
+
+    def advice(self) -> Optional[dict]:
+        """Flow-control message to send now, if any."""
+        now = time.monotonic()
+        full = len(self._outcomes) == self._outcomes.maxlen
+        if not full or now - self._last_sent < self.interval_s:
+            return None
+
+        ratio = self.drop_ratio
+        if ratio > self.drop_ratio_high:
+            action, delta = "slow_down", -self.quality_step
+            self._throttled = True
+        elif ratio == 0.0 and self._throttled:
+            action, delta = "speed_up", self.quality_step // 2
+            self._throttled = False
+        else:
+            return None
+
+        self._last_sent = now
+        self._outcomes.clear()  # judge the next window on the new settings
+        return {
+            "type": "flow_control",
+            "action": action,
+            "max_fps": self.sustainable_fps(),
+            "quality_delta": delta,
+            "drop_ratio": round(ratio, 3),
+        }
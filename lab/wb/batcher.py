@@ -0,0 +1,105 @@
+# lab/wb/batcher.py
+"""
+Cross-connection micro-batching for the websocket server.
+- Requests from all connections are queued in one place per stage
+- A batch is flushed when it reaches `max_batch` or its oldest item has
+  waited `max_wait_ms`, runs as one job on the inference pool, and each
+  result is handed back to the coroutine that submitted it
+"""
+
+import asyncio
+import time
+from collections import Counter
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+
+class MicroBatcher:
+    """
+    `batch_fn(items) -> results` must return one result per item, in order.
+    It runs on `pool` (see lab.wb.workers.InferencePool).
+    """
+
+    def __init__(
+        self,
+        name: str,
+        pool,
+        batch_fn: Callable,
+        max_batch: int,
+        max_wait_ms: float,
+    ):
+        self.name = name
+        self.pool = pool
+        self.batch_fn = batch_fn
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self._pending: List[Tuple[object, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks: Set[asyncio.Task] = set()  # the loop only holds weak refs
+        self.batch_sizes: Counter = Counter()
+        self.wait_ms_total = 0.0
+        self._first_enqueued = 0.0
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._pending)
+
+    async def submit(self, item):
+        """Queue one item and wait for its result."""
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        if not self._pending:
+            self._first_enqueued = time.perf_counter()
+        self._pending.append((item, fut))
+
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush)
+        return await fut
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending:
+            return
+
+        batch = self._pending[: self.max_batch]
+        self._pending = self._pending[self.max_batch :]
+        self.batch_sizes[len(batch)] += 1
+        self.wait_ms_total += (time.perf_counter() - self._first_enqueued) * 1000.0
+        loop = asyncio.get_running_loop()
+        task = loop.create_task(self._run(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+        if self._pending:  # leftovers start a fresh deadline
+            self._first_enqueued = time.perf_counter()
+            if len(self._pending) >= self.max_batch:
+                loop.call_soon(self._flush)
+            else:
+                self._timer = loop.call_later(self.max_wait, self._flush)
+
+    async def _run(self, batch) -> None:
+        items = [item for item, _ in batch]
+        try:
+            results = await self.pool.run(self.batch_fn, items)
+        except Exception as exc:
+            for _, fut in batch:
+                if not fut.done():
+                    fut.set_exception(exc)
+            return
+        for (_, fut), result in zip(batch, results):
+            if not fut.done():  # the connection may have gone away
+                fut.set_result(result)
+
+    def stats(self) -> Dict[str, object]:
+        batches = sum(self.batch_sizes.values())
+        items = sum(size * n for size, n in self.batch_sizes.items())
+        return {
+            "batches": batches,
+            "items": items,
+            "mean_batch": round(items / batches, 2) if batches else 0.0,
+            "mean_wait_ms": round(self.wait_ms_total / batches, 2) if batches else 0.0,
+            "sizes": dict(sorted(self.batch_sizes.items())),
+        }
@@ -1,12 +1,231 @@
 # lab/ws/client_cam.py
+"""
+Webcam client for the stream server.
+- Capture + resize + JPEG encode run in a background thread
+- Edge mode (--edge): the light detector runs here and only aligned 112x112
+  face crops (+ boxes) are uploaded, the server skips detection
+- Send and receive are independent tasks, several frames may be in flight;
+  frames go out in the binary envelope (lab.wb.protocol) with a frame id and
+  capture time, so replies are matched to frames and e2e latency is exact
+- fps, resolution and JPEG quality step down/up a ladder so the end-to-end
+  latency stays near a target (server flow-control messages too)
+"""
+
+import argparse
 import asyncio
 import json
+import threading
 import time
+from typing import Dict, List, Optional, Tuple
 
 import cv2
+import numpy as np
 import websockets
 
+from lab.face.models_config import CASCADE_LIGHT_SIZES, CONF_THRESHOLD
+from lab.wb.protocol import (
+    FLAG_JSON_RESPONSE,
+    FMT_CROPS,
+    FMT_JPEG,
+    FMT_JSON,
+    MSG_FLOW_CONTROL,
+    MSG_FRAME,
+    MSG_RESULT,
+    Envelope,
+    decode_result,
+    encode_crops,
+    pack_message,
+    unpack_message,
+)
+
+_EMA_ALPHA = 0.2
+_STEP_DOWN_LOAD = 1.1  # latency / target above this -> cheaper settings
+_STEP_UP_LOAD = 0.6  # latency / target below this -> better settings
+_ADAPT_COOLDOWN_S = 1.0  # min time between two ladder steps
+_MIN_CROP_QUALITY = 75  # face crops are small; keep them sharp for ArcFace
+
+
+# -------------------------------
+# Adaptation
+# -------------------------------
+class StreamSettings:
+    """fps / resolution scale / JPEG quality ladder, cheapest last."""
+
+    def __init__(self, fps: int, quality: int, target_latency_ms: float):
+        self.target_latency_ms = target_latency_ms
+        # (fps, scale, quality): quality goes first, then size, then rate
+        self.ladder: List[Tuple[float, float, int]] = [
+            (fps, 1.0, quality),
+            (fps, 1.0, max(40, quality - 15)),
+            (fps, 0.75, max(40, quality - 15)),
+            (fps * 0.75, 0.75, max(40, quality - 25)),
+            (fps * 0.5, 0.5, max(40, quality - 25)),
+            (fps * 0.35, 0.5, max(40, quality - 35)),
+        ]
+        self.level = 0
+        self.max_fps = float(fps)  # cap from server flow control
+        self._ema_ms: Optional[float] = None
+        self._last_change = 0.0
+
+    @property
+    def fps(self) -> float:
+        return max(1.0, min(self.ladder[self.level][0], self.max_fps))
+
+    @property
+    def scale(self) -> float:
+        return self.ladder[self.level][1]
+
+    @property
+    def quality(self) -> int:
+        return self.ladder[self.level][2]
+
+    def _step(self, delta: int, force: bool = False) -> bool:
+        now = time.monotonic()
+        if not force and now - self._last_change < _ADAPT_COOLDOWN_S:
+            return False
+        level = min(max(self.level + delta, 0), len(self.ladder) - 1)
+        if level == self.level:
+            return False
+        self.level = level
+        self._last_change = now
+        self._ema_ms = None  # re-measure at the new settings
+        return True
+
+    def report_latency(self, latency_ms: float) -> bool:
+        """Feed a measured latency; returns True if settings changed."""
+        if self._ema_ms is None:
+            self._ema_ms = latency_ms
+        else:
+            self._ema_ms += _EMA_ALPHA * (latency_ms - self._ema_ms)
+        load = self._ema_ms / self.target_latency_ms
+        if load > _STEP_DOWN_LOAD:
+            return self._step(+1)
+        if load < _STEP_UP_LOAD:
+            return self._step(-1)
+        return False
+
+    def apply_flow_control(self, msg: dict) -> None:
+        if msg.get("max_fps"):
+            self.max_fps = max(1.0, float(msg["max_fps"]))
+        if msg.get("action") == "slow_down":
+            self._step(+1, force=True)
+        elif msg.get("action") == "speed_up":
+            self.max_fps = self.ladder[0][0]
+            self._step(-1, force=True)
+
+    def describe(self) -> str:
+        return f"fps={self.fps:.1f} scale={self.scale} quality={self.quality}"
+
 
+# -------------------------------
+# Edge detection
+# -------------------------------
+class EdgeDetector:
+    """Light detector on the client: frame -> crop message bytes."""
+
+    def __init__(self, raw_crops: bool = False):
+        # onnxruntime is only needed on clients that run in edge mode
+        from lab.face import pipeline
+
+        self.pipeline = pipeline
+        self.session = pipeline.create_light_detection_session()
+        self.input_size = pipeline.session_input_size(
+            self.session, CASCADE_LIGHT_SIZES[0]
+        )
+        self.raw_crops = raw_crops
+
+    def __call__(self, frame: np.ndarray, quality: int, ts: float) -> bytes:
+        boxes, scores, _ = self.pipeline.detect_faces_full(
+            self.session, frame, self.input_size, CONF_THRESHOLD
+        )
+        crops, kept, kept_scores = [], [], []
+        for box, score in zip(boxes.astype(np.int64).tolist(), scores.tolist()):
+            crop, clipped = self.pipeline.crop_faces(frame, [box])
+            if crop:
+                crops.append(self.pipeline.align_face(crop[0]))
+                kept.append(clipped[0])
+                kept_scores.append(score)
+
+        h, w = frame.shape[:2]
+        jpeg_quality = 0 if self.raw_crops else max(quality, _MIN_CROP_QUALITY)
+        return encode_crops(crops, kept, kept_scores, (w, h), ts, jpeg_quality)
+
+
+# -------------------------------
+# Capture thread
+# -------------------------------
+class FrameProducer(threading.Thread):
+    """
+    Reads the camera continuously and, at the current fps, resizes and
+    encodes the newest frame (or detects and packs its face crops in edge
+    mode). Only the latest encoded message is kept.
+    """
+
+    def __init__(
+        self,
+        cap: cv2.VideoCapture,
+        settings: StreamSettings,
+        loop,
+        edge: Optional[EdgeDetector] = None,
+    ):
+        super().__init__(daemon=True, name="capture")
+        self.cap = cap
+        self.settings = settings
+        self.loop = loop
+        self.edge = edge
+        self.ready: asyncio.Queue = asyncio.Queue(maxsize=1)
+        self.stopped = threading.Event()
+        self.encoded = 0
+        self.replaced = 0
+
+    def _publish(self, item) -> None:
+        # runs on the event loop: replace a frame the sender has not taken yet
+        if self.ready.full():
+            self.ready.get_nowait()
+            self.replaced += 1
+        self.ready.put_nowait(item)
+
+    def run(self) -> None:
+        next_due = 0.0
+        while not self.stopped.is_set():
+            ret, frame = self.cap.read()  # blocks at the camera's own rate
+            if not ret:
+                print("[WARN] Frame read failed.")
+                time.sleep(0.1)
+                continue
+
+            now = time.monotonic()
+            if now < next_due:
+                continue
+            next_due = now + 1.0 / self.settings.fps
+
+            ts, quality = time.time(), self.settings.quality
+            if self.edge is not None:
+                # detection runs on the full-resolution frame
+                self.encoded += 1
+                message = self.edge(frame, quality, ts)
+                self.loop.call_soon_threadsafe(self._publish, (ts, message))
+                continue
+
+            scale = self.settings.scale
+            if scale != 1.0:
+                frame = cv2.resize(
+                    frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA
+                )
+            ok, buf = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+            if not ok:
+                print("[WARN] JPEG encode failed.")
+                continue
+            self.encoded += 1
+            self.loop.call_soon_threadsafe(self._publish, (ts, buf.tobytes()))
+
+    def stop(self) -> None:
+        self.stopped.set()
+
+
+# -------------------------------
+# Streaming
+# -------------------------------
 async def run(
     url: str,
     camera_index: int = 0,
@@ -14,6 +233,11 @@ async def run(
     width: int = 640,
     height: int = 480,
     quality: int = 80,
+    target_latency_ms: float = 150.0,
+    max_in_flight: int = 3,
+    edge: bool = False,
+    raw_crops: bool = False,
+    json_replies: bool = False,
 ):
     cap = cv2.VideoCapture(camera_index)
     cap.set(cv2.CAP_PROP_FRAME_WIDTH, width)
@@ -22,40 +246,132 @@ async def run(
     if not cap.isOpened():
         raise RuntimeError("Cannot open webcam")
 
-    frame_interval = 1.0 / max(1, fps)
+    settings = StreamSettings(fps, quality, target_latency_ms)
+    detector = EdgeDetector(raw_crops) if edge else None
+    producer = FrameProducer(cap, settings, asyncio.get_running_loop(), detector)
+    state = {"sent": 0, "answered": 0, "server_dropped": 0, "skipped": 0}
+    pending: Dict[int, float] = {}  # frame id -> capture time, unanswered
+    flags = FLAG_JSON_RESPONSE if json_replies else 0
+    payload_format = FMT_CROPS if edge else FMT_JPEG
 
-    async with websockets.connect(f"{url}?fps={fps}", max_size=8 * 1024 * 1024) as ws:
-        print("[INFO] Connected. Streaming frames...")
-        last_send = 0.0
+    async def sender(ws):
+        frame_id = 0
         while True:
-            ret, frame = cap.read()
-            if not ret:
-                print("[WARN] Frame read failed.")
-                await asyncio.sleep(0.1)
+            ts, payload = await producer.ready.get()
+            if len(pending) >= max_in_flight:
+                state["skipped"] += 1  # server is behind; keep the newest only
                 continue
+            frame_id += 1
+            env = Envelope(MSG_FRAME, payload_format, frame_id, ts, flags)
+            pending[frame_id] = ts
+            await ws.send(pack_message(env, payload))
+            state["sent"] += 1
 
-            now = time.time()
-            if now - last_send >= frame_interval:
-                last_send = now
-                # encode to JPEG
-                ok, buf = cv2.imencode(
-                    ".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, quality]
-                )
-                if not ok:
-                    print("[WARN] JPEG encode failed.")
-                    continue
-                await ws.send(buf.tobytes())
-
-            try:
-                msg = await asyncio.wait_for(ws.recv(), timeout=1.0)
-                data = json.loads(msg)
-                print(
-                    f"[INFO] latency={data.get('latency_ms')} ms, faces={data.get('faces')}, match={data.get('match')}"
-                )
-            except asyncio.TimeoutError:
-                # no message this cycle; continue
-                pass
+    def resolve(frame_id: int) -> None:
+        # replies come in frame order: older unanswered frames were dropped
+        for fid in [fid for fid in pending if fid <= frame_id]:
+            del pending[fid]
+            if fid != frame_id:
+                state["server_dropped"] += 1
+
+    def parse(msg):
+        """-> (message type, frame id, decoded dict)"""
+        if isinstance(msg, str):  # legacy / debug JSON
+            data = json.loads(msg)
+            kind = MSG_FLOW_CONTROL if data.get("type") == "flow_control" else 0
+            return kind or MSG_RESULT, data.get("frame_id", 0), data
+        env, payload = unpack_message(msg)
+        if env.payload_format == FMT_JSON:
+            data = json.loads(bytes(payload))
+        else:
+            data = decode_result(payload)
+        return env.msg_type, env.frame_id, data
+
+    async def receiver(ws):
+        async for msg in ws:
+            kind, frame_id, data = parse(msg)
+            if kind == MSG_FLOW_CONTROL:
+                settings.apply_flow_control(data)
+                print(f"[INFO] flow control: {data['action']} -> {settings.describe()}")
+                continue
+            ts_capture = pending.get(frame_id)
+            resolve(frame_id)
+            state["answered"] += 1
+            if "error" in data:
+                print(f"[WARN] server error: {data['error']}")
+                continue
+
+            # end-to-end: capture -> reply, both on this machine's clock
+            e2e_ms = (time.time() - ts_capture) * 1000.0 if ts_capture else 0.0
+            if settings.report_latency(e2e_ms or data.get("latency_ms", 0.0)):
+                print(f"[INFO] adapted -> {settings.describe()}")
+            print(
+                f"[INFO] frame={frame_id} e2e={e2e_ms:.1f} ms, "
+                f"latency={data.get('latency_ms')} ms, faces={data.get('faces')}, "
+                f"match={data.get('match')}, in_flight={len(pending)}"
+            )
+
+    # server rate limit at the top of the ladder; adaptation only goes lower
+    async with websockets.connect(f"{url}?fps={fps}", max_size=8 * 1024 * 1024) as ws:
+        print("[INFO] Connected. Streaming frames...")
+        producer.start()
+        tasks = [asyncio.create_task(sender(ws)), asyncio.create_task(receiver(ws))]
+        try:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                task.result()  # surface connection errors
+        finally:
+            for task in tasks:
+                task.cancel()
+            producer.stop()
+            producer.join(timeout=2.0)
+            cap.release()
+            print(
+                f"[INFO] encoded={producer.encoded} replaced={producer.replaced} "
+                f"sent={state['sent']} skipped={state['skipped']} "
+                f"answered={state['answered']} server_dropped={state['server_dropped']}"
+            )
 
 
 if __name__ == "__main__":
-    asyncio.run(run("ws://localhost:8765/stream", camera_index=0, fps=10))
+    parser = argparse.ArgumentParser(description="Stream a webcam to the server")
+    parser.add_argument("--url", default="ws://localhost:8765/stream")
+    parser.add_argument("--camera", type=int, default=0)
+    parser.add_argument("--fps", type=int, default=10)
+    parser.add_argument("--width", type=int, default=640)
+    parser.add_argument("--height", type=int, default=480)
+    parser.add_argument("--quality", type=int, default=80)
+    parser.add_argument(
+        "--target-latency-ms",
+        type=float,
+        default=150.0,
+        help="end-to-end latency the client adapts fps/size/quality to",
+    )
+    parser.add_argument("--max-in-flight", type=int, default=3)
+    parser.add_argument(
+        "--edge",
+        action="store_true",
+        help="detect faces locally and upload only aligned crops",
+    )
+    parser.add_argument(
+        "--raw-crops", action="store_true", help="edge mode: send crops without JPEG"
+    )
+    parser.add_argument(
+        "--json", action="store_true", help="ask for JSON replies (debugging)"
+    )
+    args = parser.parse_args()
+    asyncio.run(
+        run(
+            args.url,
+            args.camera,
+            args.fps,
+            args.width,
+            args.height,
+            args.quality,
+            args.target_latency_ms,
+            args.max_in_flight,
+            args.edge,
+            args.raw_crops,
+            args.json,
+        )
+    )
@@ -0,0 +1,150 @@
+# lab/wb/metrics.py
+"""
+In-process metrics for the websocket server, in the Prometheus text format
+(served on /metrics by lab.wb.server, same port as the stream).
+- Per-stage latency histograms: every answered frame records the time it
+  spent in each pipeline stage (STAGES)
+- Counters (frames, drops, errors)
+- Gauges (queue depth, connections, gallery size) read at scrape time
+"""
+
+import bisect
+from typing import Callable, Dict, List, Optional, Tuple
+
+from lab.face.models_config import METRICS_BUCKETS_MS, METRICS_PREFIX
+
+# Order is part of the binary result format (lab.wb.protocol): append only.
+#   queue      frame waiting in the connection mailbox
+#   decode     JPEG (or edge crop message) decode
+#   preprocess letterbox + normalize, detect = detector run, nms = decode + NMS
+#   crop       crop + align to 112x112
+#   embed      ArcFace, including the wait for a batch to fill
+#   match      gallery search
+#   serialize  reply encoding (histogram only, not in per-response breakdowns)
+#   total      detection start -> reply ready (the reply's latency_ms)
+STAGES = (
+    "queue",
+    "decode",
+    "preprocess",
+    "detect",
+    "nms",
+    "crop",
+    "embed",
+    "match",
+    "serialize",
+    "total",
+)
+
+
+class Histogram:
+    """Cumulative-bucket histogram; observations in seconds."""
+
+    def __init__(self, buckets_s: Tuple[float, ...]):
+        self.buckets = tuple(sorted(buckets_s))
+        self.counts = [0] * (len(self.buckets) + 1)  # last bucket = +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+
+    def cumulative(self) -> List[Tuple[str, int]]:
+        out, running = [], 0
+        for bound, n in zip(self.buckets, self.counts):
+            running += n
+            out.append((f"{bound:g}", running))
+        out.append(("+Inf", self.count))
+        return out
+
+
+def _num(value: float) -> str:
+    value = float(value)
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+def _labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    inner = ",".join(f'{k}="{v}"' for k, v in sorted(labels.items()))
+    return "{" + inner + "}"
+
+
+class Metrics:
+    def __init__(
+        self,
+        prefix: str = METRICS_PREFIX,
+        buckets_ms: Tuple[float, ...] = METRICS_BUCKETS_MS,
+    ):
+        self.prefix = prefix
+        buckets_s = tuple(b / 1000.0 for b in buckets_ms)
+        self.stages = {stage: Histogram(buckets_s) for stage in STAGES}
+        self._help: Dict[str, Tuple[str, str]] = {}  # name -> (type, help)
+        self._counters: Dict[Tuple[str, Tuple], float] = {}
+        self._gauges: Dict[str, List[Tuple[Dict[str, str], Callable]]] = {}
+
+    # -------------------------------
+    # Recording
+    # -------------------------------
+    def observe_stages(self, stages_ms: Dict[str, float]) -> None:
+        for stage, ms in stages_ms.items():
+            hist = self.stages.get(stage)
+            if hist is not None:
+                hist.observe(ms / 1000.0)
+
+    def counter(self, name: str, help_text: str) -> None:
+        self._help[name] = ("counter", help_text)
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        self._counters[key] = self._counters.get(key, 0) + value
+
+    def gauge(
+        self,
+        name: str,
+        help_text: str,
+        fn: Callable[[], float],
+        labels: Optional[Dict[str, str]] = None,
+    ) -> None:
+        """Register a gauge; `fn()` is called on every scrape."""
+        self._help[name] = ("gauge", help_text)
+        self._gauges.setdefault(name, []).append((labels or {}, fn))
+
+    # -------------------------------
+    # Export
+    # -------------------------------
+    def render(self) -> str:
+        p = self.prefix
+        lines = [
+            f"# HELP {p}_stage_seconds Time a frame spent in each pipeline stage.",
+            f"# TYPE {p}_stage_seconds histogram",
+        ]
+        for stage, hist in self.stages.items():
+            for le, n in hist.cumulative():
+                lines.append(
+                    f'{p}_stage_seconds_bucket{{stage="{stage}",le="{le}"}} {n}'
+                )
+            lines.append(f'{p}_stage_seconds_sum{{stage="{stage}"}} {hist.sum:.6f}')
+            lines.append(f'{p}_stage_seconds_count{{stage="{stage}"}} {hist.count}')
+
+        counters: Dict[str, List[str]] = {}
+        for (name, labels), value in sorted(self._counters.items()):
+            counters.setdefault(name, []).append(
+                f"{p}_{name}{_labels(dict(labels))} {_num(value)}"
+            )
+        for name, (kind, help_text) in self._help.items():
+            if kind == "counter":
+                samples = counters.get(name, [f"{p}_{name} 0"])
+            else:
+                samples = []
+                for labels, fn in self._gauges[name]:
+                    try:
+                        value = fn()
+                    except Exception:  # a broken gauge must not fail the scrape
+                        continue
+                    samples.append(f"{p}_{name}{_labels(labels)} {_num(value)}")
+            lines.append(f"# HELP {p}_{name} {help_text}")
+            lines.append(f"# TYPE {p}_{name} {kind}")
+            lines.extend(samples)
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,311 @@
+# lab/wb/protocol.py
+"""
+Binary messages between camera clients and the stream server.
+- Envelope (v1): magic "GY", version, message type, payload format, flags,
+  frame id, capture time; the payload is the rest of the websocket message
+- Frame payloads: a JPEG, or face crops from an edge client
+  crops header: magic "FC", version, face count, frame w/h, capture time
+  crop record:  box (int16 x4, frame pixels), score (uint16, x1000),
+                crop format (0 raw 112x112 BGR, 1 JPEG), payload length, payload
+- Result payloads: compact binary (below) or JSON for debugging; with
+  FLAG_STAGE_TIMINGS (or ?stages=1) a per-stage ms breakdown follows the
+  face records (stage count, then stage index + float32 ms per stage)
+Messages without an envelope (a bare JPEG or crop message) are still accepted
+and answered with JSON text, as before.
+"""
+
+import json
+import struct
+from typing import List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from lab.face.models_config import ARCFACE_INPUT_SIZE
+from lab.wb.metrics import STAGES
+
+ENVELOPE_MAGIC = b"GY"
+PROTOCOL_VERSION = 1
+
+# message types
+MSG_FRAME = 1
+MSG_RESULT = 2
+MSG_FLOW_CONTROL = 3
+MSG_ERROR = 4
+
+# payload formats
+FMT_JPEG = 0  # MSG_FRAME
+FMT_CROPS = 1  # MSG_FRAME
+FMT_BINARY = 0  # MSG_RESULT
+FMT_JSON = 1  # any message type
+
+# flags (MSG_FRAME)
+FLAG_JSON_RESPONSE = 0x01  # answer this frame with a JSON result payload
+FLAG_STAGE_TIMINGS = 0x02  # include the per-stage breakdown in the result
+
+CROPS_MAGIC = b"FC"
+CROPS_VERSION = 1
+CROP_RAW = 0
+CROP_JPEG = 1
+
+_ENVELOPE = struct.Struct("<2sBBBBId")
+_CROPS_HEADER = struct.Struct("<2sBBHHd")
+_CROP_RECORD = struct.Struct("<4hHBI")
+# ts_server, latency_ms, queue_ms, frame_seq, dropped (replaced, rate_limited),
+# faces detected, face records
+_RESULT_HEADER = struct.Struct("<dffIIIHH")
+# track id, box, flags, similarity, gallery id, profile id
+_RESULT_FACE = struct.Struct("<I4hBfqq")
+_FACE_REUSED = 0x01
+_FACE_MATCHED = 0x02
+_FACE_ACCEPTED = 0x04
+# optional trailer: stage count, then (index into metrics.STAGES, ms)
+_RESULT_STAGE_COUNT = struct.Struct("<B")
+_RESULT_STAGE = struct.Struct("<Bf")
+
+
+# -------------------------------
+# Envelope
+# -------------------------------
+class Envelope:
+    __slots__ = ("version", "msg_type", "payload_format", "flags", "frame_id", "ts")
+
+    def __init__(
+        self, msg_type, payload_format, frame_id, ts, flags=0, version=PROTOCOL_VERSION
+    ):
+        self.version = version
+        self.msg_type = msg_type
+        self.payload_format = payload_format
+        self.flags = flags
+        self.frame_id = frame_id
+        self.ts = ts  # capture time of the frame (client clock)
+
+
+def has_envelope(data: bytes) -> bool:
+    return data[:2] == ENVELOPE_MAGIC
+
+
+def pack_message(env: Envelope, payload: bytes) -> bytes:
+    header = _ENVELOPE.pack(
+        ENVELOPE_MAGIC,
+        env.version,
+        env.msg_type,
+        env.payload_format,
+        env.flags,
+        env.frame_id & 0xFFFFFFFF,
+        env.ts,
+    )
+    return header + payload
+
+
+def unpack_message(data: bytes) -> Tuple[Envelope, memoryview]:
+    """Split an enveloped message; raises ValueError on malformed input."""
+    try:
+        magic, version, msg_type, fmt, flags, frame_id, ts = _ENVELOPE.unpack_from(
+            data, 0
+        )
+    except struct.error as exc:
+        raise ValueError("truncated envelope") from exc
+    if magic != ENVELOPE_MAGIC:
+        raise ValueError("missing envelope magic")
+    if version != PROTOCOL_VERSION:
+        raise ValueError(f"unsupported protocol version {version}")
+    env = Envelope(msg_type, fmt, frame_id, ts, flags, version)
+    return env, memoryview(data)[_ENVELOPE.size :]
+
+
+def pack_json(msg_type: int, obj: dict, frame_id: int = 0, ts: float = 0.0) -> bytes:
+    """Enveloped JSON (flow control, errors, debug results)."""
+    env = Envelope(msg_type, FMT_JSON, frame_id, ts)
+    return pack_message(env, json.dumps(obj).encode())
+
+
+# -------------------------------
+# Results
+# -------------------------------
+def encode_result(result: dict) -> bytes:
+    """Server response dict (see lab.wb.server) -> compact binary payload."""
+    dropped = result.get("dropped") or {}
+    faces = result["matches"]
+    parts = [
+        _RESULT_HEADER.pack(
+            result["ts_server"],
+            result["latency_ms"],
+            result["queue_ms"],
+            result["frame_seq"],
+            dropped.get("replaced", 0),
+            dropped.get("rate_limited", 0),
+            result["faces"],
+            len(faces),
+        )
+    ]
+    for face in faces:
+        match: Optional[dict] = face["match"]
+        flags = _FACE_REUSED if face["reused"] else 0
+        if match is not None:
+            flags |= _FACE_MATCHED
+            if match["accepted"]:
+                flags |= _FACE_ACCEPTED
+        parts.append(
+            _RESULT_FACE.pack(
+                face["track_id"],
+                *face["box"],
+                flags,
+                match["similarity"] if match else 0.0,
+                match["id"] if match else -1,
+                match["profile_id"] if match else -1,
+            )
+        )
+    stages = result.get("stages")
+    if stages:
+        known = [(STAGES.index(k), v) for k, v in stages.items() if k in STAGES]
+        parts.append(_RESULT_STAGE_COUNT.pack(len(known)))
+        parts.extend(_RESULT_STAGE.pack(i, ms) for i, ms in known)
+    return b"".join(parts)
+
+
+def decode_result(payload: bytes) -> dict:
+    """Inverse of encode_result; same keys as the JSON response."""
+    ts_server, latency, queue, seq, replaced, rate_limited, n_det, n = (
+        _RESULT_HEADER.unpack_from(payload, 0)
+    )
+    offset = _RESULT_HEADER.size
+    faces = []
+    for _ in range(n):
+        track_id, x1, y1, x2, y2, flags, sim, gid, pid = _RESULT_FACE.unpack_from(
+            payload, offset
+        )
+        offset += _RESULT_FACE.size
+        match = None
+        if flags & _FACE_MATCHED:
+            match = {
+                "id": gid,
+                "profile_id": pid,
+                "similarity": sim,
+                "accepted": bool(flags & _FACE_ACCEPTED),
+            }
+        faces.append(
+            {
+                "track_id": track_id,
+                "box": [x1, y1, x2, y2],
+                "match": match,
+                "reused": bool(flags & _FACE_REUSED),
+            }
+        )
+    scored = [f["match"] for f in faces if f["match"] is not None]
+    result = {
+        "ts_server": ts_server,
+        "latency_ms": round(latency, 2),
+        "queue_ms": round(queue, 2),
+        "frame_seq": seq,
+        "dropped": {"replaced": replaced, "rate_limited": rate_limited},
+        "faces": n_det,
+        "match": max(scored, key=lambda m: m["similarity"]) if scored else None,
+        "matches": faces,
+    }
+    if len(payload) > offset:  # stage breakdown trailer
+        (count,) = _RESULT_STAGE_COUNT.unpack_from(payload, offset)
+        offset += _RESULT_STAGE_COUNT.size
+        stages = {}
+        for _ in range(count):
+            index, ms = _RESULT_STAGE.unpack_from(payload, offset)
+            offset += _RESULT_STAGE.size
+            if index < len(STAGES):  # newer server, unknown stage: skip
+                stages[STAGES[index]] = round(ms, 3)
+        result["stages"] = stages
+    return result
+
+
+# -------------------------------
+# Edge crops
+# -------------------------------
+class CropMessage:
+    __slots__ = ("frame_size", "ts_capture", "boxes", "scores", "crops")
+
+    def __init__(self, frame_size, ts_capture, boxes, scores, crops):
+        self.frame_size = frame_size  # (w, h)
+        self.ts_capture = ts_capture
+        self.boxes: List[List[int]] = boxes
+        self.scores: List[float] = scores
+        self.crops: List[np.ndarray] = crops  # aligned 112x112 BGR
+
+
+def is_crop_message(data: bytes) -> bool:
+    return data[:2] == CROPS_MAGIC
+
+
+def encode_crops(
+    crops: List[np.ndarray],
+    boxes: List[List[int]],
+    scores: List[float],
+    frame_size: Tuple[int, int],
+    ts_capture: float,
+    jpeg_quality: int = 0,
+) -> bytes:
+    """Pack aligned crops; jpeg_quality=0 sends raw pixels."""
+    if len(crops) > 255:
+        crops, boxes, scores = crops[:255], boxes[:255], scores[:255]
+    parts = [
+        _CROPS_HEADER.pack(
+            CROPS_MAGIC, CROPS_VERSION, len(crops), *frame_size, ts_capture
+        )
+    ]
+    for crop, box, score in zip(crops, boxes, scores):
+        if jpeg_quality:
+            ok, buf = cv2.imencode(
+                ".jpg", crop, [cv2.IMWRITE_JPEG_QUALITY, jpeg_quality]
+            )
+            if not ok:
+                raise ValueError("JPEG encode failed")
+            fmt, payload = CROP_JPEG, buf.tobytes()
+        else:
+            fmt, payload = CROP_RAW, np.ascontiguousarray(crop, np.uint8).tobytes()
+        score_q = int(round(min(max(score, 0.0), 1.0) * 1000))
+        parts.append(_CROP_RECORD.pack(*box, score_q, fmt, len(payload)))
+        parts.append(payload)
+    return b"".join(parts)
+
+
+def decode_crops(data: bytes) -> CropMessage:
+    """Inverse of encode_crops; raises ValueError on malformed input."""
+    try:
+        magic, version, count, w, h, ts = _CROPS_HEADER.unpack_from(data, 0)
+    except struct.error as exc:
+        raise ValueError("truncated crop header") from exc
+    if magic != CROPS_MAGIC or version != CROPS_VERSION:
+        raise ValueError(f"unsupported crop message version {version}")
+
+    aw, ah = ARCFACE_INPUT_SIZE
+    view = memoryview(data)
+    offset = _CROPS_HEADER.size
+    boxes, scores, crops = [], [], []
+    for _ in range(count):
+        try:
+            x1, y1, x2, y2, score_q, fmt, length = _CROP_RECORD.unpack_from(
+                data, offset
+            )
+        except struct.error as exc:
+            raise ValueError("truncated crop record") from exc
+        offset += _CROP_RECORD.size
+        payload = view[offset : offset + length]
+        offset += length
+        if len(payload) != length:
+            raise ValueError("truncated crop payload")
+
+        if fmt == CROP_RAW:
+            if length != aw * ah * 3:
+                raise ValueError("raw crop has the wrong size")
+            crop = np.frombuffer(payload, np.uint8).reshape(ah, aw, 3)
+        elif fmt == CROP_JPEG:
+            crop = cv2.imdecode(np.frombuffer(payload, np.uint8), cv2.IMREAD_COLOR)
+            if crop is None:
+                raise ValueError("crop JPEG decode failed")
+            if crop.shape[:2] != (ah, aw):
+                crop = cv2.resize(crop, ARCFACE_INPUT_SIZE)
+        else:
+            raise ValueError(f"unknown crop format {fmt}")
+
+        boxes.append([x1, y1, x2, y2])
+        scores.append(score_q / 1000.0)
+        crops.append(crop)
+    return CropMessage((w, h), ts, boxes, scores, crops)
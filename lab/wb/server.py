@@ -1,104 +1,464 @@
 # lab/ws/server.py
+import argparse
 import asyncio
 import json
+import signal
 import time
+from collections import Counter
+from http import HTTPStatus
+from typing import Dict, Optional
 from urllib.parse import parse_qs, urlparse
 
-import cv2
 import numpy as np
 import websockets
 
-from lab.db.models import FaceEmbedding
-from lab.db.test_database import SessionLocal
-from lab.face.pipeline import (
-    cosine_similarity,
-    detect_faces,
-    get_face_embedding,
-    initialize_onnx_sessions,
-    sanity_check_embedding,
+from lab.db.test_database import run_db_blocking
+from lab.face.gallery_cache import GalleryCache
+from lab.face.models_config import (
+    DETECTION_MODE,
+    INFERENCE_POOL_MODE,
+    INFERENCE_WORKERS,
+    METRICS_PATH,
+    MICROBATCH_DET_MAX,
+    MICROBATCH_DET_WAIT_MS,
+    MICROBATCH_EMB_MAX,
+    MICROBATCH_EMB_WAIT_MS,
+    STREAM_PIPELINE_DEPTH,
 )
+from lab.face.pipeline import sanity_check_embedding
+from lab.wb.backpressure import FlowController, FrameMailbox
+from lab.wb.batcher import MicroBatcher
+from lab.wb.metrics import Metrics
+from lab.wb.protocol import (
+    FLAG_JSON_RESPONSE,
+    FLAG_STAGE_TIMINGS,
+    FMT_BINARY,
+    FMT_CROPS,
+    MSG_ERROR,
+    MSG_FLOW_CONTROL,
+    MSG_FRAME,
+    MSG_RESULT,
+    Envelope,
+    encode_result,
+    has_envelope,
+    is_crop_message,
+    pack_json,
+    pack_message,
+    unpack_message,
+)
+from lab.wb.tracker import FaceTracker
+from lab.wb.workers import (
+    DetectResult,
+    InferencePool,
+    decode_edge_frame,
+    detect_frames,
+    embed_crops,
+)
+
+# one gallery for every connection, refreshed in the background
+gallery_cache = GalleryCache()
+
+# decode/detect/embed run here, off the event loop (created in main)
+pool = None  # InferencePool
+
+# frames / face crops from all connections are batched before inference
+det_batcher = None  # MicroBatcher(detect_frames)
+emb_batcher = None  # MicroBatcher(embed_crops)
+
+# frames of one connection processed concurrently (set in main)
+stream_depth = STREAM_PIPELINE_DEPTH
+
+# how often each detector path was taken, across all workers
+detection_paths = Counter()
+
+# per-stage histograms, counters and gauges, scraped on METRICS_PATH
+metrics = Metrics()
+metrics.counter("frames_total", "Frames answered, by result.")
+metrics.counter("frames_dropped_total", "Frames dropped before processing.")
+metrics.counter("connections_total", "Stream connections accepted.")
+connections = set()  # open StreamConnections
+
+
+async def detect_stage(data: bytes, is_crops: bool) -> DetectResult:
+    if is_crops:
+        # edge client already detected and aligned the faces
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, decode_edge_frame, data)
+    # decode JPEG and detect (batched with other connections' frames)
+    return await det_batcher.submit(data)
+
+
+async def track_stage(
+    tracker: FaceTracker, det: DetectResult, timings: Dict[str, float]
+) -> dict:
+    """Track, embed and match one detected frame -> response dict."""
+    loop = asyncio.get_running_loop()
+    detection_paths[det.det_path] += 1
+
+    # only new or changed tracks are embedded (batched across connections)
+    t0 = time.perf_counter()
+    tracked = tracker.update(det.boxes)
+    todo = [i for i, (_, needs) in enumerate(tracked) if needs]
+    vecs = await asyncio.gather(*[emb_batcher.submit(det.crops[i]) for i in todo])
+    t1 = time.perf_counter()
+    timings["embed"] = (t1 - t0) * 1000.0
+
+    # match new embeddings against the shared gallery (matmul, GIL released)
+    valid = [j for j, vec in enumerate(vecs) if sanity_check_embedding(vec)]
+    if valid:
+        gallery = gallery_cache.index  # snapshot; refreshes swap it atomically
+        queries = np.stack([vecs[j] for j in valid])
+        matches = await loop.run_in_executor(None, gallery.best_matches, queries)
+        for j, match in zip(valid, matches):
+            tracker.set_match(tracked[todo[j]][0], match)
+    timings["match"] = (time.perf_counter() - t1) * 1000.0
+
+    faces_info = []
+    for i, (track, needs) in enumerate(tracked):
+        faces_info.append(
+            {
+                "track_id": track.track_id,
+                "box": det.boxes[i],
+                "match": track.match,
+                "reused": not needs,
+            }
+        )
+
+    # best-scoring face kept as "match" for existing clients
+    scored = [f["match"] for f in faces_info if f["match"] is not None]
+    match_info = max(scored, key=lambda m: m["similarity"]) if scored else None
+    return {"faces": det.faces, "match": match_info, "matches": faces_info}
+
+
+class StreamConnection:
+    """
+    One client. The reader puts frames into a latest-wins mailbox; `depth`
+    consumers process them concurrently. Detection overlaps freely, while
+    tracking, embedding, matching and the reply run in frame order.
+    """
+
+    def __init__(self, websocket, json_mode: bool, depth: int, stages: bool = False):
+        self.websocket = websocket
+        self.json_mode = json_mode  # ?format=json: text JSON replies (debugging)
+        self.stages = stages  # ?stages=1: stage breakdown in every reply
+        self.depth = max(1, depth)
+        self.tracker = FaceTracker()
+        self.mailbox = FrameMailbox()
+        self.flow = FlowController(concurrency=self.depth)
+        self.drops = Counter(replaced=0, rate_limited=0)
+        self.binary_client = False  # last frame came in an envelope
+        self._pending = set()  # seqs taken from the mailbox, not yet answered
+        self._turn = asyncio.Condition()
+
+    # -------------------------------
+    # Replies
+    # -------------------------------
+    def _encode(self, env: Optional[Envelope], payload: dict):
+        """Binary envelope for enveloped frames, JSON text otherwise."""
+        json_reply = (
+            env is None or self.json_mode or bool(env.flags & FLAG_JSON_RESPONSE)
+        )
+        if json_reply:
+            if env is not None:
+                payload = {"frame_id": env.frame_id, "ts_capture": env.ts, **payload}
+            return json.dumps(payload)
+        if "error" in payload:
+            return pack_json(MSG_ERROR, payload, env.frame_id, env.ts)
+        reply = Envelope(MSG_RESULT, FMT_BINARY, env.frame_id, env.ts)
+        return pack_message(reply, encode_result(payload))
+
+    async def send_flow_control(self) -> None:
+        advice = self.flow.advice()
+        if advice is None:
+            return
+        if self.binary_client and not self.json_mode:
+            await self.websocket.send(pack_json(MSG_FLOW_CONTROL, advice))
+        else:
+            await self.websocket.send(json.dumps(advice))
+
+    # -------------------------------
+    # Processing
+    # -------------------------------
+    async def _serve(self, seq: int, frame) -> None:
+        try:
+            await self._answer(seq, frame)
+        except websockets.ConnectionClosed:
+            raise
+        except Exception as exc:  # one bad frame must not stop this consumer
+            print(f"[ERROR] Frame {seq} failed: {exc!r}")
+            metrics.inc("frames_total", result="error")
+            env = frame[1]
+            error = {"error": f"internal_error: {type(exc).__name__}"}
+            await self.websocket.send(self._encode(env, error))
+        finally:
+            async with self._turn:
+                self._pending.discard(seq)
+                self._turn.notify_all()
+
+    async def _answer(self, seq: int, frame) -> None:
+        t_recv, env, data, is_crops = frame
+        t0 = time.time()
+        det = await detect_stage(data, is_crops)
+
+        # frames overtake each other in detection, not in tracking
+        async with self._turn:
+            await self._turn.wait_for(lambda: min(self._pending) == seq)
+        timings = dict(det.timings)
+        if det.error:
+            payload = {"error": det.error}
+        else:
+            payload = await track_stage(self.tracker, det, timings)
+            latency_ms = (time.time() - t0) * 1000.0
+            self.flow.record_processing(latency_ms)
+            timings["queue"] = (t0 - t_recv) * 1000.0
+            timings["total"] = latency_ms
+            payload = {
+                "ts_server": time.time(),
+                "latency_ms": round(latency_ms, 2),
+                "queue_ms": round((t0 - t_recv) * 1000.0, 2),
+                "frame_seq": seq,
+                "dropped": dict(self.drops),
+                **payload,
+            }
+            if self.stages or (env is not None and env.flags & FLAG_STAGE_TIMINGS):
+                payload["stages"] = {k: round(v, 3) for k, v in timings.items()}
+
+        t_ser = time.perf_counter()
+        reply = self._encode(env, payload)
+        timings["serialize"] = (time.perf_counter() - t_ser) * 1000.0
+        await self.websocket.send(reply)
+        metrics.observe_stages(timings)
+        metrics.inc("frames_total", result="error" if det.error else "answered")
+        await self.send_flow_control()
+
+    async def consume(self) -> None:
+        while True:
+            entry = await self.mailbox.get()
+            if entry is None:
+                return
+            seq, frame = entry
+            self._pending.add(seq)  # mailbox hands frames out in seq order
+            await self._serve(seq, frame)
+
+    # -------------------------------
+    # Input
+    # -------------------------------
+    def parse(self, message: bytes):
+        """Raw message -> (envelope or None, payload bytes, is_crops)."""
+        if has_envelope(message):
+            env, payload = unpack_message(message)
+            if env.msg_type != MSG_FRAME:
+                raise ValueError(f"unexpected message type {env.msg_type}")
+            self.binary_client = True
+            return env, bytes(payload), env.payload_format == FMT_CROPS
+        return None, message, is_crop_message(message)
+
+    def accept(self, t_recv: float, message: bytes) -> None:
+        env, data, is_crops = self.parse(message)
+        replaced = self.mailbox.put((t_recv, env, data, is_crops))
+        self.drops["replaced"] += replaced
+        if replaced:
+            metrics.inc("frames_dropped_total", reason="replaced")
+        self.flow.record_frame(replaced)
 
 
 async def handle_stream(websocket):
-    # parse query (fps optional)
+    # parse query (fps, format optional)
     url = urlparse(websocket.request.path)
     params = parse_qs(url.query)
     target_fps = float(params.get("fps", [10])[0])
+    json_mode = params.get("format", ["binary"])[0] == "json"
+    stages = params.get("stages", ["0"])[0] == "1"
 
-    det_sess, emb_sess = initialize_onnx_sessions()
+    frame_interval = 1.0 / max(1.0, target_fps)
+    last_time = 0.0
+
+    # reading never waits for inference: frames go to a latest-wins slot
+    conn = StreamConnection(websocket, json_mode, stream_depth, stages)
+    consumers = [asyncio.create_task(conn.consume()) for _ in range(conn.depth)]
+    connections.add(conn)
+    metrics.inc("connections_total")
 
-    # preload DB embeddings into memory for faster matching
-    db = SessionLocal()
     try:
-        records = db.query(FaceEmbedding).all()
-        gallery = [
-            (rec.id, rec.profile_id, np.fromstring(rec.embedding, sep=","))
-            for rec in records
-        ]
-        print(f"[INFO] Loaded {len(gallery)} embeddings into memory.")
+        async for message in websocket:
+            # rate limit
+            now = time.time()
+            if now - last_time < frame_interval:
+                conn.drops["rate_limited"] += 1
+                metrics.inc("frames_dropped_total", reason="rate_limited")
+                continue
+            last_time = now
+
+            if not isinstance(message, (bytes, bytearray)):
+                await websocket.send(json.dumps({"error": "invalid_message_type"}))
+                continue
+            try:
+                conn.accept(now, bytes(message))
+            except ValueError as exc:
+                await websocket.send(json.dumps({"error": f"bad_message: {exc}"}))
+    except websockets.ConnectionClosed:
+        for task in consumers:
+            task.cancel()  # nobody left to answer
+        return
     finally:
-        db.close()
+        conn.mailbox.close()
+        connections.discard(conn)
 
-    frame_interval = 1.0 / max(1.0, target_fps)
-    last_time = 0.0
+    results = await asyncio.gather(*consumers, return_exceptions=True)
+    if any(isinstance(r, websockets.ConnectionClosed) for r in results):
+        return
 
-    async for message in websocket:
-        # rate limit
-        now = time.time()
-        if now - last_time < frame_interval:
-            continue
-        last_time = now
-
-        # decode JPEG bytes to np.ndarray (BGR)
-        if isinstance(message, (bytes, bytearray)):
-            data = np.frombuffer(message, dtype=np.uint8)
-            frame = cv2.imdecode(data, cv2.IMREAD_COLOR)
-            if frame is None:
-                await websocket.send(json.dumps({"error": "decode_failed"}))
-                continue
-        else:
-            await websocket.send(json.dumps({"error": "invalid_message_type"}))
-            continue
+    tracker = conn.tracker
+    print(
+        f"[INFO] Connection closed: {tracker.faces_seen} faces, "
+        f"{tracker.embeddings_computed} embeddings computed, "
+        f"dropped {dict(conn.drops)}"
+    )
+    print(f"[INFO] Detector paths so far: {dict(detection_paths)}")
+    print(f"[INFO] Detection batches: {det_batcher.stats()}")
+    print(f"[INFO] Embedding batches: {emb_batcher.stats()}")
+
+
+def serve_http(connection, request):
+    """Plain HTTP on the stream port: METRICS_PATH returns the metrics."""
+    if urlparse(request.path).path != METRICS_PATH:
+        return None  # continue with the websocket handshake
+    response = connection.respond(HTTPStatus.OK, metrics.render())
+    del response.headers["Content-Type"]
+    response.headers["Content-Type"] = "text/plain; version=0.0.4; charset=utf-8"
+    return response
+
+
+def register_gauges() -> None:
+    metrics.gauge(
+        "queue_depth",
+        "Items waiting for a micro-batch.",
+        lambda: det_batcher.queue_depth,
+        {"stage": "detect"},
+    )
+    metrics.gauge(
+        "queue_depth",
+        "Items waiting for a micro-batch.",
+        lambda: emb_batcher.queue_depth,
+        {"stage": "embed"},
+    )
+    metrics.gauge(
+        "inference_in_flight",
+        "Jobs running or waiting on the inference pool.",
+        lambda: pool.in_flight,
+    )
+    metrics.gauge(
+        "active_connections", "Open stream connections.", lambda: len(connections)
+    )
+    metrics.gauge(
+        "gallery_size",
+        "Embeddings in the in-memory gallery.",
+        lambda: len(gallery_cache),
+    )
+    metrics.gauge(
+        "gallery_memory_bytes",
+        "Private bytes held by the gallery's search arrays (mapped snapshot excluded).",
+        lambda: gallery_cache.index.nbytes,
+    )
+    metrics.gauge(
+        "gallery_last_refresh_timestamp_seconds",
+        "Unix time of the last gallery refresh.",
+        lambda: gallery_cache.last_refresh,
+    )
+
+
+async def main(
+    detection_mode: str = DETECTION_MODE,
+    pool_mode: str = INFERENCE_POOL_MODE,
+    workers: int = INFERENCE_WORKERS,
+    det_batch: int = MICROBATCH_DET_MAX,
+    det_wait_ms: float = MICROBATCH_DET_WAIT_MS,
+    emb_batch: int = MICROBATCH_EMB_MAX,
+    emb_wait_ms: float = MICROBATCH_EMB_WAIT_MS,
+    pipeline_depth: int = STREAM_PIPELINE_DEPTH,
+):
+    global pool, det_batcher, emb_batcher, stream_depth
+
+    # models (per worker) and gallery are ready before the first client connects
+    t0 = time.time()
+    pool = InferencePool(pool_mode, workers, detection_mode=detection_mode)
+    await pool.start()
+    det_batcher = MicroBatcher("detect", pool, detect_frames, det_batch, det_wait_ms)
+    emb_batcher = MicroBatcher("embed", pool, embed_crops, emb_batch, emb_wait_ms)
+    stream_depth = pipeline_depth
+    register_gauges()
+    print(f"[INFO] Models loaded and warmed up in {time.time() - t0:.2f}s")
+
+    loop = asyncio.get_running_loop()
+    await run_db_blocking(gallery_cache.load)  # DB thread pool, not the loop
+    refresher = asyncio.create_task(gallery_cache.run_refresh_loop())
+    try:
+        # SIGHUP forces a refresh (e.g. right after a bulk enrollment)
+        loop.add_signal_handler(signal.SIGHUP, gallery_cache.request_refresh)
+    except (NotImplementedError, AttributeError):
+        pass  # not available on Windows
 
-        t0 = time.time()
-        boxes = detect_faces(det_sess, frame)
-        match_info = None
-
-        if boxes:
-            x1, y1, x2, y2 = boxes[0]
-            crop = frame[y1:y2, x1:x2]
-            if crop.size > 0:
-                vec = get_face_embedding(emb_sess, crop)
-                if sanity_check_embedding(vec) and gallery:
-                    # nearest by cosine
-                    best = (-1.0, None, None)  # (sim, id, profile_id)
-                    for rec_id, prof_id, emb_g in gallery:
-                        sim = cosine_similarity(vec, emb_g)
-                        if sim > best[0]:
-                            best = (sim, rec_id, prof_id)
-                    match_info = {
-                        "id": best[1],
-                        "profile_id": best[2],
-                        "similarity": float(best[0]),
-                    }
-
-        latency_ms = (time.time() - t0) * 1000.0
-        payload = {
-            "ts_server": time.time(),
-            "latency_ms": round(latency_ms, 2),
-            "faces": len(boxes),
-            "match": match_info,
-        }
-        await websocket.send(json.dumps(payload))
-
-
-async def main():
     async with websockets.serve(
-        handle_stream, "0.0.0.0", 8765, max_size=8 * 1024 * 1024
+        handle_stream,
+        "0.0.0.0",
+        8765,
+        max_size=8 * 1024 * 1024,
+        process_request=serve_http,
     ):
         print("[INFO] WebSocket server running on ws://localhost:8765/stream")
-        await asyncio.Future()  # run forever
+        print(f"[INFO] Metrics on http://localhost:8765{METRICS_PATH}")
+        try:
+            await asyncio.Future()  # run forever
+        finally:
+            refresher.cancel()
+            pool.shutdown()
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    parser = argparse.ArgumentParser(description="Face recognition websocket server")
+    parser.add_argument(
+        "--detection-mode", choices=["single", "cascade"], default=DETECTION_MODE
+    )
+    parser.add_argument(
+        "--pool", choices=["thread", "process"], default=INFERENCE_POOL_MODE
+    )
+    parser.add_argument(
+        "--workers", type=int, default=INFERENCE_WORKERS, help="0 = one per core"
+    )
+    parser.add_argument(
+        "--det-batch", type=int, default=MICROBATCH_DET_MAX, help="frames per batch"
+    )
+    parser.add_argument(
+        "--det-wait-ms",
+        type=float,
+        default=MICROBATCH_DET_WAIT_MS,
+        help="max wait for a detection batch to fill",
+    )
+    parser.add_argument(
+        "--emb-batch", type=int, default=MICROBATCH_EMB_MAX, help="crops per batch"
+    )
+    parser.add_argument(
+        "--emb-wait-ms",
+        type=float,
+        default=MICROBATCH_EMB_WAIT_MS,
+        help="max wait for an embedding batch to fill",
+    )
+    parser.add_argument(
+        "--pipeline-depth",
+        type=int,
+        default=STREAM_PIPELINE_DEPTH,
+        help="frames per connection in flight at once",
+    )
+    args = parser.parse_args()
+    asyncio.run(
+        main(
+            args.detection_mode,
+            args.pool,
+            args.workers,
+            args.det_batch,
+            args.det_wait_ms,
+            args.emb_batch,
+            args.emb_wait_ms,
+            args.pipeline_depth,
+        )
+    )
@@ -0,0 +1,123 @@
+# lab/wb/tracker.py
+"""
+Per-connection IoU face tracker.
+- Detections are linked to existing tracks by greedy highest-IoU matching
+- A track matched above the login threshold keeps its identity and is only
+  re-embedded every N frames or when its box moves/resizes a lot
+- Tracks that miss too many frames are dropped
+"""
+
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from lab.face.models_config import (
+    TRACK_IOU_THRESHOLD,
+    TRACK_MAX_MISSES,
+    TRACK_REEMBED_EVERY,
+    TRACK_REEMBED_IOU,
+)
+
+
+def iou_matrix(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Pairwise IoU between (N,4) and (M,4) xyxy boxes."""
+    a = np.asarray(a, np.float32).reshape(-1, 4)
+    b = np.asarray(b, np.float32).reshape(-1, 4)
+    ax1, ay1, ax2, ay2 = (a[:, None, i] for i in range(4))
+    w = np.maximum(0.0, np.minimum(ax2, b[:, 2]) - np.maximum(ax1, b[:, 0]))
+    h = np.maximum(0.0, np.minimum(ay2, b[:, 3]) - np.maximum(ay1, b[:, 1]))
+    inter = w * h
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return inter / np.maximum(area_a[:, None] + area_b - inter, 1e-9)
+
+
+class Track:
+    __slots__ = ("track_id", "box", "embed_box", "match", "last_embed", "misses")
+
+    def __init__(self, track_id: int, box):
+        self.track_id = track_id
+        self.box = box
+        self.embed_box = None  # box at the last embedding
+        self.match: Optional[dict] = None
+        self.last_embed = -1
+        self.misses = 0
+
+    @property
+    def identified(self) -> bool:
+        return self.match is not None and self.match.get("accepted", False)
+
+
+class FaceTracker:
+    def __init__(
+        self,
+        iou_threshold: float = TRACK_IOU_THRESHOLD,
+        reembed_every: int = TRACK_REEMBED_EVERY,
+        reembed_iou: float = TRACK_REEMBED_IOU,
+        max_misses: int = TRACK_MAX_MISSES,
+    ):
+        self.iou_threshold = iou_threshold
+        self.reembed_every = reembed_every
+        self.reembed_iou = reembed_iou
+        self.max_misses = max_misses
+        self.tracks: List[Track] = []
+        self.frame_index = 0
+        self._next_id = 1
+        self.faces_seen = 0
+        self.embeddings_computed = 0
+
+    def _associate(self, boxes: List[List[int]]) -> List[Optional[Track]]:
+        """Greedy highest-IoU assignment of detections to live tracks."""
+        assigned: List[Optional[Track]] = [None] * len(boxes)
+        if not self.tracks or not boxes:
+            return assigned
+        ious = iou_matrix([t.box for t in self.tracks], boxes)
+        while True:
+            ti, di = np.unravel_index(np.argmax(ious), ious.shape)
+            if ious[ti, di] < self.iou_threshold:
+                break
+            assigned[di] = self.tracks[ti]
+            ious[ti, :] = -1.0
+            ious[:, di] = -1.0
+        return assigned
+
+    def _needs_embedding(self, track: Track) -> bool:
+        if not track.identified:
+            return True
+        if self.frame_index - track.last_embed >= self.reembed_every:
+            return True
+        moved = iou_matrix([track.embed_box], [track.box])[0, 0]
+        return bool(moved < self.reembed_iou)
+
+    def update(self, boxes: List[List[int]]) -> List[Tuple[Track, bool]]:
+        """
+        Advance one frame. Returns (track, needs_embedding) per box, in order.
+        Call `set_match` for every track that was embedded.
+        """
+        self.frame_index += 1
+        assigned = self._associate(boxes)
+
+        results = []
+        for box, track in zip(boxes, assigned):
+            if track is None:
+                track = Track(self._next_id, box)
+                self._next_id += 1
+                self.tracks.append(track)
+            track.box = box
+            track.misses = 0
+            results.append((track, self._needs_embedding(track)))
+
+        seen = {id(t) for t, _ in results}
+        for track in self.tracks:
+            if id(track) not in seen:
+                track.misses += 1
+        self.tracks = [t for t in self.tracks if t.misses <= self.max_misses]
+
+        self.faces_seen += len(results)
+        return results
+
+    def set_match(self, track: Track, match: Optional[dict]) -> None:
+        track.match = match
+        track.embed_box = track.box
+        track.last_embed = self.frame_index
+        self.embeddings_computed += 1
@@ -0,0 +1,226 @@
+# lab/wb/workers.py
+"""
+Inference worker pool for the websocket server.
+- Decode, detection, cropping and embedding run in a thread or process pool
+- Thread workers share one set of ONNX sessions (InferenceSession.run is
+  thread-safe) and one detector cascade; process workers each own a set
+- In-flight jobs are bounded; callers wait for a slot instead of queueing forever
+The event loop only does websocket I/O, tracking and the (cheap) gallery match.
+"""
+
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import get_context
+from typing import Dict, List, Optional
+
+import cv2
+import numpy as np
+
+from lab.face.cascade import DetectorCascade
+from lab.face.models_config import (
+    DETECTION_MODE,
+    INFERENCE_POOL_MODE,
+    INFERENCE_QUEUE_SIZE,
+    INFERENCE_WORKERS,
+)
+from lab.face.pipeline import (
+    align_face,
+    create_detection_session,
+    create_embedding_session,
+    create_light_detection_session,
+    crop_faces,
+    detect_faces_batch,
+    get_face_embeddings_batch,
+    warmup_sessions,
+)
+from lab.wb.protocol import decode_crops
+
+# -------------------------------
+# Per-worker state
+# -------------------------------
+_local = threading.local()
+
+
+class _WorkerState:
+    def __init__(self, detection_mode: str, intra_op_threads: int):
+        self.det = create_detection_session(intra_op_threads=intra_op_threads)
+        self.emb = create_embedding_session(intra_op_threads=intra_op_threads)
+        warmup_sessions(self.det, self.emb)
+        self.cascade = None
+        if detection_mode == "cascade":
+            light = create_light_detection_session(intra_op_threads=intra_op_threads)
+            self.cascade = DetectorCascade(light, self.det)
+
+
+def _init_worker(detection_mode: str, intra_op_threads: int) -> None:
+    _local.state = _WorkerState(detection_mode, intra_op_threads)
+
+
+def _use_shared_state(state: _WorkerState) -> None:
+    _local.state = state
+
+
+def _ping() -> int:
+    """No-op job used to spin up (and warm) every worker at startup."""
+    return os.getpid()
+
+
+# -------------------------------
+# Jobs (batched; see lab.wb.batcher)
+# -------------------------------
+class DetectResult:
+    """
+    Per-frame output of `detect_frames`; crops are aligned 112x112 BGR.
+    `timings` holds ms per stage (lab.wb.metrics.STAGES); batch-level stages
+    count in full for every frame of the batch, as each frame waited for them.
+    """
+
+    __slots__ = ("error", "faces", "boxes", "crops", "det_path", "timings")
+
+    def __init__(self, error: Optional[str] = None):
+        self.error = error
+        self.faces = 0
+        self.boxes: List[List[int]] = []
+        self.crops: List[np.ndarray] = []
+        self.det_path = ""
+        self.timings: Dict[str, float] = {}
+
+
+def detect_frames(jpegs: List[bytes]) -> List[DetectResult]:
+    """
+    Decode a batch of JPEG frames (from any connections), detect faces with
+    one batched detector run and return aligned crops for every face.
+    """
+    state = _local.state
+    results = [DetectResult() for _ in jpegs]
+    frames, owners = [], []
+    for i, jpeg in enumerate(jpegs):
+        t0 = time.perf_counter()
+        frame = cv2.imdecode(np.frombuffer(jpeg, dtype=np.uint8), cv2.IMREAD_COLOR)
+        results[i].timings["decode"] = (time.perf_counter() - t0) * 1000.0
+        if frame is None:
+            results[i].error = "decode_failed"
+            continue
+        frames.append(frame)
+        owners.append(i)
+
+    spent: Dict[str, float] = {}  # seconds per stage, whole batch
+    if state.cascade is not None:  # per-frame decisions, cannot batch
+        t0 = time.perf_counter()
+        detections = [state.cascade.detect(frame) for frame in frames]
+        spent["detect"] = time.perf_counter() - t0
+    else:
+        detections = [
+            (boxes, scores, lmks, "single")
+            for boxes, scores, lmks in detect_faces_batch(
+                state.det, frames, timings=spent
+            )
+        ]
+
+    for i, frame, (boxes, _, _, path) in zip(owners, frames, detections):
+        t0 = time.perf_counter()
+        raw = boxes.astype(np.int64).tolist()
+        crops, kept = crop_faces(frame, raw)
+        res = results[i]
+        res.faces = len(raw)
+        res.boxes = kept
+        res.crops = [align_face(crop) for crop in crops]
+        res.det_path = path
+        res.timings["crop"] = (time.perf_counter() - t0) * 1000.0
+        for stage, seconds in spent.items():
+            res.timings[stage] = seconds * 1000.0
+    return results
+
+
+def decode_edge_frame(data: bytes) -> DetectResult:
+    """Edge-client message (crops already detected/aligned) -> DetectResult."""
+    t0 = time.perf_counter()
+    try:
+        msg = decode_crops(data)
+    except ValueError as exc:
+        return DetectResult(f"bad_crop_message: {exc}")
+    res = DetectResult()
+    res.timings["decode"] = (time.perf_counter() - t0) * 1000.0
+    res.faces = len(msg.crops)
+    res.boxes = msg.boxes
+    res.crops = msg.crops
+    res.det_path = "edge"
+    return res
+
+
+def embed_crops(crops: List[np.ndarray]) -> List[np.ndarray]:
+    """Embed aligned face crops (from any connections) in one batched run."""
+    return list(get_face_embeddings_batch(_local.state.emb, crops))
+
+
+# -------------------------------
+# Pool
+# -------------------------------
+class InferencePool:
+    def __init__(
+        self,
+        mode: str = INFERENCE_POOL_MODE,
+        workers: int = INFERENCE_WORKERS,
+        queue_size: int = INFERENCE_QUEUE_SIZE,
+        detection_mode: str = DETECTION_MODE,
+    ):
+        if mode not in ("thread", "process"):
+            raise ValueError(f"Unknown inference pool mode: {mode}")
+        self.mode = mode
+        self.workers = workers or os.cpu_count() or 1
+        # in-flight jobs = running + waiting; beyond that callers block
+        self.capacity = self.workers + max(0, queue_size)
+        self.detection_mode = detection_mode
+        self.in_flight = 0
+        self._executor = None
+        self._slots: Optional[asyncio.Semaphore] = None
+
+    async def start(self) -> None:
+        """Create the executor and spin up/warm every worker before serving."""
+        # split cores between workers so ORT thread pools do not oversubscribe
+        intra = max(1, (os.cpu_count() or 1) // self.workers)
+        init_args = (self.detection_mode, intra)
+        loop = asyncio.get_running_loop()
+        if self.mode == "process":
+            self._executor = ProcessPoolExecutor(
+                self.workers,
+                mp_context=get_context("spawn"),
+                initializer=_init_worker,
+                initargs=init_args,
+            )
+        else:
+            # one copy of the weights for every thread
+            state = await loop.run_in_executor(None, _WorkerState, *init_args)
+            self._executor = ThreadPoolExecutor(
+                self.workers,
+                thread_name_prefix="infer",
+                initializer=_use_shared_state,
+                initargs=(state,),
+            )
+        self._slots = asyncio.Semaphore(self.capacity)
+
+        await asyncio.gather(
+            *[loop.run_in_executor(self._executor, _ping) for _ in range(self.workers)]
+        )
+        sessions = "shared sessions" if self.mode == "thread" else "sessions each"
+        print(
+            f"[INFO] Inference pool ready: {self.workers} {self.mode} worker(s), "
+            f"{sessions} with {intra} ORT thread(s), capacity={self.capacity}"
+        )
+
+    async def run(self, fn, *args):
+        """Run `fn(*args)` on a worker, waiting for a free slot first."""
+        async with self._slots:
+            self.in_flight += 1
+            try:
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(self._executor, fn, *args)
+            finally:
+                self.in_flight -= 1
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)